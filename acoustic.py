@@ -0,0 +1,263 @@
+"""
+シャドーイングの音響的な評価
+
+お手本の読み上げ音声とユーザーの録音からMFCCを求め、DTW（動的時間伸縮）で
+対応付けて、話す速さ（ペース）・リズムのずれ（タイミング）・間の取り方（ポーズ）を採点する。
+文字起こしやLLMを使わず、ローカルで1秒未満で計算できる。
+"""
+import io
+import math
+
+import numpy as np
+from scipy.fft import dct
+from scipy.io import wavfile
+from scipy.signal import resample_poly
+
+FS = 16000
+FRAME_LEN = 400  # 25ミリ秒
+HOP = 160  # 10ミリ秒
+N_FFT = 512
+N_MELS = 40
+N_MFCC = 13
+# 間の長さの違いがこれより短い場合（子音の閉鎖や、対応付けの境目のずれ）は、ポーズの違いとみなさない
+MIN_PAUSE = 0.1
+# 余分な間・抜けた間による減点（1箇所あたりと、間の長さの違い1秒あたり）
+PAUSE_PENALTY = 10.0
+PAUSE_PENALTY_PER_SECOND = 20.0
+
+
+def to_mono(audio):
+    """
+    音声を (モノラルの float32 配列, サンプリングレート) に変換
+    Args:
+        audio: AudioSegment、WAV形式のバイト列/ファイル、または (配列, サンプリングレート)
+    """
+    if isinstance(audio, tuple):
+        samples, fs = audio
+    elif hasattr(audio, "raw_data"):
+        width = audio.sample_width
+        dtype = {1: np.int8, 2: np.int16, 4: np.int32}[width]
+        samples = np.frombuffer(audio.raw_data, dtype=dtype).reshape(-1, audio.channels)
+        samples = samples.astype(np.float32) / float(2 ** (8 * width - 1))
+        fs = audio.frame_rate
+    else:
+        if hasattr(audio, "seek"):
+            audio.seek(0)
+        fs, samples = wavfile.read(audio if hasattr(audio, "read") else io.BytesIO(audio))
+        # 整数のPCMは型の最大値で -1.0〜1.0 に揃える（8ビットは符号なし）
+        if samples.dtype == np.uint8:
+            samples = (samples.astype(np.float32) - 128) / 128
+        elif np.issubdtype(samples.dtype, np.integer):
+            samples = samples.astype(np.float32) / -np.iinfo(samples.dtype).min
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim == 2:
+        samples = samples.mean(axis=1)
+    return samples, fs
+
+
+def mel_filterbank(fs=FS, n_fft=N_FFT, n_mels=N_MELS):
+    """メルフィルタバンク（n_mels, n_fft // 2 + 1）"""
+    def hz_to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700)
+
+    def mel_to_hz(mel):
+        return 700 * (10 ** (mel / 2595) - 1)
+
+    mel_points = np.linspace(hz_to_mel(0), hz_to_mel(fs / 2), n_mels + 2)
+    bins = np.floor((n_fft + 1) * mel_to_hz(mel_points) / fs).astype(int)
+    fbank = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            fbank[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            fbank[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return fbank
+
+
+_FBANK = mel_filterbank()
+_WINDOW = np.hamming(FRAME_LEN).astype(np.float32)
+
+
+def features(samples, fs):
+    """
+    フレームごとのMFCCと対数パワー
+    Args:
+        samples: モノラルの float 音声
+        fs: サンプリングレート
+    Returns:
+        (MFCC (フレーム数, N_MFCC), 対数パワー (フレーム数,))
+    """
+    if fs != FS:
+        g = math.gcd(int(fs), FS)
+        samples = resample_poly(samples, FS // g, int(fs) // g).astype(np.float32)
+    if len(samples) < FRAME_LEN:
+        samples = np.pad(samples, (0, FRAME_LEN - len(samples)))
+    n_frames = 1 + (len(samples) - FRAME_LEN) // HOP
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_LEN)[::HOP][:n_frames] * _WINDOW
+    power = np.abs(np.fft.rfft(frames, n=N_FFT)) ** 2 / N_FFT
+    log_power = 10 * np.log10(power.sum(axis=1) + 1e-10)
+    log_mel = np.log(power @ _FBANK.T + 1e-10)
+    mfcc = dct(log_mel, type=2, axis=1, norm="ortho")[:, :N_MFCC]
+    return mfcc, log_power
+
+
+def silence_mask(log_power, floor_db=35):
+    """ピークから floor_db 以上小さいフレームを無音とみなす"""
+    return log_power < log_power.max() - floor_db
+
+
+def trim(mfcc, silent):
+    """先頭・末尾の無音フレームを除去"""
+    voiced = np.flatnonzero(~silent)
+    if len(voiced) == 0:
+        return mfcc[:0], silent[:0]
+    return mfcc[voiced[0]:voiced[-1] + 1], silent[voiced[0]:voiced[-1] + 1]
+
+
+def runs(mask):
+    """
+    True が続く区間
+    Returns:
+        (開始, 終了) のリスト（終了は含まない）
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def pause_score(ref_pause, rec_pause, path):
+    """
+    間の取り方の採点（余分な間・抜けた間の数と長さに応じて減点）
+
+    経路上でどちらかが無音の区間ごとに、お手本と録音の無音の長さを比べる
+    （DTWは録音の長い間をお手本の短い間に対応付けるため、無音の有無ではなく長さで比べる）。
+    Args:
+        ref_pause: 経路の各点で、お手本が無音か
+        rec_pause: 経路の各点で、録音が無音か
+        path: DTWの経路（(i, j) の配列）
+    Returns:
+        0〜100 の点数
+    """
+    penalty = 0.0
+    for start, end in runs(ref_pause | rec_pause):
+        ref_seconds = len(np.unique(path[start:end, 0][ref_pause[start:end]])) * HOP / FS
+        rec_seconds = len(np.unique(path[start:end, 1][rec_pause[start:end]])) * HOP / FS
+        difference = abs(rec_seconds - ref_seconds)
+        if difference >= MIN_PAUSE:
+            penalty += PAUSE_PENALTY + PAUSE_PENALTY_PER_SECOND * difference
+    return max(0.0, 100.0 - penalty)
+
+
+def dtw(x, y):
+    """
+    DTWによる2つの特徴量系列の対応付け（反対角線ごとにベクトル化）
+    Args:
+        x: (n, 次元数) の特徴量
+        y: (m, 次元数) の特徴量
+    Returns:
+        (経路の (i, j) の配列, 経路長で正規化した累積距離)
+    """
+    n, m = len(x), len(y)
+    # ユークリッド距離の行列
+    cost = np.sqrt(np.maximum(
+        (x * x).sum(axis=1)[:, None] + (y * y).sum(axis=1)[None, :] - 2 * x @ y.T, 0))
+    acc = np.full((n + 1, m + 1), np.inf)
+    acc[0, 0] = 0
+    for d in range(2, n + m + 1):
+        i = np.arange(max(1, d - m), min(n, d - 1) + 1)
+        j = d - i
+        acc[i, j] = cost[i - 1, j - 1] + np.minimum(np.minimum(acc[i - 1, j - 1], acc[i - 1, j]), acc[i, j - 1])
+
+    # 終点から経路をたどる
+    path = []
+    i, j = n, m
+    while i > 0 and j > 0:
+        path.append((i - 1, j - 1))
+        step = np.argmin([acc[i - 1, j - 1], acc[i - 1, j], acc[i, j - 1]])
+        if step == 0:
+            i, j = i - 1, j - 1
+        elif step == 1:
+            i -= 1
+        else:
+            j -= 1
+    path.reverse()
+    path = np.array(path)
+    return path, acc[n, m] / len(path)
+
+
+class AcousticScore:
+    """
+    音響的な評価結果（各スコアは0〜100）
+
+    Attributes:
+        pace: 話す速さがお手本に近いか
+        timing: お手本と比べたリズムのずれの小ささ
+        pause: お手本と同じ箇所で間を取れているか（余分な間・抜けた間の数と長さに応じて減点）
+        pace_ratio: ユーザーの発話時間 / お手本の発話時間
+        timing_deviation: 全体の速さの違いを除いた、時間のずれの平均（秒）
+        distance: DTWの正規化累積距離（小さいほど音が近い）
+    """
+
+    def __init__(self, pace, timing, pause, pace_ratio, timing_deviation, distance):
+        self.pace = pace
+        self.timing = timing
+        self.pause = pause
+        self.pace_ratio = pace_ratio
+        self.timing_deviation = timing_deviation
+        self.distance = distance
+
+    @property
+    def overall(self):
+        return (self.pace + self.timing + self.pause) / 3
+
+    def to_markdown(self):
+        """評価結果の表示用テキスト"""
+        if self.pace_ratio > 1.1:
+            pace_note = "お手本よりゆっくり"
+        elif self.pace_ratio < 0.9:
+            pace_note = "お手本より速め"
+        else:
+            pace_note = "お手本とほぼ同じ"
+        return "\n".join([
+            "【リズム・タイミング】",
+            "",
+            f"- 総合: {self.overall:.0f}点",
+            f"- ペース: {self.pace:.0f}点（{pace_note}、お手本の{self.pace_ratio:.2f}倍の長さ）",
+            f"- タイミング: {self.timing:.0f}点（リズムのずれ 平均{self.timing_deviation:.2f}秒）",
+            f"- ポーズ: {self.pause:.0f}点",
+        ])
+
+
+def score(reference, recording):
+    """
+    お手本の音声とユーザーの録音を比較して採点
+    Args:
+        reference: お手本の音声（to_mono が受け付ける形式）
+        recording: ユーザーの録音（to_mono が受け付ける形式）
+    Returns:
+        AcousticScore（どちらかに発話が含まれない場合は None）
+    """
+    ref_mfcc, ref_power = features(*to_mono(reference))
+    rec_mfcc, rec_power = features(*to_mono(recording))
+    ref_mfcc, ref_silent = trim(ref_mfcc, silence_mask(ref_power))
+    rec_mfcc, rec_silent = trim(rec_mfcc, silence_mask(rec_power))
+    if len(ref_mfcc) < 10 or len(rec_mfcc) < 10:
+        return None
+
+    # 話者や収録環境の違いを打ち消すため、係数ごとに平均を引く
+    ref_norm = ref_mfcc - ref_mfcc.mean(axis=0)
+    rec_norm = rec_mfcc - rec_mfcc.mean(axis=0)
+    path, distance = dtw(ref_norm, rec_norm)
+
+    pace_ratio = len(rec_mfcc) / len(ref_mfcc)
+    pace = 100 * math.exp(-1.7 * abs(math.log(pace_ratio)))
+
+    # 全体の速さの違いを補正した上で、対応付けが対角線からどれだけずれているか
+    expected = path[:, 0] * pace_ratio
+    timing_deviation = float(np.mean(np.abs(path[:, 1] - expected))) * HOP / FS
+    timing = 100 * math.exp(-timing_deviation / 0.3)
+
+    # 対応付けた位置同士で、無音（間）の有無が食い違う箇所
+    pause = pause_score(ref_silent[path[:, 0]], rec_silent[path[:, 1]], path)
+
+    return AcousticScore(pace, timing, pause, pace_ratio, timing_deviation, float(distance))
@@ -0,0 +1,365 @@
+"""
+録音・読み上げ音声の保存（アーカイブ）
+
+音声はセッションごとのディレクトリに、時刻と乱数からなる重複しないファイル名で保存する。
+保存したファイルは索引ファイル（JSONL、追記のみ）に記録し、検索や削除の際に
+ディレクトリを走査しない。別スレッドで定期的に、一定時間が経ったWAVをFLAC（またはOpus）に
+圧縮し、保存期間を過ぎたもの・容量の上限を超えた分を古い順に削除する。
+
+使い方（保存状況の表示・圧縮と削除をすぐに実行）:
+    python audio_archive.py audio --maintain
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from pydub import AudioSegment
+
+import audio_encoding
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# 保存先のディレクトリ（この下に input・output の種類ごと、セッションごとのディレクトリを作る）
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "audio")
+# 古いWAVを圧縮する形式（"flac"・"opus"、"wav" の場合は圧縮しない）
+ARCHIVE_FORMAT = os.environ.get("ARCHIVE_FORMAT", "flac")
+# 保存してからWAVを圧縮するまでの時間（秒）
+ARCHIVE_COMPACT_AFTER = float(os.environ.get("ARCHIVE_COMPACT_AFTER", "3600"))
+# 保存期間（日）
+ARCHIVE_MAX_AGE_DAYS = float(os.environ.get("ARCHIVE_MAX_AGE_DAYS", "30"))
+# 保存する音声の合計サイズの上限（MB）
+ARCHIVE_MAX_MB = float(os.environ.get("ARCHIVE_MAX_MB", "1024"))
+
+INDEX_FILE = "archive_index.jsonl"
+
+
+def _safe_name(name):
+    """ディレクトリ名に使えない文字を置き換える"""
+    name = re.sub(r"[^0-9A-Za-z_.-]", "_", name)[:64]
+    # "." や ".." で親のディレクトリを指さないようにする
+    return re.sub(r"^\.", "_", name) or "default"
+
+
+def _report(future):
+    # 結果を待たない呼び出し元（録音・読み上げ音声の保存、定期的な整理）に代わって、失敗をログに出力
+    error = future.exception()
+    if error is not None:
+        logger.warning("音声の保存・整理に失敗しました", exc_info=error)
+
+
+class AudioArchive:
+    """
+    容量上限・保存期間付きの音声アーカイブ
+
+    ファイルの書き込み・圧縮・削除は1つの別スレッドで順に行い、呼び出し元は待たない。
+
+    Args:
+        root: 保存先のディレクトリ
+        format: 古いWAVを圧縮する形式（"flac"・"opus"・"wav"）
+        compact_after: 保存してから圧縮するまでの時間（秒）
+        max_age: 保存期間（秒）
+        max_bytes: 保存する音声の合計バイト数の上限
+        interval: 圧縮・削除を行う間隔（秒、0 の場合は定期的には行わない）
+    """
+
+    def __init__(self, root=ARCHIVE_DIR, format=ARCHIVE_FORMAT, compact_after=ARCHIVE_COMPACT_AFTER,
+                 max_age=ARCHIVE_MAX_AGE_DAYS * 86400, max_bytes=int(ARCHIVE_MAX_MB * 1024 * 1024), interval=600):
+        if format not in audio_encoding.FORMATS:
+            raise ValueError(f"未対応の形式です: {format}")
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.root / INDEX_FILE
+        self.format = format
+        self.compact_after = compact_after
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 保存した順（古い順）の {ID: 索引の項目}
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._log_lines = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.evicted = 0
+        self.compacted = 0
+        self.bytes_saved = 0
+
+        if self.index_path.exists():
+            self._load()
+        else:
+            self._import_legacy()
+
+        self._stopped = threading.Event()
+        if interval:
+            threading.Thread(target=self._run, args=(interval,), daemon=True).start()
+
+    def _load(self):
+        # 索引の操作ログを順に適用して、現在の状態を復元
+        with open(self.index_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                op = record.pop("op")
+                if op == "add":
+                    self._entries[record["id"]] = record
+                elif op == "update" and record["id"] in self._entries:
+                    self._entries[record["id"]].update(record)
+                elif op == "remove":
+                    self._entries.pop(record["id"], None)
+                self._log_lines += 1
+        self._bytes = sum(entry["bytes"] for entry in self._entries.values())
+
+    def _import_legacy(self):
+        # 索引がない場合のみ、以前の形式（recorded_audio_*_<秒>.wav）のファイルを一度だけ登録
+        files = []
+        for kind in ("input", "output"):
+            for path in (self.root / kind).glob(f"recorded_audio_{kind}_*.wav"):
+                stat = path.stat()
+                files.append((stat.st_mtime, {
+                    "id": f"legacy-{path.stem}",
+                    "kind": kind,
+                    "session": None,
+                    "path": path.relative_to(self.root).as_posix(),
+                    "created": stat.st_mtime,
+                    "bytes": stat.st_size,
+                    "format": "wav",
+                }))
+        for _, entry in sorted(files, key=lambda item: item[0]):
+            self._entries[entry["id"]] = entry
+            self._bytes += entry["bytes"]
+        self._rewrite_index()
+
+    def _append(self, records):
+        # 呼び出し元でロックを取得済み
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._log_lines += len(records)
+
+    def _rewrite_index(self):
+        # 削除・更新の記録が増えたら、現在の項目だけの索引に書き直す
+        temp = self.index_path.with_suffix(".tmp")
+        with open(temp, "w", encoding="utf-8") as f:
+            for entry in self._entries.values():
+                f.write(json.dumps({"op": "add", **entry}, ensure_ascii=False) + "\n")
+        os.replace(temp, self.index_path)
+        self._log_lines = len(self._entries)
+
+    def path(self, entry):
+        """索引の項目のファイルのパス"""
+        return self.root / entry["path"]
+
+    def save(self, kind, data, session=None, extension="wav"):
+        """
+        音声データを別スレッドで保存
+        Args:
+            kind: 種類（"input"・"output"）
+            data: 保存するバイト列
+            session: セッションのID（保存先のディレクトリになる）
+            extension: ファイルの拡張子
+        Returns:
+            索引の項目を返す Future
+        """
+        created = time.time()
+        entry_id = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(created))}-{uuid.uuid4().hex[:8]}"
+        entry = {
+            "id": entry_id,
+            "kind": kind,
+            "session": session,
+            "path": f"{kind}/{_safe_name(session or 'default')}/recorded_audio_{kind}_{entry_id}.{extension}",
+            "created": created,
+            "bytes": len(data),
+            "format": extension,
+        }
+        future = self._executor.submit(self._write, entry, data)
+        future.add_done_callback(_report)
+        return future
+
+    def _write(self, entry, data):
+        path = self.path(entry)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            self._entries[entry["id"]] = entry
+            self._bytes += entry["bytes"]
+            self._append([{"op": "add", **entry}])
+            over = self._bytes > self.max_bytes
+        if over:
+            self._evict(time.time())
+        return entry
+
+    def find(self, session=None, kind=None, since=None):
+        """
+        保存した音声の索引の項目（古い順、ディレクトリは走査しない）
+        Args:
+            session: 指定した場合は、そのセッションのみ
+            kind: 指定した場合は、その種類のみ
+            since: 指定した場合は、その時刻（time.time()）以降に保存したもののみ
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+        return [
+            dict(entry) for entry in entries
+            if (session is None or entry["session"] == session)
+            and (kind is None or entry["kind"] == kind)
+            and (since is None or entry["created"] >= since)
+        ]
+
+    def _remove(self, entries):
+        # 呼び出し元でロックを取得済み
+        for entry in entries:
+            self._entries.pop(entry["id"], None)
+            self._bytes -= entry["bytes"]
+            path = self.path(entry)
+            path.unlink(missing_ok=True)
+            if path.parent.parent != self.root:
+                try:
+                    # セッションのディレクトリが空になったら消す
+                    path.parent.rmdir()
+                except OSError:
+                    pass
+        self.evicted += len(entries)
+        self._append([{"op": "remove", "id": entry["id"]} for entry in entries])
+
+    def _evict(self, now):
+        with self._lock:
+            expired = [entry for entry in self._entries.values() if entry["created"] < now - self.max_age]
+            self._remove(expired)
+            # 容量の上限を超えた分は、古い順に削除
+            oldest, total = [], self._bytes
+            for entry in self._entries.values():
+                if total <= self.max_bytes:
+                    break
+                oldest.append(entry)
+                total -= entry["bytes"]
+            self._remove(oldest)
+            if self._log_lines > 2 * len(self._entries) + 100:
+                self._rewrite_index()
+        return len(expired) + len(oldest)
+
+    def _compact(self, now):
+        if self.format == "wav" or not audio_encoding.HAS_FFMPEG:
+            return 0
+        container, codec, extension = audio_encoding.FORMATS[self.format]
+        with self._lock:
+            targets = [dict(entry) for entry in self._entries.values()
+                       if entry["format"] == "wav" and entry["created"] < now - self.compact_after]
+        compacted = 0
+        for entry in targets:
+            source = self.path(entry)
+            target = source.with_suffix(f".{extension}")
+            parameters = {"codec": codec}
+            if self.format == "opus":
+                parameters["bitrate"] = "32k"
+            try:
+                AudioSegment.from_wav(source).export(target, format=container, **parameters)
+            except Exception:
+                logger.warning("音声の圧縮に失敗しました: %s", source, exc_info=True)
+                target.unlink(missing_ok=True)
+                continue
+            size = target.stat().st_size
+            with self._lock:
+                current = self._entries.get(entry["id"])
+                if current is None:
+                    # 圧縮中に削除された
+                    target.unlink(missing_ok=True)
+                    continue
+                update = {"id": entry["id"], "path": target.relative_to(self.root).as_posix(),
+                          "bytes": size, "format": extension}
+                current.update(update)
+                self._bytes += size - entry["bytes"]
+                self.bytes_saved += entry["bytes"] - size
+                self._append([{"op": "update", **update}])
+            source.unlink(missing_ok=True)
+            compacted += 1
+        self.compacted += compacted
+        return compacted
+
+    def maintain(self, now=None):
+        """
+        古いWAVの圧縮と、保存期間・容量の上限による削除を、別スレッドで実行
+        Returns:
+            (圧縮した数, 削除した数) を返す Future
+        """
+        future = self._executor.submit(self._maintain, now)
+        future.add_done_callback(_report)
+        return future
+
+    def _maintain(self, now=None):
+        now = time.time() if now is None else now
+        with tracing.span("archive.maintain") as attrs:
+            # 削除するものを先に除いてから圧縮する
+            evicted = self._evict(now)
+            compacted = self._compact(now)
+            evicted += self._evict(now)
+            attrs.update(compacted=compacted, evicted=evicted)
+        return compacted, evicted
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            self.maintain()
+
+    def stats(self):
+        """保存している数・合計バイト数（形式ごと）と、圧縮・削除の実績"""
+        with self._lock:
+            by_format = {}
+            for entry in self._entries.values():
+                count, size = by_format.get(entry["format"], (0, 0))
+                by_format[entry["format"]] = (count + 1, size + entry["bytes"])
+            return {
+                "files": len(self._entries),
+                "bytes": self._bytes,
+                "by_format": by_format,
+                "compacted": self.compacted,
+                "evicted": self.evicted,
+                "bytes_saved": self.bytes_saved,
+            }
+
+    def close(self):
+        """定期的な圧縮・削除を止め、書き込み中の保存が終わるまで待つ"""
+        self._stopped.set()
+        self._executor.shutdown(wait=True)
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """プロセス全体で共有する AudioArchive（最初の呼び出し時に索引を読み込む）"""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = AudioArchive()
+        return _archive
+
+
+def main():
+    parser = argparse.ArgumentParser(description="音声アーカイブの保存状況")
+    parser.add_argument("root", nargs="?", default=ARCHIVE_DIR)
+    parser.add_argument("--maintain", action="store_true", help="圧縮と削除をすぐに実行")
+    args = parser.parse_args()
+
+    archive = AudioArchive(args.root, interval=0)
+    if args.maintain:
+        compacted, evicted = archive.maintain().result()
+        print(f"圧縮 {compacted} 件・削除 {evicted} 件")
+    stats = archive.stats()
+    print(f"{stats['files']} 件、{stats['bytes'] / 1024 / 1024:.1f} MB")
+    for format, (count, size) in sorted(stats["by_format"].items()):
+        print(f"  {format:<6}{count:>8} 件{size / 1024 / 1024:>10.1f} MB")
+    archive.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+録音用のキャプチャバッファ
+
+録音ブロックを受け取るたびに16ビット整数へ変換して、あらかじめ確保した
+領域に書き込む。float32 のブロックをリストに溜めて最後に連結・変換する
+方式と比べ、録音全体のコピーを何重にも持たないため、ピークメモリが小さい。
+"""
+import numpy as np
+
+
+class CaptureBuffer:
+    """
+    容量上限付きの int16 キャプチャバッファ
+
+    initial_seconds 分の領域を確保し、不足したら max_seconds まで倍々に拡張する。
+    上限に達した後は、ring=True なら古いデータから上書きし（リングバッファ）、
+    ring=False なら以降の書き込みを捨てて full を True にする。
+
+    Args:
+        fs: サンプリングレート
+        channels: チャンネル数
+        max_seconds: 保持する音声の最大長（秒）
+        initial_seconds: 最初に確保する長さ（秒）
+        ring: 上限到達後に古いデータを上書きするか
+    """
+
+    def __init__(self, fs=48000, channels=2, max_seconds=120, initial_seconds=10, ring=False):
+        self.fs = fs
+        self.channels = channels
+        self.capacity = int(fs * max_seconds)
+        self.ring = ring
+        initial = min(self.capacity, int(fs * initial_seconds))
+        self._data = np.empty((initial, channels), dtype=np.int16)
+        # 次に書き込む位置と、保持しているサンプル数
+        self._pos = 0
+        self._size = 0
+        self.full = False
+        self.dropped = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def duration(self):
+        """保持している音声の長さ（秒）"""
+        return self._size / self.fs
+
+    @property
+    def nbytes(self):
+        """確保済みの領域のバイト数"""
+        return self._data.nbytes
+
+    def _grow(self, needed):
+        new_len = min(self.capacity, max(needed, len(self._data) * 2))
+        if new_len <= len(self._data):
+            return
+        grown = np.empty((new_len, self.channels), dtype=np.int16)
+        grown[:self._size] = self._data[:self._size]
+        self._data = grown
+
+    def _store(self, dst, src):
+        # ブロック単位で16ビット整数に変換（範囲外の値はクリップ）
+        np.clip(src * 32767, -32768, 32767, out=src)
+        dst[...] = src
+
+    def write(self, block):
+        """
+        録音ブロックを書き込む
+        Args:
+            block: (サンプル数, チャンネル数) の float 音声（-1.0〜1.0）
+        Returns:
+            書き込んだサンプル数
+        """
+        block = np.array(block, dtype=np.float32).reshape(-1, self.channels)
+        n = len(block)
+        if n == 0:
+            return 0
+        if self.full and not self.ring:
+            self.dropped += n
+            return 0
+
+        if not self.ring or self._size < self.capacity:
+            if self._pos + n > len(self._data):
+                self._grow(self._pos + n)
+            free = len(self._data) - self._pos
+            if free < n and not self.ring:
+                self.dropped += n - free
+                self.full = True
+                block = block[:free]
+                n = free
+            if self._pos + n <= len(self._data):
+                self._store(self._data[self._pos:self._pos + n], block)
+                self._pos += n
+                self._size += n
+                if self._size == self.capacity:
+                    self.full = True
+                    self._pos %= self.capacity
+                return n
+            # 上限に達したので、残りは先頭から上書きする
+            head = len(self._data) - self._pos
+            self._store(self._data[self._pos:], block[:head])
+            self._size = self.capacity
+            self._pos = 0
+            self.full = True
+            return head + self._write_ring(block[head:])
+
+        return self._write_ring(block)
+
+    def _write_ring(self, block):
+        n = len(block)
+        if n >= self.capacity:
+            # 上限より長いブロックは末尾のみ保持
+            self.dropped += n - self.capacity
+            block = block[-self.capacity:]
+            self._pos = 0
+            n = self.capacity
+        end = self._pos + n
+        if end <= self.capacity:
+            self._store(self._data[self._pos:end], block)
+        else:
+            head = self.capacity - self._pos
+            self._store(self._data[self._pos:], block[:head])
+            self._store(self._data[:end - self.capacity], block[head:])
+        self.dropped += n
+        self._pos = end % self.capacity
+        return n
+
+    def to_array(self):
+        """
+        保持している音声を時系列順の int16 配列として返す
+        Returns:
+            (サンプル数, チャンネル数) の int16 配列（折り返していなければコピーなしのビュー）
+        """
+        if self._size < len(self._data) or self._pos == 0:
+            return self._data[:self._size]
+        return np.concatenate([self._data[self._pos:], self._data[:self._pos]], axis=0)
+
+    def clear(self):
+        """保持している音声を破棄（確保済みの領域は再利用）"""
+        self._pos = 0
+        self._size = 0
+        self.full = False
+        self.dropped = 0
@@ -0,0 +1,100 @@
+"""
+文字起こし用の音声の圧縮
+
+録音は48kHzステレオの16ビットWAV（約190KB/秒）のため、そのまま送ると通信に時間がかかる。
+音声認識には16kHzモノラルで十分なので、モノラル化・ポリフェーズフィルタによる
+リサンプリングを行い、必要に応じてFLAC（可逆）またはOpus（非可逆）に圧縮してから送る。
+"""
+import io
+import math
+import os
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.utils import which
+from scipy.io import wavfile
+from scipy.signal import resample_poly
+
+# 文字起こしに使うサンプリングレート
+UPLOAD_RATE = 16000
+
+# 形式ごとの (pydub に渡す形式, コーデック, ファイル名の拡張子)
+FORMATS = {
+    "wav": ("wav", None, "wav"),
+    "flac": ("flac", "flac", "flac"),
+    "opus": ("ogg", "libopus", "ogg"),
+}
+
+# FLAC・Opus への圧縮には ffmpeg が必要（ない場合は16kHzモノラルのWAVで送る）
+HAS_FFMPEG = which("ffmpeg") is not None or which("avconv") is not None
+
+
+def read_wav(audio):
+    """
+    WAVデータを (サンプリングレート, 配列) として読み込む
+    Args:
+        audio: WAVファイルのパス、またはWAV形式の音声データ（BytesIO など）
+    """
+    if hasattr(audio, "read"):
+        audio.seek(0)
+        fs, samples = wavfile.read(audio)
+        audio.seek(0)
+        return fs, samples
+    return wavfile.read(audio)
+
+
+def downmix_resample(samples, fs, rate=UPLOAD_RATE):
+    """
+    モノラル化し、ポリフェーズフィルタで rate にリサンプリング
+    Args:
+        samples: (サンプル数,) または (サンプル数, チャンネル数) の16ビット整数または float 音声
+        fs: 元のサンプリングレート
+        rate: 変換後のサンプリングレート
+    Returns:
+        16ビット整数のモノラル音声
+    """
+    samples = np.asarray(samples)
+    scale = 32768.0 if samples.dtype == np.int16 else 1.0
+    mono = samples.mean(axis=1) if samples.ndim == 2 else samples.astype(np.float64)
+    if fs != rate:
+        g = math.gcd(int(fs), int(rate))
+        mono = resample_poly(mono, rate // g, int(fs) // g)
+    return np.int16(np.clip(mono / scale, -1, 32767 / 32768) * 32768)
+
+
+def encode(audio, format="flac", rate=UPLOAD_RATE, bitrate="24k"):
+    """
+    文字起こし用に音声を圧縮
+    Args:
+        audio: WAVファイルのパス、またはWAV形式の音声データ（BytesIO など）
+        format: "wav"・"flac"・"opus" のいずれか（ffmpeg がない場合は "wav" として扱う）
+        rate: 変換後のサンプリングレート
+        bitrate: Opus のビットレート
+    Returns:
+        圧縮した音声データ（拡張子付きの name を持つ BytesIO）
+    """
+    if format not in FORMATS:
+        raise ValueError(f"未対応の形式です: {format}")
+    if not HAS_FFMPEG:
+        format = "wav"
+
+    fs, samples = read_wav(audio)
+    mono = downmix_resample(samples, fs, rate)
+
+    buffer = io.BytesIO()
+    container, codec, extension = FORMATS[format]
+    if format == "wav":
+        wavfile.write(buffer, rate, mono)
+    else:
+        segment = AudioSegment(mono.tobytes(), frame_rate=rate, sample_width=2, channels=1)
+        parameters = {"codec": codec}
+        if format == "opus":
+            parameters["bitrate"] = bitrate
+        segment.export(buffer, format=container, **parameters)
+
+    # OpenAI APIはファイル名の拡張子から形式を判定する
+    source = getattr(audio, "name", None) if hasattr(audio, "read") else str(audio)
+    name = os.path.splitext(os.path.basename(source))[0] if source else "recorded_audio_input"
+    buffer.name = f"{name}.{extension}"
+    buffer.seek(0)
+    return buffer
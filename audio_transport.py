@@ -0,0 +1,665 @@
+"""
+音声の入出力（トランスポート）
+
+録音・読み上げの音声を、どこで入出力するかを切り替える。
+    local: サーバーのマイク（sounddevice）とスピーカー（PyAudio）を使う（1台のPCで1人が使う場合）
+    websocket: 各ユーザーのブラウザでマイク・スピーカーを使い、音声はWebSocketでサーバーとやり取りする
+        （1つのプロセスで複数のユーザーが同時に使える）
+
+ブラウザは /audio/<session_id>?token=<token> に接続する（token はセッションごとに生成し、画面に埋め込むHTMLにのみ含める）。
+WebSocketでは、1バイトの種類の後にPCMデータ（16ビット・モノラル、リトルエンディアン）を続けたバイナリメッセージを送る。
+    MIC: ブラウザ → サーバー、16kHzのマイク音声（録音中のみ、20ミリ秒ごと）
+    PLAY: サーバー → ブラウザ、24kHzの読み上げ音声
+    FLUSH: サーバー → ブラウザ、再生待ちの音声を破棄（バージイン）
+    CAPTURE_START / CAPTURE_STOP: サーバー → ブラウザ、マイク音声の送信の開始・停止
+いずれのトランスポートも、record_audio の input_stream と、playback モジュールと同じ
+get_engine() / is_playing() / stop() を持つ。
+"""
+import asyncio
+import hmac
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+import tornado.websocket
+
+import playback
+
+logger = logging.getLogger(__name__)
+
+# 音声の入出力（local / websocket）
+AUDIO_TRANSPORT = os.environ.get("AUDIO_TRANSPORT", "local")
+# WebSocketサーバーのアドレスとポート（Streamlitとは別のポートで待ち受ける）
+# 他のPCのブラウザから使う場合は 0.0.0.0 などを指定する
+AUDIO_WS_HOST = os.environ.get("AUDIO_WS_HOST", "127.0.0.1")
+AUDIO_WS_PORT = int(os.environ.get("AUDIO_WS_PORT", "8510"))
+# ブラウザとの接続が切れたセッションを破棄するまでの時間（秒）
+AUDIO_SESSION_TTL = float(os.environ.get("AUDIO_SESSION_TTL", "600"))
+
+# メッセージの種類（先頭の1バイト）
+MIC = 1
+PLAY = 2
+FLUSH = 3
+CAPTURE_START = 4
+CAPTURE_STOP = 5
+
+# ブラウザから送るマイク音声のサンプリングレート（文字起こしに送る形式と同じ）
+MIC_RATE = 16000
+# 録音中にサーバーが読み込まずに溜められるマイク音声（20ミリ秒のフレーム数）
+MIC_QUEUE_FRAMES = 500
+
+
+class LocalTransport:
+    """サーバーのマイク（sounddevice）とスピーカー（PyAudio、プロセス全体で共有する再生エンジン）"""
+
+    # スピーカーの読み上げ音声がマイクに回り込む
+    echo_cancelled = False
+    # プロセス全体で使い続けるため、破棄されることはない
+    closed = False
+
+    def input_stream(self, samplerate, channels, blocksize=None):
+        # PortAudio はマイクを使う場合のみ読み込む（計測用の代替入力では不要）
+        import sounddevice as sd
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("入力デバイス一覧:\n%s", sd.query_devices())
+        return sd.InputStream(samplerate=samplerate, channels=channels, blocksize=blocksize)
+
+    def get_engine(self):
+        return playback.get_engine()
+
+    def is_playing(self):
+        return playback.is_playing()
+
+    def stop(self):
+        return playback.stop()
+
+    def output(self):
+        """StreamingPlayer などに渡す音声出力"""
+        return playback.EngineOutput()
+
+    def client_html(self):
+        """ブラウザに埋め込むHTML（サーバーで入出力するため不要）"""
+        return None
+
+
+local = LocalTransport()
+
+
+class WebSocketInputStream:
+    """
+    ブラウザから届いたマイク音声を録音ブロックとして返す、sounddevice.InputStream の代替
+
+    16kHzのマイク音声を、指定のサンプリングレート・チャンネル数に線形補間で変換する
+    （文字起こしには16kHzに戻して送るため、変換で失われる情報はない）。
+    timeout 秒以上音声が届かない場合（接続が切れた場合など）は、無音を返して録音を続ける。
+
+    Args:
+        transport: WebSocketTransport
+        samplerate: サンプリングレート
+        channels: チャンネル数
+        blocksize: 1回に読み込むサンプル数（read の引数で指定するため使わない）
+        timeout: 音声が届くのを待つ最大の秒数
+    """
+
+    def __init__(self, transport, samplerate=48000, channels=2, blocksize=None, timeout=1.0):
+        self.transport = transport
+        self.samplerate = samplerate
+        self.channels = channels
+        self.timeout = timeout
+        self._step = MIC_RATE / samplerate
+        self._phase = 0.0
+        self._previous = 0.0
+        self._pending = np.zeros(0, np.float32)
+
+    def __enter__(self):
+        self.transport._start_capture()
+        return self
+
+    def __exit__(self, *exc):
+        self.transport._stop_capture()
+        return False
+
+    def _resample(self, samples):
+        # 前のフレームの最後のサンプルから続けて補間し、フレームの境目で途切れないようにする
+        source = np.concatenate(([self._previous], samples))
+        count = max(0, int(np.ceil((len(samples) - self._phase) / self._step)))
+        positions = self._phase + np.arange(count) * self._step
+        self._phase += count * self._step - len(samples)
+        self._previous = samples[-1]
+        return np.interp(positions, np.arange(len(source)), source).astype(np.float32)
+
+    def read(self, frames):
+        """
+        Returns:
+            (float32 の (frames, channels) の配列, 読み込まれずに失われた音声があったか)
+        """
+        parts, size = [self._pending], len(self._pending)
+        while size < frames:
+            try:
+                samples = self.transport._mic.get(timeout=self.timeout)
+            except queue.Empty:
+                # 音声が届かない間は無音として扱う
+                samples = np.zeros(int((frames - size) * self._step) + 1, np.float32)
+            resampled = self._resample(samples)
+            parts.append(resampled)
+            size += len(resampled)
+        data = np.concatenate(parts)
+        self._pending = data[frames:]
+        overflowed = self.transport._overflowed
+        self.transport._overflowed = False
+        return np.repeat(data[:frames, None], self.channels, axis=1), overflowed
+
+
+class WebSocketBackend:
+    """
+    PlaybackEngine の出力として、音声をブラウザに送る
+
+    AudioServer のスレッドが一定間隔で呼び出し、実時間より lead 秒先までの音声を再生キューから取り出して送る
+    （ブラウザ側ではこの分が再生待ちのバッファになり、通信の揺らぎを吸収する）。
+    無音は送らない。
+
+    Args:
+        transport: WebSocketTransport
+        lead: 実時間より先に送る音声の長さ（秒、バージインで止めた後に聞こえる最大の長さでもある）
+
+    Attributes:
+        written: 送った音声のバイト数
+        latency: 取り出した音声がブラウザで鳴るまでの遅延（秒、ブラウザで再生待ちの音声の長さ）
+    """
+
+    def __init__(self, transport, lead=0.2):
+        self.transport = transport
+        self.lead = lead
+        self.written = 0
+        self.latency = 0.0
+        self._idle = True
+        self._sent_until = 0.0
+
+    def start(self, rate, channels, width, frames_per_buffer, fill):
+        self._rate = rate
+        self._period = frames_per_buffer / rate
+        self._fill = fill
+        self.transport.server._add_backend(self)
+
+    def pump(self, now):
+        # AudioServer のスレッドから呼ばれる
+        if self._idle:
+            # 無音の間は1周期分ずつ取り出し、音声が現れたらすぐに lead 秒分を送る
+            self._sent_until = now
+            target = now + self._period
+        else:
+            target = now + self.lead
+        frames = int((target - self._sent_until) * self._rate)
+        if frames <= 0:
+            return
+        self.latency = max(0.0, self._sent_until - now)
+        data = self._fill(frames)
+        self._sent_until += frames / self._rate
+        if not data.strip(b"\0"):
+            self._idle = True
+            return
+        if self._idle:
+            self._idle = False
+            frames = int((now + self.lead - self._sent_until) * self._rate)
+            if frames > 0:
+                self.latency = max(0.0, self._sent_until - now)
+                data += self._fill(frames)
+                self._sent_until += frames / self._rate
+        self.written += len(data)
+        self.transport.send(PLAY, data)
+
+    def flush(self):
+        """ブラウザで再生待ちの音声も破棄する（PlaybackEngine.stop() から呼ばれる）"""
+        self._idle = True
+        self.transport.send(FLUSH)
+
+    def stop(self):
+        self.transport.server._remove_backend(self)
+
+
+class WebSocketTransport:
+    """
+    1つのセッション（ブラウザのタブ）の音声の入出力
+
+    Args:
+        server: AudioServer
+        session_id: セッションのID（ブラウザは /audio/<session_id> に接続する）
+
+    Attributes:
+        token: ブラウザが接続時に示す、セッションごとのランダムな文字列
+        closed: close() 済みか（AudioServer が破棄したセッションは、get_transport で取得し直す）
+    """
+
+    # ブラウザのマイクはエコーキャンセルを有効にして開く
+    echo_cancelled = True
+
+    def __init__(self, server, session_id):
+        self.server = server
+        self.session_id = session_id
+        self.token = secrets.token_urlsafe(16)
+        self.closed = False
+        self.connected = threading.Event()
+        self.disconnected_at = time.monotonic()
+        self._socket = None
+        self._mic = queue.Queue(maxsize=MIC_QUEUE_FRAMES)
+        self._capturing = False
+        self._overflowed = False
+        self._engine = None
+        self._engine_lock = threading.Lock()
+
+    @property
+    def path(self):
+        """ブラウザの接続先のパス"""
+        return f"/audio/{self.session_id}?token={self.token}"
+
+    def _check_open(self):
+        if self.closed:
+            raise RuntimeError("セッションの音声の入出力は破棄されています。get_transport で取得し直してください。")
+
+    def input_stream(self, samplerate, channels, blocksize=None):
+        self._check_open()
+        return WebSocketInputStream(self, samplerate, channels, blocksize)
+
+    def get_engine(self):
+        """セッションごとの再生エンジン（最初の呼び出し時に生成）"""
+        with self._engine_lock:
+            self._check_open()
+            if self._engine is None:
+                self._engine = playback.PlaybackEngine(WebSocketBackend(self))
+            return self._engine
+
+    def is_playing(self):
+        return self._engine is not None and self._engine.playing
+
+    def stop(self):
+        if self._engine is not None:
+            return self._engine.stop()
+        return 0
+
+    def output(self):
+        """StreamingPlayer などに渡す音声出力"""
+        return playback.EngineOutput(self.get_engine())
+
+    def client_html(self):
+        """ブラウザに埋め込むHTML（streamlit.components.v1.html で表示する）"""
+        return client_html(self.session_id, self.server.port, self.token)
+
+    def send(self, kind, payload=b""):
+        """
+        ブラウザにメッセージを送る（どのスレッドからでも呼べる、接続していない場合は何もしない）
+        Returns:
+            送信を予約した場合は True
+        """
+        socket = self._socket
+        if socket is None:
+            return False
+        self.server.loop.add_callback(_write, socket, bytes([kind]) + payload)
+        return True
+
+    def _start_capture(self):
+        # 録音前に届いていた音声は捨てる
+        while True:
+            try:
+                self._mic.get_nowait()
+            except queue.Empty:
+                break
+        self._overflowed = False
+        self._capturing = True
+        self.send(CAPTURE_START)
+
+    def _stop_capture(self):
+        self._capturing = False
+        self.send(CAPTURE_STOP)
+
+    def _receive(self, payload):
+        if not self._capturing:
+            return
+        samples = np.frombuffer(payload, dtype="<i2").astype(np.float32) / 32768
+        try:
+            self._mic.put_nowait(samples)
+        except queue.Full:
+            self._overflowed = True
+
+    def _attach(self, socket):
+        previous, self._socket = self._socket, socket
+        if previous is not None:
+            previous.close()
+        self.connected.set()
+        if self._capturing:
+            # 録音中に再接続した場合は、マイク音声の送信を再開させる
+            self.send(CAPTURE_START)
+
+    def _detach(self, socket):
+        if self._socket is socket:
+            self._socket = None
+            self.connected.clear()
+            self.disconnected_at = time.monotonic()
+
+    def close(self):
+        """再生エンジンを止め、ブラウザとの接続を閉じる（以降の録音・再生はエラーになる）"""
+        with self._engine_lock:
+            self.closed = True
+        if self._engine is not None:
+            self._engine.close()
+        socket = self._socket
+        if socket is not None:
+            self.server.loop.add_callback(socket.close)
+
+
+def _write(socket, data):
+    try:
+        socket.write_message(data, binary=True)
+    except tornado.websocket.WebSocketClosedError:
+        pass
+
+
+class _AudioSocket(tornado.websocket.WebSocketHandler):
+
+    def initialize(self, server):
+        self.server = server
+        self.transport = None
+
+    def check_origin(self, origin):
+        # Streamlitの画面（ポートが異なる同じホスト）からの接続を許可する
+        return urlparse(origin).hostname == self.request.host_name
+
+    def open(self, session_id):
+        transport = self.server.get(session_id)
+        if transport is None:
+            self.close(4404, "unknown session")
+            return
+        if not hmac.compare_digest(self.get_argument("token", ""), transport.token):
+            self.close(4403, "invalid token")
+            return
+        self.transport = transport
+        self.set_nodelay(True)
+        self.transport._attach(self)
+
+    def on_message(self, message):
+        if self.transport is not None and isinstance(message, bytes) and message[:1] == bytes([MIC]):
+            self.transport._receive(message[1:])
+
+    def on_close(self):
+        if self.transport is not None:
+            self.transport._detach(self)
+
+
+class AudioServer:
+    """
+    ブラウザとの音声のやり取りを行うWebSocketサーバー（別スレッドのイベントループで動かす）
+
+    再生はセッションごとにスレッドを作らず、1つのスレッドが全セッションの再生エンジンから
+    一定間隔で音声を取り出して送る。
+
+    Args:
+        port: 待ち受けるポート（0 の場合は空いているポート）
+        host: 待ち受けるアドレス
+        period: 再生エンジンから音声を取り出す間隔（秒）
+        ttl: ブラウザとの接続が切れたセッションを破棄するまでの時間（秒）
+    """
+
+    def __init__(self, port=AUDIO_WS_PORT, host=AUDIO_WS_HOST, period=0.02, ttl=AUDIO_SESSION_TTL):
+        self.period = period
+        self.ttl = ttl
+        self._transports = {}
+        self._backends = set()
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._running.set()
+        sockets = tornado.netutil.bind_sockets(port, host)
+        self.port = sockets[0].getsockname()[1]
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(sockets, started), daemon=True)
+        self._thread.start()
+        started.wait()
+        self._pump_thread = threading.Thread(target=self._pump, daemon=True)
+        self._pump_thread.start()
+
+    def _serve(self, sockets, started):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        self.loop = tornado.ioloop.IOLoop.current()
+        app = tornado.web.Application([(r"/audio/([0-9A-Za-z_-]+)", _AudioSocket, {"server": self})])
+        self._http = tornado.httpserver.HTTPServer(app)
+        self._http.add_sockets(sockets)
+        started.set()
+        self.loop.start()
+
+    def open(self, session_id):
+        """
+        セッションの音声の入出力を取得（存在しない場合、または破棄済みの場合は作成）
+        Returns:
+            WebSocketTransport
+        """
+        with self._lock:
+            transport = self._transports.get(session_id)
+            if transport is None or transport.closed:
+                transport = self._transports[session_id] = WebSocketTransport(self, session_id)
+            return transport
+
+    def get(self, session_id):
+        """セッションの音声の入出力（open されていない場合は None）"""
+        with self._lock:
+            return self._transports.get(session_id)
+
+    def release(self, session_id):
+        """セッションの音声の入出力を破棄"""
+        with self._lock:
+            transport = self._transports.pop(session_id, None)
+        if transport is not None:
+            transport.close()
+
+    def _add_backend(self, backend):
+        with self._lock:
+            self._backends.add(backend)
+
+    def _remove_backend(self, backend):
+        with self._lock:
+            self._backends.discard(backend)
+
+    def _pump(self):
+        next_at = time.perf_counter()
+        next_sweep = time.monotonic() + self.ttl
+        while self._running.is_set():
+            now = time.perf_counter()
+            with self._lock:
+                backends = list(self._backends)
+            for backend in backends:
+                backend.pump(now)
+            if time.monotonic() >= next_sweep:
+                self._sweep()
+                next_sweep = time.monotonic() + min(self.ttl, 60)
+            next_at = max(next_at + self.period, time.perf_counter() - self.period)
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+
+    def _sweep(self):
+        # ブラウザを閉じたまま戻ってこないセッションを破棄する
+        limit = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [sid for sid, t in self._transports.items() if not t.connected.is_set() and t.disconnected_at < limit]
+        for session_id in expired:
+            self.release(session_id)
+
+    def stats(self):
+        """セッション数・接続中のセッション数・再生中のセッション数"""
+        with self._lock:
+            transports = list(self._transports.values())
+        return {
+            "sessions": len(transports),
+            "connected": sum(t.connected.is_set() for t in transports),
+            "playing": sum(t.is_playing() for t in transports),
+        }
+
+    def close(self):
+        """すべてのセッションを破棄し、サーバーを止める"""
+        with self._lock:
+            session_ids = list(self._transports)
+        for session_id in session_ids:
+            self.release(session_id)
+        self._running.clear()
+        self._pump_thread.join()
+        self.loop.add_callback(self._http.stop)
+        self.loop.add_callback(self.loop.stop)
+        self._thread.join()
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_server():
+    """プロセス全体で共有する AudioServer（最初の呼び出し時にポートを開く）"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = AudioServer()
+        return _server
+
+
+def get_transport(session_id):
+    """
+    セッションの音声の入出力（AUDIO_TRANSPORT に従う）
+    Args:
+        session_id: セッションのID
+    Returns:
+        LocalTransport または WebSocketTransport（破棄されたセッションの場合は作り直したもの）
+    """
+    if AUDIO_TRANSPORT == "websocket":
+        return get_server().open(session_id)
+    return local
+
+
+CLIENT_HTML = """
+<div style="font-family: sans-serif; font-size: 14px;">
+  <button id="start">🎤 マイクとスピーカーを使う</button>
+  <span id="status"></span>
+</div>
+<script>
+const SESSION = "%(session)s", TOKEN = "%(token)s", PORT = %(port)d, MIC_RATE = %(mic_rate)d, PLAY_RATE = %(play_rate)d;
+const MIC = %(mic)d, PLAY = %(play)d, FLUSH = %(flush)d, CAPTURE_START = %(capture_start)d, CAPTURE_STOP = %(capture_stop)d;
+const status = document.getElementById("status");
+
+// マイク音声を16kHz・16ビットに変換し、20ミリ秒ごとにメインスレッドへ渡す
+const WORKLET = `
+class Capture extends AudioWorkletProcessor {
+  constructor() {
+    super();
+    this.step = sampleRate / ${MIC_RATE};
+    this.position = 0; this.sum = 0; this.count = 0;
+    this.frame = new Int16Array(${MIC_RATE / 50}); this.size = 0;
+  }
+  process(inputs) {
+    const input = inputs[0][0];
+    if (!input) return true;
+    for (let i = 0; i < input.length; i++) {
+      // 間引く区間の平均をとる（折り返し雑音を抑える）
+      this.sum += input[i]; this.count++; this.position++;
+      if (this.position < this.step) continue;
+      this.position -= this.step;
+      const value = Math.max(-1, Math.min(1, this.sum / this.count));
+      this.sum = 0; this.count = 0;
+      this.frame[this.size++] = value * 32767;
+      if (this.size === this.frame.length) {
+        this.port.postMessage(this.frame.buffer, [this.frame.buffer]);
+        this.frame = new Int16Array(this.frame.length); this.size = 0;
+      }
+    }
+    return true;
+  }
+}
+registerProcessor("capture", Capture);
+`;
+
+let socket = null, capturing = false, player = null, nextTime = 0, sources = [];
+
+function connect() {
+  // srcdoc のiframe内で動くため、Streamlitの画面のホスト名を使う
+  const page = window.parent.location;
+  socket = new WebSocket(`${page.protocol === "https:" ? "wss" : "ws"}://${page.hostname}:${PORT}/audio/${SESSION}?token=${TOKEN}`);
+  socket.binaryType = "arraybuffer";
+  socket.onopen = () => { status.textContent = "接続しました"; };
+  socket.onclose = (event) => {
+    capturing = false;
+    status.textContent = "接続が切れました。再接続しています…";
+    // 接続が切れている間にセッションが破棄された場合は、画面の再実行で作り直されるまで間隔をあけて試す
+    if (event.code === 4403) status.textContent = "このタブは無効になりました。ページを再読み込みしてください。";
+    else setTimeout(connect, event.code === 4404 ? 5000 : 1000);
+  };
+  socket.onmessage = (event) => {
+    const kind = new Uint8Array(event.data, 0, 1)[0];
+    if (kind === PLAY) play(event.data.slice(1));
+    else if (kind === FLUSH) flush();
+    else if (kind === CAPTURE_START) capturing = true;
+    else if (kind === CAPTURE_STOP) capturing = false;
+  };
+}
+
+function play(data) {
+  const pcm = new Int16Array(data);
+  const buffer = player.createBuffer(1, pcm.length, PLAY_RATE);
+  const channel = buffer.getChannelData(0);
+  for (let i = 0; i < pcm.length; i++) channel[i] = pcm[i] / 32768;
+  const source = player.createBufferSource();
+  source.buffer = buffer;
+  source.connect(player.destination);
+  // 届いた順に隙間なく再生する
+  nextTime = Math.max(nextTime, player.currentTime + 0.03);
+  source.start(nextTime);
+  nextTime += buffer.duration;
+  sources.push(source);
+  source.onended = () => { sources = sources.filter((s) => s !== source); };
+}
+
+function flush() {
+  for (const source of sources) source.stop();
+  sources = [];
+  nextTime = 0;
+}
+
+document.getElementById("start").onclick = async (event) => {
+  event.target.disabled = true;
+  // エコーキャンセルにより、読み上げ中に話し始めても読み上げ音声を拾いにくくなる
+  const stream = await navigator.mediaDevices.getUserMedia(
+    {audio: {channelCount: 1, echoCancellation: true, noiseSuppression: true}});
+  const mic = new AudioContext();
+  await mic.audioWorklet.addModule(URL.createObjectURL(new Blob([WORKLET], {type: "application/javascript"})));
+  const capture = new AudioWorkletNode(mic, "capture");
+  capture.port.onmessage = (message) => {
+    if (!capturing || socket.readyState !== WebSocket.OPEN) return;
+    const frame = new Uint8Array(message.data.byteLength + 1);
+    frame[0] = MIC;
+    frame.set(new Uint8Array(message.data), 1);
+    socket.send(frame);
+  };
+  const mute = mic.createGain();
+  mute.gain.value = 0;
+  mic.createMediaStreamSource(stream).connect(capture).connect(mute).connect(mic.destination);
+  player = new AudioContext({sampleRate: PLAY_RATE});
+  connect();
+};
+</script>
+"""
+
+
+def client_html(session_id, port=AUDIO_WS_PORT, token=""):
+    """
+    ブラウザでマイク・スピーカーを使い、音声をWebSocketでやり取りするHTML
+    （ブラウザの自動再生の制限のため、最初にボタンを押してもらう）
+    Args:
+        session_id: セッションのID
+        port: AudioServer のポート
+        token: セッションの WebSocketTransport.token
+    """
+    return CLIENT_HTML % {
+        "session": session_id, "token": token, "port": port, "mic_rate": MIC_RATE, "play_rate": playback.RATE,
+        "mic": MIC, "play": PLAY, "flush": FLUSH, "capture_start": CAPTURE_START, "capture_stop": CAPTURE_STOP,
+    }
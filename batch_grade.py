@@ -0,0 +1,272 @@
+"""
+録音済みの回答の一括採点（コマンドライン）
+
+マニフェスト（JSONL または CSV）に並べた回答を、画面を使わずにまとめて採点する。
+文字起こしは functions.transcribe、採点はアプリのシャドーイング・ディクテーションと同じく
+scoring.score（単語単位の比較）・acoustic.score（リズム・タイミング）・chains.advise_async（アドバイス）を使う。
+回答は上限付きのスレッドプールで並行して処理し、APIの呼び出しは1分あたりの回数で制限する
+（数えた回数を超えて要求を送らないよう、ヘッジ・再試行は行わない）。
+結果は1件ごとにJSONLへ追記するため、中断しても同じコマンドで続きから再開でき、失敗した回答は再開時にもう一度採点する。
+
+マニフェストの列:
+    id: 回答のID（省略時は行番号）
+    mode: "shadowing"（シャドーイング）または "dictation"（ディクテーション）
+    reference: 問題文
+    audio: 回答の録音ファイル（ディクテーションで answer を指定する場合は不要）
+    answer: 入力された回答文（ディクテーション）
+    reference_audio: お手本の音声ファイル（シャドーイングのリズム・タイミングの採点に使う、省略可）
+
+使い方:
+    python batch_grade.py submissions.jsonl --output results.jsonl --workers 8 --rpm 300
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import acoustic
+import chains
+import functions as func
+import orchestrator
+import scoring
+import tracing
+
+MODES = {
+    "shadowing": "シャドーイング",
+    "dictation": "ディクテーション",
+    "シャドーイング": "シャドーイング",
+    "ディクテーション": "ディクテーション",
+}
+
+# 文字起こしの時間制限（ヘッジ・再試行は RateLimiter で数えない要求を送るため行わず、失敗した回答は再開時に採点し直す）
+STT_POLICY = orchestrator.Policy(timeout=orchestrator.STT.timeout, retries=0, hedge=False)
+
+
+class RateLimiter:
+    """
+    トークンバケットによる呼び出し回数の制限（スレッド間で共有）
+
+    Args:
+        per_minute: 1分あたりの呼び出し回数の上限（0 の場合は制限しない）
+        burst: 連続して呼び出せる回数
+
+    Attributes:
+        waited: 呼び出しの枠が空くまで待った時間の合計（秒、スレッドごとの待ち時間の和）
+    """
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60
+        self.capacity = burst or max(1, per_minute // 60)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self):
+        """呼び出しの枠が空くまで待つ"""
+        if not self.rate:
+            return
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.waited += now - start
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def load_manifest(path):
+    """
+    マニフェストを読み込む
+    Returns:
+        回答の辞書のリスト（相対パスはマニフェストのディレクトリを基準にする）
+    """
+    path = Path(path)
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.suffix == ".csv":
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    items = []
+    for i, row in enumerate(rows, 1):
+        item = {key: value for key, value in row.items() if value not in (None, "")}
+        item["id"] = str(item.get("id", i))
+        mode = item.get("mode", "shadowing")
+        if mode not in MODES:
+            raise ValueError(f"{item['id']}: 未対応のモードです: {mode}")
+        item["mode"] = MODES[mode]
+        for key in ("audio", "reference_audio"):
+            if key in item:
+                item[key] = str(path.parent / item[key])
+        items.append(item)
+    return items
+
+
+def load_checkpoint(path):
+    """採点済み（成功した）回答のIDの集合（失敗した回答は再開時にもう一度採点する）"""
+    done = set()
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if "error" not in record:
+                        done.add(record["id"])
+    return done
+
+
+def read_audio(path):
+    """
+    録音ファイルを読み込む
+    Returns:
+        WAVの場合はバイト列、それ以外は AudioSegment（デコードには ffmpeg が必要）
+    """
+    if Path(path).suffix.lower() == ".wav":
+        return Path(path).read_bytes()
+    from pydub import AudioSegment
+    return AudioSegment.from_file(path)
+
+
+def grade(item, client, limiter, advice=False):
+    """
+    1件の回答を採点（アプリのシャドーイング・ディクテーションと同じ評価）
+    Args:
+        item: マニフェストの1行
+        client: OpenAIクライアント
+        limiter: APIの呼び出しに使う RateLimiter
+        advice: LLMによるアドバイスも生成するか
+    Returns:
+        採点結果の辞書
+    """
+    start = time.perf_counter()
+    record = {"id": item["id"], "mode": item["mode"], "reference": item["reference"]}
+    recording = None
+    if "audio" in item:
+        recording = read_audio(item["audio"])
+        limiter.acquire()
+        if isinstance(recording, bytes):
+            audio = io.BytesIO(recording)
+            audio.name = Path(item["audio"]).name
+            answer = func.transcribe(audio, client, policy=STT_POLICY).text
+        else:
+            # WAV以外は変換せずにそのまま送る
+            answer = func.transcribe(item["audio"], client, format="original", policy=STT_POLICY).text
+    else:
+        answer = item["answer"]
+    record["answer"] = answer
+
+    score = scoring.score(item["reference"], answer)
+    record.update(accuracy=score.accuracy, wer=score.wer, correct=score.correct,
+                  substitutions=score.substitutions, deletions=score.deletions, insertions=score.insertions)
+    markdown = score.to_markdown()
+
+    if item["mode"] == "シャドーイング" and recording is not None and "reference_audio" in item:
+        rhythm = acoustic.score(read_audio(item["reference_audio"]), recording)
+        if rhythm is not None:
+            record.update(rhythm=rhythm.overall, pace=rhythm.pace, timing=rhythm.timing, pause=rhythm.pause)
+            markdown += "\n\n" + rhythm.to_markdown()
+
+    if advice:
+        limiter.acquire()
+        future = chains.advise_async(item["reference"], answer, score)
+        if future is not None:
+            record["advice"] = future.result()
+            markdown += "\n\n" + record["advice"]
+
+    record["markdown"] = markdown
+    record["elapsed"] = time.perf_counter() - start
+    return record
+
+
+def run(items, output, client, workers=4, per_minute=0, advice=False, progress_every=10):
+    """
+    回答をスレッドプールで並行して採点し、1件ごとに output へ追記
+    Args:
+        items: 採点する回答のリスト
+        output: 結果を追記するJSONLファイルのパス
+        client: OpenAIクライアント
+        workers: 同時に採点する数
+        per_minute: APIの1分あたりの呼び出し回数の上限（0 の場合は制限しない）
+        advice: LLMによるアドバイスも生成するか
+        progress_every: この件数ごとに進捗を表示
+    Returns:
+        {"done", "failed", "elapsed", "throughput", "p50", "p95", "rate_wait"}
+    """
+    limiter = RateLimiter(per_minute)
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    latencies, failed = [], 0
+    start = time.perf_counter()
+
+    with open(output, "a", encoding="utf-8") as f, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(grade, item, client, limiter, advice): item for item in items}
+        for i, future in enumerate(as_completed(futures), 1):
+            item = futures[future]
+            try:
+                record = future.result()
+                latencies.append(record["elapsed"])
+            except Exception as e:
+                failed += 1
+                record = {"id": item["id"], "mode": item["mode"], "error": f"{type(e).__name__}: {e}"}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            # 中断しても採点済みの分は残るよう、1件ごとに書き出す
+            f.flush()
+            if i % progress_every == 0 or i == len(items):
+                elapsed = time.perf_counter() - start
+                print(f"{i}/{len(items)} 件（{i / elapsed:.2f} 件/秒、失敗 {failed} 件）", flush=True)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "done": len(items) - failed,
+        "failed": failed,
+        "elapsed": elapsed,
+        "throughput": len(items) / elapsed if elapsed else 0.0,
+        "p50": tracing.percentile(latencies, 50),
+        "p95": tracing.percentile(latencies, 95),
+        "rate_wait": limiter.waited,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="録音済みの回答の一括採点")
+    parser.add_argument("manifest", help="回答の一覧（JSONL または CSV）")
+    parser.add_argument("--output", default="logs/grades.jsonl", help="結果を追記するJSONLファイル（再開時も同じファイルを指定）")
+    parser.add_argument("--workers", type=int, default=4, help="同時に採点する数")
+    parser.add_argument("--rpm", type=int, default=300, help="APIの1分あたりの呼び出し回数の上限（0で制限なし）")
+    parser.add_argument("--advice", action="store_true", help="LLMによるアドバイスも生成する")
+    parser.add_argument("--base-url", help="OpenAI APIの接続先（代替サーバーなど）")
+    args = parser.parse_args()
+
+    # アドバイスも1回の呼び出しにつき1回だけ要求を送る（LLMを生成する前に設定）
+    chains.LLM_MAX_RETRIES = 0
+
+    if args.base_url:
+        # 文字起こし・アドバイスのどちらのクライアントも環境変数の接続先を使う
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "dummy")
+
+    items = load_manifest(args.manifest)
+    done = load_checkpoint(Path(args.output))
+    pending = [item for item in items if item["id"] not in done]
+    print(f"{len(items)} 件中 {len(items) - len(pending)} 件は採点済み、{len(pending)} 件を採点します。")
+    if not pending:
+        return
+
+    stats = run(pending, args.output, chains.get_openai_client(), workers=args.workers,
+                per_minute=args.rpm, advice=args.advice)
+    print(f"{stats['done']} 件を採点、{stats['failed']} 件失敗（{stats['elapsed']:.1f}秒、{stats['throughput']:.2f} 件/秒）")
+    print(f"1件あたり p50 {stats['p50']:.2f}秒・p95 {stats['p95']:.2f}秒、呼び出し回数の制限による待ち {stats['rate_wait']:.1f}秒")
+
+
+if __name__ == "__main__":
+    main()
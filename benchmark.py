@@ -0,0 +1,1179 @@
+"""
+性能計測用スクリプト
+
+使い方:
+    python benchmark.py capture --seconds 180
+    python benchmark.py io --seconds 10
+    python benchmark.py tts --words 40
+    python benchmark.py pipeline
+    python benchmark.py stretch --seconds 10
+    python benchmark.py chains
+    python benchmark.py acoustic --words 25
+    python benchmark.py stt --phrases 3
+    python benchmark.py upload --phrases 3
+    python benchmark.py e2e --turns 3
+    python benchmark.py playback --words 20
+    python benchmark.py memory --turns 20
+    python benchmark.py history --messages 100 1000 10000
+    python benchmark.py tail --requests 100 --slow-rate 0.05
+    python benchmark.py archive --files 2000
+    python benchmark.py batch --items 40 --workers 1 8
+    python benchmark.py transport --sessions 1 10 50
+    python benchmark.py startup --repeat 3 --budget 1.5
+    python benchmark.py bank --problems 300
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+from pathlib import Path
+
+import numpy as np
+
+
+def measure(func, *args, **kwargs):
+    """
+    関数を実行し、実行時間とピークメモリを計測
+    Returns:
+        (戻り値, 実行時間（秒）, ピークメモリ（バイト）)
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def print_row(label, elapsed, peak=None, extra=""):
+    peak_text = f"{peak / 1024 / 1024:9.1f} MB" if peak is not None else " " * 12
+    print(f"{label:<28}{elapsed * 1000:10.1f} ms{peak_text}  {extra}")
+
+
+def synthetic_blocks(seconds, fs=48000, channels=2, blocksize=2400, seed=0):
+    """録音ブロックを模したランダムな float32 ブロックを順に返す"""
+    rng = np.random.default_rng(seed)
+    block = rng.uniform(-0.5, 0.5, (blocksize, channels)).astype(np.float32)
+    for _ in range(int(seconds * fs / blocksize)):
+        # sounddevice は読み込みごとに新しい配列を返すため、毎回コピーを渡す
+        yield block.copy()
+
+
+def bench_capture(args):
+    """録音データの保持方法によるピークメモリの比較"""
+    from audio_buffer import CaptureBuffer
+
+    def list_concat():
+        recorded_audio = []
+        for data in synthetic_blocks(args.seconds, args.fs):
+            recorded_audio.append(data)
+        audio_data = np.concatenate(recorded_audio, axis=0)
+        return np.int16(audio_data * 32767)
+
+    def capture_buffer():
+        buffer = CaptureBuffer(fs=args.fs, channels=2, max_seconds=args.seconds)
+        for data in synthetic_blocks(args.seconds, args.fs):
+            buffer.write(data)
+        return buffer.to_array()
+
+    size = int(args.seconds * args.fs) * 2 * 2
+    print(f"録音 {args.seconds} 秒（int16 の最終サイズ {size / 1024 / 1024:.1f} MB）")
+    for label, func in [("list + concatenate", list_concat), ("CaptureBuffer", capture_buffer)]:
+        _, elapsed, peak = measure(func)
+        print_row(label, elapsed, peak, f"x{peak / size:.2f}")
+
+
+def repeat(func, n):
+    """関数を n 回実行し、実行時間の中央値（秒）を返す"""
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def tts_payload(seconds, format):
+    """TTSの応答を模した音声データ（24kHzモノラルの正弦波）"""
+    from pydub import AudioSegment
+
+    t = np.arange(int(24000 * seconds)) / 24000
+    samples = np.int16(np.sin(2 * np.pi * 220 * t) * 8000)
+    audio = AudioSegment(samples.tobytes(), frame_rate=24000, sample_width=2, channels=1)
+    buffer = io.BytesIO()
+    audio.export(buffer, format=format)
+    return buffer.getvalue()
+
+
+def bench_io(args):
+    """1ターン分の音声処理にかかる時間（ファイル経由とメモリ上での比較）"""
+    from pydub import AudioSegment
+    from scipy.io.wavfile import write
+    import functions as func
+
+    fs = 48000
+    recording = np.int16(np.random.default_rng(0).uniform(-0.5, 0.5, (int(fs * args.seconds), 2)) * 32767)
+    content = tts_payload(args.seconds, args.format)
+    work_dir = Path(tempfile.mkdtemp())
+
+    def file_based():
+        # 録音の保存と、文字起こし時の読み込み
+        file_path = work_dir / "recorded_audio_input.wav"
+        write(file_path, fs, recording)
+        with open(file_path, "rb") as f:
+            f.read()
+        # TTS応答の一時保存・変換・保存
+        temp_file_name = work_dir / "temp.mp3"
+        with open(temp_file_name, "wb") as temp_file:
+            temp_file.write(content)
+        output_file = work_dir / "recorded_audio_output.wav"
+        AudioSegment.from_file(temp_file_name, format=args.format).export(output_file, format="wav")
+        os.remove(temp_file_name)
+        # 再生前の読み込み・一時保存・再読み込み
+        temp_file = work_dir / "temp_modified.wav"
+        AudioSegment.from_wav(output_file).export(temp_file, format="wav")
+        with wave.open(str(temp_file), "rb") as play_target_file:
+            play_target_file.readframes(play_target_file.getnframes())
+        os.remove(temp_file)
+
+    def in_memory():
+        wav_buffer = io.BytesIO()
+        write(wav_buffer, fs, recording)
+        wav_buffer.getvalue()
+        audio = func.save_to_wav(content, format=args.format)
+        audio.raw_data
+
+    print(f"録音 {args.seconds} 秒 / 読み上げ {args.seconds} 秒（{args.format}）")
+    for label, target in [("ファイル経由", file_based), ("メモリ上", in_memory)]:
+        print_row(label, repeat(target, args.repeat))
+
+
+def estimate_tokens(self, messages, tools=None):
+    """メッセージのトークン数の概算（1トークンを約4文字とし、メッセージごとの区切りの分を加える）"""
+    return sum(len(str(message.content)) // 4 + 4 for message in messages)
+
+
+def fake_client(config=None):
+    """
+    代替サーバーを起動し、そこへ接続するOpenAIクライアントを返す
+
+    代替サーバーの音声でアプリの読み上げ音声のキャッシュを汚さないよう、キャッシュの保存先を一時ディレクトリにする。
+    会話履歴の要約で使うトークン数の計算（tiktoken）は、初回にエンコーディングをダウンロードするため、
+    ネットワークなしで動くよう文字数からの概算に置き換える。
+    """
+    from langchain_openai import ChatOpenAI
+    from openai import OpenAI
+    from fake_openai_server import start_server
+    import tts_cache
+
+    tts_cache.TTS_CACHE_DIR = tempfile.mkdtemp()
+    ChatOpenAI.get_num_tokens_from_messages = estimate_tokens
+
+    server, base_url = start_server(config=config)
+    return OpenAI(base_url=base_url, api_key="dummy"), server
+
+
+def bench_tts(args):
+    """読み上げ開始までの時間（一括取得とストリーミングの比較）"""
+    from pydub import AudioSegment
+    from fake_openai_server import FakeConfig
+    import tts_cache
+    import tts_stream
+
+    client, server = fake_client(FakeConfig(latency=args.latency, chunk_delay=args.chunk_delay))
+    # 繰り返しの2回目以降がキャッシュから返らないようにする
+    tts_cache.TTS_CACHE = False
+    text = " ".join(["word"] * args.words)
+
+    def full():
+        start = time.perf_counter()
+        response = client.audio.speech.create(model="tts-1", voice="alloy", input=text, response_format="wav")
+        audio = AudioSegment.from_file(io.BytesIO(response.content), format="wav")
+        output = tts_stream.NullOutput()
+        output.open(audio.frame_rate, audio.channels, audio.sample_width)
+        output.write(audio.raw_data)
+        return output.first_write_at - start
+
+    def streaming():
+        start = time.perf_counter()
+        output = tts_stream.NullOutput()
+        tts_stream.speak_streaming(client, text, output=output)
+        return output.first_write_at - start
+
+    print(f"{args.words} 単語 / 応答遅延 {args.latency} 秒 / チャンク間隔 {args.chunk_delay} 秒")
+    for label, target in [("一括取得", full), ("ストリーミング", streaming)]:
+        first_audio = statistics.median(target() for _ in range(args.repeat))
+        print_row(label, first_audio, extra="（最初の音声まで）")
+    server.shutdown()
+
+
+def fake_chain(base_url, memory_class=None, max_token_limit=500):
+    """
+    代替サーバーに接続する、日常英会話モードと同じ構成の ConversationChain
+    Args:
+        base_url: 代替サーバーの base_url
+        memory_class: 会話履歴のクラス（未指定の場合はアプリと同じ BackgroundSummaryMemory）
+        max_token_limit: 要約せずに保持する会話履歴のトークン数
+    """
+    from langchain.chains import ConversationChain
+    from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+    from langchain.schema import SystemMessage
+    from langchain_openai import ChatOpenAI
+
+    prompt = ChatPromptTemplate.from_messages([
+        SystemMessage(content="You are a conversational English tutor."),
+        MessagesPlaceholder(variable_name="history"),
+        HumanMessagePromptTemplate.from_template("{input}")
+    ])
+    llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.5, base_url=base_url, api_key="dummy")
+    if memory_class is None:
+        from summary_memory import BackgroundSummaryMemory as memory_class
+    memory = memory_class(llm=llm, max_token_limit=max_token_limit, return_messages=True)
+    return ConversationChain(llm=llm, prompt=prompt, memory=memory)
+
+
+def bench_pipeline(args):
+    """日常英会話モードで話し始めるまでの時間（応答全体を待つ場合と文単位の場合の比較）"""
+    from fake_openai_server import FakeConfig
+    import speech_pipeline
+    import tts_cache
+    import tts_stream
+
+    client, server = fake_client(FakeConfig(latency=args.latency, token_delay=args.token_delay))
+    tts_cache.TTS_CACHE = False
+    base_url = str(client.base_url)
+
+    def serial():
+        chain = fake_chain(base_url)
+        output = tts_stream.NullOutput()
+        start = time.perf_counter()
+        reply = chain.predict(input="I go to the mountains last weekend.")
+        tts_stream.speak_streaming(client, reply, output=output)
+        return output.first_write_at - start
+
+    def pipelined():
+        chain = fake_chain(base_url)
+        output = tts_stream.NullOutput()
+        start = time.perf_counter()
+        speech_pipeline.speak_reply(chain, "I go to the mountains last weekend.", client,
+                                    max_workers=args.workers, output=output)
+        return output.first_write_at - start
+
+    print(f"応答遅延 {args.latency} 秒 / 1トークン {args.token_delay} 秒 / 合成の並列数 {args.workers}")
+    for label, target in [("応答全体を待って読み上げ", serial), ("文単位で読み上げ", pipelined)]:
+        first_audio = statistics.median(target() for _ in range(args.repeat))
+        print_row(label, first_audio, extra="（最初の音声まで）")
+    server.shutdown()
+
+
+def bench_stretch(args):
+    """再生速度の変更にかかる、音声1秒あたりの時間"""
+    from pydub import AudioSegment
+    import time_stretch
+
+    rate = 24000
+    t = np.arange(int(rate * args.seconds)) / rate
+    samples = np.int16(np.sin(2 * np.pi * 180 * t) * np.abs(np.sin(np.pi * t / 0.35)) * 8000)
+    audio = AudioSegment(samples.tobytes(), frame_rate=rate, sample_width=2, channels=1)
+
+    def frame_rate_override(speed):
+        modified = audio._spawn(audio.raw_data, overrides={"frame_rate": int(audio.frame_rate * speed)})
+        return modified.set_frame_rate(audio.frame_rate)
+
+    def wsola_blocks(speed):
+        return time_stretch.stretch(samples / 32768, speed, rate=rate, blocksize=4800 // 2)
+
+    print(f"音声 {args.seconds} 秒（24kHzモノラル）、音声1秒あたりの処理時間")
+    for speed in args.speeds:
+        time_stretch.cache = time_stretch.StretchCache()
+        rows = [
+            ("frame_rate 変更（従来）", lambda: frame_rate_override(speed)),
+            ("WSOLA（一括）", lambda: time_stretch.stretch_pcm(audio.raw_data, speed, rate=rate)),
+            ("WSOLA（100msブロック）", lambda: wsola_blocks(speed)),
+        ]
+        time_stretch.stretch_segment(audio, speed)
+        rows.append(("WSOLA（キャッシュ済み）", lambda: time_stretch.stretch_segment(audio, speed)))
+        print(f"速度 {speed}")
+        for label, target in rows:
+            print_row("  " + label, repeat(target, args.repeat) / args.seconds)
+
+
+def bench_chains(args):
+    """1ラウンドあたりのチェーン生成のオーバーヘッド（毎回生成する場合と共有する場合の比較）"""
+    from fake_openai_server import FakeConfig
+    from langchain.chains import ConversationChain
+    from langchain.memory import ConversationSummaryBufferMemory
+    from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+    from langchain.schema import SystemMessage
+    from langchain_openai import ChatOpenAI
+    import chains
+
+    client, server = fake_client(FakeConfig(latency=0, token_delay=0))
+    os.environ["OPENAI_BASE_URL"] = str(client.base_url)
+    os.environ.setdefault("OPENAI_API_KEY", "dummy")
+
+    def build_chain(system_template):
+        prompt = ChatPromptTemplate.from_messages([
+            SystemMessage(content=system_template),
+            MessagesPlaceholder(variable_name="history"),
+            HumanMessagePromptTemplate.from_template("{input}")
+        ])
+        llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.5)
+        memory = ConversationSummaryBufferMemory(llm=llm, max_token_limit=500, return_messages=True)
+        return ConversationChain(llm=llm, prompt=prompt, memory=memory)
+
+    def rebuild_each_round():
+        problem = build_chain(chains.DICTATION_PROBLEM_TEMPLATE).predict(input="")
+        feedback = build_chain(chains.ADVICE_TEMPLATE.format(llm_text=problem, user_text=problem, analysis=""))
+        return feedback.predict(input="")
+
+    problem_chain = chains.create_conversation_chain(chains.DICTATION_PROBLEM_TEMPLATE)
+
+    def shared():
+        problem = problem_chain.predict(input="")
+        return chains.evaluate(chains.ADVICE_TEMPLATE, llm_text=problem, user_text=problem, analysis="")
+
+    print("ディクテーション1ラウンド（問題文の生成＋評価、応答遅延なしの代替サーバー）")
+    for label, target in [("毎回生成", rebuild_each_round), ("共有", shared)]:
+        target()
+        print_row(label, repeat(target, args.repeat))
+    server.shutdown()
+
+
+def learner_recording(reference, speed=1.0, pause=0.0, noise=0.003, fs=48000, seed=0):
+    """
+    お手本の音声から、録音を模したWAVを作成
+    （速度の変更・途中の間・前後の無音・雑音を加え、48kHzステレオにする）
+    """
+    from scipy.signal import resample_poly
+    import time_stretch
+
+    rng = np.random.default_rng(seed)
+    samples = time_stretch.stretch(reference, speed, rate=24000)[:, 0]
+    if pause:
+        middle = len(samples) // 2
+        samples = np.concatenate([samples[:middle], np.zeros(int(24000 * pause)), samples[middle:]])
+    samples = np.concatenate([np.zeros(24000), samples, np.zeros(14400)])
+    samples = resample_poly(samples, fs // 24000, 1) + rng.normal(0, noise, len(samples) * (fs // 24000))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(2)
+        wf.setsampwidth(2)
+        wf.setframerate(fs)
+        wf.writeframes(np.int16(np.clip(np.repeat(samples[:, None], 2, axis=1), -1, 1) * 32767).tobytes())
+    buffer.seek(0)
+    return buffer
+
+
+def bench_acoustic(args):
+    """シャドーイングの音響的な評価にかかる時間と、条件ごとのスコア"""
+    from fake_openai_server import synthesize_pcm
+    from pydub import AudioSegment
+    import acoustic
+
+    pcm = synthesize_pcm(" ".join(["word"] * args.words))
+    reference = AudioSegment(pcm, frame_rate=24000, sample_width=2, channels=1)
+    samples = np.frombuffer(pcm, dtype="<i2") / 32768
+    cases = [
+        ("お手本どおり", learner_recording(samples)),
+        ("ゆっくり（0.8倍速）", learner_recording(samples, speed=0.8)),
+        ("速め（1.25倍速）", learner_recording(samples, speed=1.25)),
+        ("途中で0.6秒の間", learner_recording(samples, pause=0.6)),
+    ]
+
+    print(f"お手本 {len(reference) / 1000:.1f} 秒（{args.words}語、録音は48kHzステレオのWAV）")
+    for label, recording in cases:
+        elapsed = repeat(lambda: acoustic.score(reference, recording), args.repeat)
+        result = acoustic.score(reference, recording)
+        print_row(label, elapsed, extra=(
+            f"ペース {result.pace:3.0f}  タイミング {result.timing:3.0f}  ポーズ {result.pause:3.0f}"
+            f"  （長さ {result.pace_ratio:.2f}倍、ずれ {result.timing_deviation:.2f}秒）"))
+
+
+def utterance(phrases, words=8, pause=0.45, fs=48000, seed=0):
+    """句の間に短い間を挟んだ、発話を模した録音（前後の無音を含む、48kHzステレオの float32）"""
+    from fake_openai_server import synthesize_pcm
+    from scipy.signal import resample_poly
+
+    rng = np.random.default_rng(seed)
+    pcm = np.frombuffer(synthesize_pcm(" ".join(["word"] * words)), dtype="<i2") / 32768
+    parts = [np.zeros(int(24000 * 0.5))]
+    for i in range(phrases):
+        parts += [pcm, np.zeros(int(24000 * (pause if i < phrases - 1 else 1.0)))]
+    samples = resample_poly(np.concatenate(parts), fs // 24000, 1)
+    samples = samples + rng.normal(0, 0.001, len(samples))
+    return np.repeat(samples[:, None], 2, axis=1).astype(np.float32)
+
+
+def bench_stt(args):
+    """話し終えてから文字起こしが揃うまでの時間（録音後に一括で送る場合と、録音しながら区切って送る場合の比較）"""
+    from fake_openai_server import FakeConfig
+    from scipy.io.wavfile import write
+    from streaming_stt import StreamingTranscriber
+    from vad import VoiceActivityDetector
+
+    fs, blocksize = 48000, 2400
+    client, server = fake_client(FakeConfig(latency=args.latency, transcribe_time=args.transcribe_time))
+    samples = utterance(args.phrases)
+
+    def transcribe(audio):
+        # functions.transcribe と同じ呼び出し（functions は再生用の PyAudio を必要とするため使わない）
+        return client.audio.transcriptions.create(model="whisper-1", file=audio)
+
+    def capture(transcriber):
+        """録音を実時間で再現し、ターン終了を検出した時刻と録音データを返す"""
+        vad = VoiceActivityDetector(fs=fs)
+        recorded, start = [], time.perf_counter()
+        for i, offset in enumerate(range(0, len(samples), blocksize)):
+            block = samples[offset:offset + blocksize].copy()
+            # 録音ブロックが届く時刻まで待つ
+            time.sleep(max(0.0, start + (i + 1) * blocksize / fs - time.perf_counter()))
+            recorded.append(block)
+            ended = vad.process(block)
+            if transcriber is not None:
+                transcriber.feed(block, vad)
+            if ended:
+                break
+        return np.concatenate(recorded)
+
+    def whole():
+        recorded = capture(None)
+        ended = time.perf_counter()
+        wav_buffer = io.BytesIO()
+        write(wav_buffer, fs, np.int16(recorded * 32767))
+        wav_buffer.name = "recorded_audio_input.wav"
+        text = transcribe(wav_buffer).text
+        return time.perf_counter() - ended, text, "1区間"
+
+    def streaming():
+        transcriber = StreamingTranscriber(transcribe, fs=fs)
+        capture(transcriber)
+        ended = time.perf_counter()
+        pending = transcriber.pending
+        result = transcriber.finish()
+        return time.perf_counter() - ended, result.text, f"{len(result.segments)}区間（終了時に未完了 {pending}）"
+
+    print(f"発話 {len(samples) / fs:.1f} 秒（{args.phrases}句）、代替サーバー（遅延 {args.latency}秒、音声1秒あたり {args.transcribe_time}秒）")
+    for label, target in [("録音後に一括", whole), ("録音しながら区切って送信", streaming)]:
+        times = []
+        for _ in range(args.repeat):
+            elapsed, text, detail = target()
+            times.append(elapsed)
+        print_row(label, statistics.median(times), extra=f"{len(text.split())}語、{detail}")
+    server.shutdown()
+
+
+def bench_upload(args):
+    """文字起こしに送る音声のサイズと変換時間（録音のままのWAVとの比較）"""
+    from scipy.io.wavfile import write
+    import audio_encoding
+
+    fs = 48000
+    samples = utterance(args.phrases)
+    recorded = io.BytesIO()
+    write(recorded, fs, np.int16(samples * 32767))
+    recorded.name = "recorded_audio_input.wav"
+    seconds = len(samples) / fs
+
+    def upload_time(size):
+        return size * 8 / (args.mbps * 1_000_000)
+
+    print(f"録音 {seconds:.1f} 秒（48kHzステレオ）、送信時間は {args.mbps} Mbps 換算")
+    size = len(recorded.getvalue())
+    print_row("録音のまま（WAV）", 0.0, extra=f"{size / 1024:8.1f} KB  {size / seconds / 1024:6.1f} KB/秒  送信 {upload_time(size):.2f}秒")
+    for format in ["wav", "flac", "opus"]:
+        if format != "wav" and not audio_encoding.HAS_FFMPEG:
+            print(f"{format:<28}（ffmpeg がないため省略）")
+            continue
+        elapsed = repeat(lambda: audio_encoding.encode(recorded, format), args.repeat)
+        size = len(audio_encoding.encode(recorded, format).getvalue())
+        print_row(f"16kHzモノラル（{format}）", elapsed,
+                  extra=f"{size / 1024:8.1f} KB  {size / seconds / 1024:6.1f} KB/秒  送信 {upload_time(size):.2f}秒")
+
+
+def bench_e2e(args):
+    """
+    3つのモードのターン全体を、代替サーバー・代替マイク・無音の出力で再現し、
+    最初の音声までの時間・ターン全体の時間・ピークメモリを計測
+    """
+    from fake_openai_server import FakeConfig
+    from scipy.io.wavfile import write
+
+    client, server = fake_client(FakeConfig(
+        latency=args.latency, chunk_delay=args.chunk_delay, token_delay=args.token_delay,
+        transcribe_time=args.transcribe_time))
+    os.environ["OPENAI_BASE_URL"] = str(client.base_url)
+    os.environ.setdefault("OPENAI_API_KEY", "dummy")
+
+    import acoustic
+    import chains
+    import fake_audio
+    import functions as func
+    import orchestrator
+    import prefetch
+    import scoring
+    import speech_pipeline
+    import tracing
+    import tts_cache
+    from tts_stream import NullOutput
+
+    # 計測に影響するキャッシュ・ファイル保存は無効にする
+    if not args.cache:
+        tts_cache.TTS_CACHE = False
+    func.ARCHIVE_AUDIO = False
+    tracing.tracer.path = None
+
+    fixture = args.fixture
+    if fixture is None:
+        fixture = Path(tempfile.mkdtemp()) / "utterance.wav"
+        write(fixture, 48000, np.int16(utterance(args.phrases) * 32767))
+    realtime = not args.fast
+    client = chains.get_openai_client()
+
+    def record():
+        transcriber = func.create_transcriber(client)
+        audio = func.record_audio(transcriber=transcriber, input_stream=fake_audio.replay(fixture, realtime=realtime))
+        recorded = time.perf_counter()
+        text = transcriber.finish().text if transcriber is not None else func.transcribe(audio, client).text
+        return audio, text, recorded
+
+    def conversation(state):
+        if "chain" not in state:
+            state["chain"] = chains.create_conversation_chain(chains.TUTOR_TEMPLATE)
+        _, text, recorded = record()
+        output = NullOutput(realtime=realtime)
+        if func.TTS_STREAMING:
+            speech_pipeline.speak_reply(state["chain"], text, client, output=output)
+        else:
+            func.speak(state["chain"].predict(input=text), client, output=output)
+        # 話し終えてから、応答の最初の音声まで
+        return output.first_write_at - recorded
+
+    def problem_mode(template, answer_by_voice):
+        def turn(state):
+            if "prefetcher" not in state:
+                problem_chain = chains.create_conversation_chain(template)
+                state["prefetcher"] = prefetch.ProblemPrefetcher(
+                    generate=lambda: problem_chain.predict(input=""),
+                    synthesize=lambda text: func.synthesize(text, client, deadline=orchestrator.Deadline()),
+                    depth=func.PREFETCH_DEPTH
+                )
+            start = time.perf_counter()
+            problem = state["prefetcher"].get()
+            output = NullOutput(realtime=realtime)
+            func.play_wav(problem.audio, output=output)
+            if answer_by_voice:
+                audio, answer, _ = record()
+                acoustic.score(problem.audio, audio)
+            else:
+                answer = problem.text
+            advice = chains.advise_async(problem.text, answer, scoring.score(problem.text, answer))
+            if advice is not None:
+                advice.result()
+            # 問題の準備から、読み上げの最初の音声まで
+            return output.first_write_at - start
+        return turn
+
+    modes = {
+        "日常英会話": conversation,
+        "シャドーイング": problem_mode(chains.SHADOWING_PROBLEM_TEMPLATE, answer_by_voice=True),
+        "ディクテーション": problem_mode(chains.DICTATION_PROBLEM_TEMPLATE, answer_by_voice=False),
+    }
+
+    print(f"代替サーバー（遅延 {args.latency}秒）、{'待ち時間なし' if args.fast else '実時間'}で各モード {args.turns} ターン")
+    print(f"{'':<28}{'最初の音声':>12}{'ターン全体':>12}{'ピーク':>12}")
+    for name in args.modes:
+        state = {}
+        first_audio, totals, peaks = [], [], []
+        for _ in range(args.turns):
+            result, elapsed, peak = measure(modes[name], state)
+            first_audio.append(result)
+            totals.append(elapsed)
+            peaks.append(peak)
+        if "prefetcher" in state:
+            state["prefetcher"].cancel()
+        print(f"{name:<28}{statistics.median(first_audio) * 1000:9.1f} ms{statistics.median(totals) * 1000:9.1f} ms"
+              f"{max(peaks) / 1024 / 1024:9.1f} MB")
+    server.shutdown()
+
+
+def bench_playback(args):
+    """再生中にスクリプトが止まる時間と、バージイン（再生の停止）にかかる時間"""
+    from fake_openai_server import synthesize_pcm
+    from playback import NullBackend, PlaybackEngine
+    from tts_stream import PCM_CHANNELS, PCM_RATE, PCM_WIDTH, NullOutput
+
+    pcm = synthesize_pcm(" ".join(["word"] * args.words))
+    seconds = len(pcm) / (PCM_RATE * PCM_WIDTH)
+
+    def blocking():
+        # 従来の play_wav と同じく、1発話ごとに出力を開き、最後まで書き込んでから閉じる
+        output = NullOutput(realtime=True)
+        output.open(PCM_RATE, PCM_CHANNELS, PCM_WIDTH)
+        for start in range(0, len(pcm), 1024 * PCM_WIDTH):
+            output.write(pcm[start:start + 1024 * PCM_WIDTH])
+        output.close()
+
+    backend = NullBackend(realtime=True)
+    engine = PlaybackEngine(backend)
+
+    print(f"読み上げ {seconds:.1f} 秒（デバイスを開く時間は含まない）")
+    print_row("1発話ごとに書き込み（従来）", repeat(blocking, 1), extra="（再生中はスクリプトが停止）")
+    _, elapsed, _ = measure(engine.play, pcm)
+    print_row("再生エンジンのキューに追加", elapsed)
+    engine.wait()
+
+    # 停止後も出力された音声の長さ（これに加えて、デバイスのバッファ1つ分が聞こえる）
+    delays = []
+    for _ in range(args.repeat):
+        engine.play(pcm)
+        time.sleep(0.3)
+        start = time.perf_counter()
+        engine.stop()
+        elapsed = time.perf_counter() - start
+        written = backend.written
+        time.sleep(0.1)
+        delays.append((backend.written - written) / (PCM_RATE * PCM_WIDTH))
+    buffer_ms = 480 / PCM_RATE * 1000
+    print_row("バージイン（stop() の呼び出し）", elapsed,
+              extra=f"停止後の出力 最大 {max(delays) * 1000:.1f} ms＋バッファ {buffer_ms:.0f} ms")
+    engine.close()
+
+
+def bench_memory(args):
+    """会話履歴の要約による、応答の生成（predict）の待ち時間のばらつき"""
+    import tracing
+    from fake_openai_server import FakeConfig
+    from langchain.memory import ConversationSummaryBufferMemory
+    from summary_memory import BackgroundSummaryMemory
+
+    client, server = fake_client(FakeConfig(latency=args.latency, token_delay=args.token_delay))
+    print(f"{args.turns} ターン（履歴の上限 {args.limit} トークン、応答・要約とも遅延 {args.latency}秒＋生成時間）")
+    for label, memory_class in [("同期で要約（従来）", ConversationSummaryBufferMemory), ("別スレッドで要約", BackgroundSummaryMemory)]:
+        chain = fake_chain(str(client.base_url), memory_class=memory_class, max_token_limit=args.limit)
+        times = []
+        for i in range(args.turns):
+            start = time.perf_counter()
+            chain.predict(input=f"This is my answer number {i}. I went to the park and played tennis with my friends.")
+            times.append(time.perf_counter() - start)
+        if isinstance(chain.memory, BackgroundSummaryMemory):
+            chain.memory.wait()
+        print_row(label, statistics.median(times),
+                  extra=f"p95 {tracing.percentile(times, 95) * 1000:.0f} ms  最大 {max(times) * 1000:.0f} ms")
+    server.shutdown()
+
+
+def bench_history(args):
+    """会話履歴の件数と、再実行ごとに読み込む（表示する）メッセージの量"""
+    from session_store import SessionStore
+
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.messages:
+            store = SessionStore(os.path.join(directory, f"history_{n}.db"))
+            # 他のセッションの履歴も同じファイルに含める
+            sessions = [store.session() for _ in range(2)]
+            start = time.perf_counter()
+            for i in range(n):
+                for session in sessions:
+                    session.add_message("user" if i % 2 == 0 else "assistant", f"This is message number {i}. " * 4, "日常英会話")
+            insert = (time.perf_counter() - start) / (n * len(sessions))
+
+            session = sessions[0]
+            for label, read in [(f"{n}件: 全件を表示（従来）", lambda: session.recent_messages(n)),
+                                (f"{n}件: 直近{args.window}件を表示", lambda: session.window(args.window)[0])]:
+                times = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    messages = read()
+                    times.append(time.perf_counter() - start)
+                print_row(label, statistics.median(times), extra=f"{len(messages)}件（追加 {insert * 1e6:.0f} µs/件）")
+            store.close()
+
+
+def bench_tail(args):
+    """遅延・エラーを混ぜた代替サーバーに対する、音声合成・文字起こしの応答時間の裾（p95・p99）"""
+    from openai import OpenAI
+    from fake_openai_server import FakeConfig, start_server
+    from scipy.io.wavfile import write
+    import functions as func
+    import orchestrator
+    import tracing
+    import tts_stream
+
+    fs = 48000
+    wav_buffer = io.BytesIO()
+    write(wav_buffer, fs, np.int16(utterance(1) * 32767))
+    wav_buffer.name = "recorded_audio_input.wav"
+    text = "Could you tell me how to get to the nearest station from here?"
+
+    def speech(client):
+        # 最初の音声のチャンクが届くまで
+        next(iter(tts_stream.iter_speech_pcm(client, text, cache=False)))
+
+    def transcription(client):
+        func.transcribe(wav_buffer, client, format="original")
+
+    print(f"{args.requests} 回ずつ（遅延 {args.latency}秒、{args.slow_rate:.0%} の要求に +{args.slow_latency}秒、"
+          f"{args.error_rate:.0%} の要求で500エラー）")
+    print(f"{'':<28}{'p50':>9}{'p95':>9}{'p99':>9}{'最大':>9}{'失敗':>6}")
+    for label, protected in [("クライアントの再試行のみ（従来）", False), ("時間制限・再試行・ヘッジ", True)]:
+        print(label)
+        for stage, request in [("speech", speech), ("transcribe", transcription)]:
+            config = FakeConfig(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                                error_rate=args.error_rate, seed=args.seed)
+            server, base_url = start_server(config=config)
+            if protected:
+                client = OpenAI(base_url=base_url, api_key="dummy", timeout=orchestrator.API_TIMEOUT, max_retries=0)
+                policies = {"STT": orchestrator.STT, "TTS": orchestrator.TTS}
+            else:
+                # 従来どおり、OpenAIクライアント既定の再試行（2回）のみで、時間制限・ヘッジなし
+                client = OpenAI(base_url=base_url, api_key="dummy")
+                policies = {"STT": orchestrator.Policy(timeout=600, retries=0),
+                            "TTS": orchestrator.Policy(timeout=600, retries=0)}
+            saved = orchestrator.STT, orchestrator.TTS
+            orchestrator.STT, orchestrator.TTS = policies["STT"], policies["TTS"]
+            orchestrator.reset_stats()
+            times, failures = [], 0
+            try:
+                for _ in range(args.requests):
+                    start = time.perf_counter()
+                    try:
+                        request(client)
+                    except Exception:
+                        failures += 1
+                    times.append(time.perf_counter() - start)
+            finally:
+                orchestrator.STT, orchestrator.TTS = saved
+                server.shutdown()
+            counts = orchestrator.stats().get(stage, {})
+            extra = f"  再試行 {counts.get('retries', 0)}回・ヘッジ {counts.get('hedges', 0)}回" if protected else ""
+            print(f"  {stage:<26}" + "".join(
+                f"{value * 1000:>7.0f}ms" for value in [tracing.percentile(times, q) for q in (50, 95, 99)] + [max(times)]
+            ) + f"{failures:>6}{extra}")
+
+
+def bench_archive(args):
+    """音声アーカイブの保存（ファイル名の重複）・検索・圧縮・容量上限による削除"""
+    from concurrent.futures import ThreadPoolExecutor
+    import audio_encoding
+    from audio_archive import AudioArchive
+    from scipy.io.wavfile import write
+
+    fs = 48000
+    wav_buffer = io.BytesIO()
+    write(wav_buffer, fs, np.int16(utterance(1) * 32767))
+    data = wav_buffer.getvalue()
+    sessions = [f"session{i}" for i in range(args.sessions)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        archive = AudioArchive(directory, max_bytes=int(args.budget_mb * 1024 * 1024), compact_after=0, interval=0)
+        # 複数のセッションから同時に保存（従来の秒単位のファイル名と重複数を比較）
+        start = time.perf_counter()
+        legacy_names = set()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = []
+            for i in range(args.files):
+                legacy_names.add(f"recorded_audio_input_{int(time.time())}.wav")
+                futures.append(executor.submit(archive.save, "input", data, sessions[i % len(sessions)]))
+            entries = [future.result().result() for future in futures]
+        elapsed = time.perf_counter() - start
+        print_row(f"{args.files}件を保存", elapsed / args.files,
+                  extra=f"ファイル名の重複 {args.files - len({entry['path'] for entry in entries})}件"
+                        f"（従来の名前では {args.files - len(legacy_names)}件が上書き）")
+
+        stats = archive.stats()
+        print(f"容量の上限による削除: {stats['evicted']}件（残り {stats['files']}件・"
+              f"{stats['bytes'] / 1024 / 1024:.1f} MB、上限 {args.budget_mb:.0f} MB）")
+
+        start = time.perf_counter()
+        found = archive.find(session=sessions[0])
+        print_row("索引で検索", time.perf_counter() - start, extra=f"{len(found)}件")
+        start = time.perf_counter()
+        listed = list(Path(directory, "input", sessions[0]).glob("*.wav"))
+        print_row("ディレクトリを走査（従来）", time.perf_counter() - start, extra=f"{len(listed)}件")
+
+        if audio_encoding.HAS_FFMPEG:
+            before = archive.stats()["bytes"]
+            start = time.perf_counter()
+            compacted, _ = archive.maintain().result()
+            after = archive.stats()["bytes"]
+            print_row(f"{archive.format}に圧縮", time.perf_counter() - start,
+                      extra=f"{compacted}件 {before / 1024 / 1024:.1f} MB → {after / 1024 / 1024:.1f} MB")
+        else:
+            print("ffmpeg がないため、圧縮は計測しません。")
+        archive.close()
+
+        # 索引の読み込み（再起動時）
+        start = time.perf_counter()
+        reopened = AudioArchive(directory, interval=0)
+        print_row("索引の読み込み", time.perf_counter() - start, extra=f"{reopened.stats()['files']}件")
+        reopened.close()
+
+
+def bench_batch(args):
+    """録音済みの回答の一括採点の処理速度（同時に採点する数ごと）と、中断後の再開"""
+    from fake_openai_server import FakeConfig
+    from scipy.io.wavfile import write
+    import batch_grade
+
+    client, server = fake_client(FakeConfig(latency=args.latency, transcribe_time=args.transcribe_time))
+    reference = "Last weekend I went to the mountains with my friends and we climbed to the top"
+    with tempfile.TemporaryDirectory() as directory:
+        write(os.path.join(directory, "answer.wav"), 48000, np.int16(utterance(args.phrases) * 32767))
+        with open(os.path.join(directory, "manifest.jsonl"), "w", encoding="utf-8") as f:
+            for i in range(args.items):
+                f.write(json.dumps({"id": f"item{i}", "mode": "shadowing", "reference": reference,
+                                    "audio": "answer.wav", "reference_audio": "answer.wav"}) + "\n")
+        items = batch_grade.load_manifest(os.path.join(directory, "manifest.jsonl"))
+        print(f"{args.items} 件（文字起こしの遅延 {args.latency}秒＋音声1秒あたり {args.transcribe_time}秒）")
+        for workers in args.workers:
+            output = os.path.join(directory, f"grades_{workers}.jsonl")
+            with contextlib.redirect_stdout(io.StringIO()):
+                stats = batch_grade.run(items, output, client, workers=workers, per_minute=args.rpm)
+            print_row(f"{workers}並列", stats["elapsed"],
+                      extra=f"{stats['throughput']:.2f} 件/秒  1件あたり p50 {stats['p50']:.2f}秒"
+                            f"  制限による待ち {stats['rate_wait']:.1f}秒  失敗 {stats['failed']}件")
+
+        # 途中で中断した場合（半分だけ採点済み）の再開
+        output = Path(directory, "grades_resume.jsonl")
+        with contextlib.redirect_stdout(io.StringIO()):
+            batch_grade.run(items[:len(items) // 2], output, client, workers=max(args.workers))
+            done = batch_grade.load_checkpoint(output)
+            pending = [item for item in items if item["id"] not in done]
+            batch_grade.run(pending, output, client, workers=max(args.workers))
+        ids = [json.loads(line)["id"] for line in output.read_text(encoding="utf-8").splitlines()]
+        print(f"再開: {len(done)} 件は採点済みのため省略し、残り {len(pending)} 件を採点"
+              f"（結果 {len(ids)} 件、重複 {len(ids) - len(set(ids))} 件）")
+    server.shutdown()
+
+
+def bench_transport(args):
+    """
+    ブラウザの代替を同時に多数接続し、WebSocket経由の録音（ターン終了の検出）と読み上げの送信を計測
+    """
+    import threading
+
+    import audio_transport
+    import fake_browser
+    import functions as func
+    import tracing
+    from fake_openai_server import synthesize_pcm
+    from scipy.io.wavfile import write
+
+    func.ARCHIVE_AUDIO = False
+    tracing.tracer.path = None
+    # 画面のないスレッドから録音の進捗表示を呼ぶことによる警告を抑える
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").addFilter(lambda record: False)
+    pcm = synthesize_pcm(" ".join(["word"] * args.words))
+    reply_seconds = len(pcm) / (audio_transport.playback.RATE * audio_transport.playback.WIDTH)
+    fixture = Path(tempfile.mkdtemp()) / "utterance.wav"
+    write(fixture, 48000, np.int16(utterance(args.phrases) * 32767))
+
+    print(f"1セッションあたり 発話 {len(utterance(args.phrases)) / 48000:.1f}秒の録音と、読み上げ {reply_seconds:.1f}秒の再生"
+          "（録音の終了は話し終えてからの無音の待ち 0.6秒を含む）")
+    print(f"{'':<16}{'録音の終了 p50':>16}{'p95':>10}{'読み上げの受信':>16}{'CPU':>8}{'ターン全体':>12}")
+    for sessions in args.sessions:
+        server = audio_transport.AudioServer(port=0, host="127.0.0.1")
+        transports = [server.open(f"bench{i}") for i in range(sessions)]
+        browsers = fake_browser.start([f"ws://127.0.0.1:{server.port}{t.path}" for t in transports], fixture)
+        delays, received = [None] * sessions, [0.0] * sessions
+
+        def turn(i):
+            func.record_audio(transport=transports[i], archive=False, barge_in=False)
+            delays[i] = time.perf_counter() - browsers[i].speech_ended_at
+            engine = transports[i].get_engine()
+            engine.play(pcm)
+            engine.wait()
+            # ブラウザに送り終えるまで（実時間より lead 秒先まで送るため、再生し終える前に届く）
+            deadline = time.perf_counter() + 2
+            while browsers[i].played < len(pcm) and time.perf_counter() < deadline:
+                time.sleep(0.01)
+            received[i] = browsers[i].played / len(pcm)
+
+        start, cpu = time.perf_counter(), time.process_time()
+        threads = [threading.Thread(target=turn, args=(i,)) for i in range(sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+        print(f"{sessions:>4} セッション   {statistics.median(delays) * 1000:10.1f} ms"
+              f"{tracing.percentile(delays, 95) * 1000:7.1f} ms{min(received) * 100:14.1f} %"
+              f"{cpu / elapsed * 100:6.1f} %{elapsed:10.2f} 秒")
+        server.close()
+
+
+# 新しいプロセスで main.py を画面なしで実行し、最初の実行（最初の画面）と再実行の時間を計測する
+FIRST_PAINT_SCRIPT = """
+import json, os, sys, time
+sys.path.insert(0, os.getcwd())
+from streamlit.testing.v1 import AppTest
+import startup
+app = AppTest.from_file("main.py", default_timeout=120)
+start = time.perf_counter()
+app.run()
+first = time.perf_counter() - start
+# 再実行は重いモジュールの読み込みが終わった後（ユーザーが操作するころ）に計測する
+startup.wait()
+start = time.perf_counter()
+app.run()
+rerun = time.perf_counter() - start
+print(json.dumps({"first": first, "rerun": rerun, "preload": startup.elapsed}))
+"""
+
+
+def run_fresh(code, env=None):
+    """新しいPythonプロセスでコードを実行し、最後の行の出力を返す"""
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def bench_startup(args):
+    """モジュールの読み込み時間と、最初の画面を表示するまでの時間（いずれも新しいプロセスで計測）"""
+    import startup
+
+    def import_time(modules):
+        code = f"import time\nstart = time.perf_counter()\nimport {', '.join(modules)}\nprint(time.perf_counter() - start)"
+        return statistics.median(float(run_fresh(code)) for _ in range(args.repeat))
+
+    print(f"新しいプロセスで {args.repeat} 回ずつ計測した中央値")
+    print_row("streamlit の読み込み", import_time(["streamlit"]))
+    print_row("最初の画面に必要なモジュール", import_time(["streamlit", "tracing", "orchestrator", "audio_transport", "session_store", "startup"]))
+    print_row("重いモジュール（別スレッドで読み込む）", import_time(["streamlit", *startup.HEAVY_MODULES]))
+
+    # 会話履歴は保存せず、APIキーがなくても最初の画面は表示できることを確かめる
+    env = {key: value for key, value in os.environ.items() if key != "OPENAI_API_KEY"}
+    env["HISTORY_DB"] = ""
+    runs = [json.loads(run_fresh(FIRST_PAINT_SCRIPT, env)) for _ in range(args.repeat)]
+    first = statistics.median(run["first"] for run in runs)
+    print_row("最初の画面（main.py の最初の実行）", first)
+    print_row("再実行", statistics.median(run["rerun"] for run in runs))
+    print_row("重いモジュールの事前読み込み", statistics.median(run["preload"] for run in runs), extra="（画面の表示後、別スレッドで）")
+    if args.budget and first > args.budget:
+        raise SystemExit(f"最初の画面の表示に {first:.2f}秒かかりました（上限 {args.budget:.2f}秒）。")
+
+
+def bench_bank(args):
+    """問題集からの出題（索引の検索・音声の取り出し）と、問題の準備から最初の音声までの時間（その場での生成との比較）"""
+    from fake_openai_server import FakeConfig, synthesize_pcm
+
+    import chains
+    import functions as func
+    import prefetch
+    import problem_bank
+    import tts_cache
+    from tts_stream import NullOutput
+
+    client, server = fake_client(FakeConfig(latency=args.latency, token_delay=args.token_delay))
+    os.environ["OPENAI_BASE_URL"] = str(client.base_url)
+    os.environ.setdefault("OPENAI_API_KEY", "dummy")
+    tts_cache.TTS_CACHE = False
+    func.ARCHIVE_AUDIO = False
+    rng = np.random.default_rng(0)
+    words = "we could meet after work to talk about the project and plan our weekend trip together".split()
+
+    with tempfile.TemporaryDirectory() as directory:
+        writer = problem_bank.BankWriter(directory)
+        cells = [(length, register, difficulty) for length in problem_bank.LENGTHS
+                 for register in problem_bank.REGISTERS for difficulty in problem_bank.DIFFICULTIES]
+        _, elapsed, _ = measure(lambda: [
+            writer.add(" ".join(rng.choice(words, problem_bank.LENGTHS[cell[0]][0])) + f" {i}.",
+                       synthesize_pcm(" ".join(["word"] * problem_bank.LENGTHS[cell[0]][0])), *cell)
+            for i, cell in zip(range(args.problems), itertools.cycle(cells))
+        ])
+        writer.close()
+        size = os.path.getsize(os.path.join(directory, problem_bank.PCM_FILE))
+        print(f"問題集 {args.problems} 問（PCMファイル {size / 1024 / 1024:.1f} MB）")
+        print_row("作成（合成済みの音声の書き込み）", elapsed)
+
+        _, elapsed, peak = measure(problem_bank.ProblemBank, directory)
+        bank = problem_bank.ProblemBank(directory)
+        print_row("索引の読み込み", elapsed, peak)
+        _, elapsed, peak = measure(bank.deck, "short", "business", 2)
+        print_row("条件での検索（長さ・話し方・難易度）", elapsed, peak)
+        deck = bank.deck("long")
+        times = []
+        for _ in range(min(args.draws, deck.remaining)):
+            _, elapsed, peak = measure(deck.next)
+            times.append(elapsed)
+        print_row("1問の取り出し（中央値）", statistics.median(times), peak, extra="（メモリは1問分の音声のみ）")
+
+        # 問題の準備から、読み上げの最初の音声まで（問題集の場合はAPIを呼び出さない）
+        def first_audio(use_bank):
+            calls = []
+            problem_chain = chains.create_conversation_chain(chains.SHADOWING_PROBLEM_TEMPLATE)
+
+            def generate():
+                calls.append("chat")
+                return problem_chain.predict(input="")
+
+            def synthesize(text):
+                calls.append("speech")
+                return func.synthesize(text, client)
+
+            start = time.perf_counter()
+            prefetcher = prefetch.ProblemPrefetcher(generate, synthesize, depth=1,
+                                                    bank=bank.deck("long") if use_bank else None)
+            problem = prefetcher.get()
+            calls_before_audio = len(calls)
+            output = NullOutput(realtime=True)
+            func.play_wav(problem.audio, output=output)
+            prefetcher.cancel()
+            return output.first_write_at - start, calls_before_audio
+
+        for label, use_bank in [("その場で生成（従来）", False), ("問題集から出題", True)]:
+            first, calls = first_audio(use_bank)
+            print_row(label, first, extra=f"（最初の音声まで、APIの呼び出し {calls} 回）")
+        bank.close()
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成AI英会話アプリの性能計測")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    capture = subparsers.add_parser("capture", help="録音バッファのメモリ使用量")
+    capture.add_argument("--seconds", type=float, default=180)
+    capture.add_argument("--fs", type=int, default=48000)
+    capture.set_defaults(func=bench_capture)
+
+    io_parser = subparsers.add_parser("io", help="1ターン分の音声I/Oの時間")
+    io_parser.add_argument("--seconds", type=float, default=10)
+    io_parser.add_argument("--format", default="mp3", help="TTS応答の形式（ffmpegが無い環境では wav）")
+    io_parser.add_argument("--repeat", type=int, default=5)
+    io_parser.set_defaults(func=bench_io)
+
+    tts = subparsers.add_parser("tts", help="読み上げ開始までの時間")
+    tts.add_argument("--words", type=int, default=40)
+    tts.add_argument("--latency", type=float, default=0.3)
+    tts.add_argument("--chunk-delay", type=float, default=0.05)
+    tts.add_argument("--repeat", type=int, default=3)
+    tts.set_defaults(func=bench_tts)
+
+    pipeline = subparsers.add_parser("pipeline", help="LLM応答の読み上げ開始までの時間")
+    pipeline.add_argument("--latency", type=float, default=0.3)
+    pipeline.add_argument("--token-delay", type=float, default=0.03)
+    pipeline.add_argument("--workers", type=int, default=3)
+    pipeline.add_argument("--repeat", type=int, default=3)
+    pipeline.set_defaults(func=bench_pipeline)
+
+    stretch = subparsers.add_parser("stretch", help="再生速度の変更にかかる時間")
+    stretch.add_argument("--seconds", type=float, default=10)
+    stretch.add_argument("--speeds", type=float, nargs="+", default=[0.6, 0.8, 1.2, 1.5, 2.0])
+    stretch.add_argument("--repeat", type=int, default=3)
+    stretch.set_defaults(func=bench_stretch)
+
+    chains_parser = subparsers.add_parser("chains", help="チェーン生成のオーバーヘッド")
+    chains_parser.add_argument("--repeat", type=int, default=20)
+    chains_parser.set_defaults(func=bench_chains)
+
+    acoustic_parser = subparsers.add_parser("acoustic", help="シャドーイングの音響的な評価の時間")
+    acoustic_parser.add_argument("--words", type=int, default=25)
+    acoustic_parser.add_argument("--repeat", type=int, default=5)
+    acoustic_parser.set_defaults(func=bench_acoustic)
+
+    stt = subparsers.add_parser("stt", help="話し終えてから文字起こしが揃うまでの時間")
+    stt.add_argument("--phrases", type=int, default=3)
+    stt.add_argument("--latency", type=float, default=0.3)
+    stt.add_argument("--transcribe-time", type=float, default=0.1)
+    stt.add_argument("--repeat", type=int, default=2)
+    stt.set_defaults(func=bench_stt)
+
+    upload = subparsers.add_parser("upload", help="文字起こしに送る音声のサイズと変換時間")
+    upload.add_argument("--phrases", type=int, default=3)
+    upload.add_argument("--mbps", type=float, default=1.0, help="送信時間の換算に使う回線速度")
+    upload.add_argument("--repeat", type=int, default=5)
+    upload.set_defaults(func=bench_upload)
+
+    e2e = subparsers.add_parser("e2e", help="各モードのターン全体（最初の音声・ターン時間・メモリ）")
+    e2e.add_argument("--modes", nargs="+", default=["日常英会話", "シャドーイング", "ディクテーション"])
+    e2e.add_argument("--turns", type=int, default=3)
+    e2e.add_argument("--fixture", help="ユーザーの発話として再生するWAVファイル（未指定の場合は合成音声）")
+    e2e.add_argument("--phrases", type=int, default=2)
+    e2e.add_argument("--latency", type=float, default=0.3)
+    e2e.add_argument("--chunk-delay", type=float, default=0.05)
+    e2e.add_argument("--token-delay", type=float, default=0.03)
+    e2e.add_argument("--transcribe-time", type=float, default=0.1)
+    e2e.add_argument("--fast", action="store_true", help="録音・再生を実時間で待たない")
+    e2e.add_argument("--cache", action="store_true", help="TTSキャッシュを有効にする")
+    e2e.set_defaults(func=bench_e2e)
+
+    playback_parser = subparsers.add_parser("playback", help="再生によるスクリプトの停止時間とバージインの速さ")
+    playback_parser.add_argument("--words", type=int, default=20)
+    playback_parser.add_argument("--repeat", type=int, default=10)
+    playback_parser.set_defaults(func=bench_playback)
+
+    memory = subparsers.add_parser("memory", help="会話履歴の要約による応答の待ち時間")
+    memory.add_argument("--turns", type=int, default=20)
+    memory.add_argument("--limit", type=int, default=500)
+    memory.add_argument("--latency", type=float, default=0.3)
+    memory.add_argument("--token-delay", type=float, default=0.01)
+    memory.set_defaults(func=bench_memory)
+
+    history = subparsers.add_parser("history", help="会話履歴の件数と再実行ごとの読み込み量")
+    history.add_argument("--messages", type=int, nargs="+", default=[100, 1000, 10000])
+    history.add_argument("--window", type=int, default=20)
+    history.add_argument("--repeat", type=int, default=20)
+    history.set_defaults(func=bench_history)
+
+    tail = subparsers.add_parser("tail", help="遅延・エラーを混ぜた場合の応答時間の裾")
+    tail.add_argument("--requests", type=int, default=100)
+    tail.add_argument("--latency", type=float, default=0.2)
+    tail.add_argument("--slow-rate", type=float, default=0.05)
+    tail.add_argument("--slow-latency", type=float, default=5.0)
+    tail.add_argument("--error-rate", type=float, default=0.02)
+    tail.add_argument("--seed", type=int, default=0)
+    tail.set_defaults(func=bench_tail)
+
+    archive = subparsers.add_parser("archive", help="音声アーカイブの保存・検索・圧縮・削除")
+    archive.add_argument("--files", type=int, default=2000)
+    archive.add_argument("--sessions", type=int, default=20)
+    archive.add_argument("--budget-mb", type=float, default=200)
+    archive.set_defaults(func=bench_archive)
+
+    batch = subparsers.add_parser("batch", help="録音済みの回答の一括採点の処理速度")
+    batch.add_argument("--items", type=int, default=40)
+    batch.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    batch.add_argument("--rpm", type=int, default=0, help="APIの1分あたりの呼び出し回数の上限（0で制限なし）")
+    batch.add_argument("--phrases", type=int, default=2)
+    batch.add_argument("--latency", type=float, default=0.3)
+    batch.add_argument("--transcribe-time", type=float, default=0.1)
+    batch.set_defaults(func=bench_batch)
+
+    transport = subparsers.add_parser("transport", help="ブラウザとのWebSocketによる音声の入出力（同時セッション数ごと）")
+    transport.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50])
+    transport.add_argument("--phrases", type=int, default=2)
+    transport.add_argument("--words", type=int, default=20)
+    transport.set_defaults(func=bench_transport)
+
+    startup_parser = subparsers.add_parser("startup", help="モジュールの読み込み時間と最初の画面の表示までの時間")
+    startup_parser.add_argument("--repeat", type=int, default=3)
+    startup_parser.add_argument("--budget", type=float, default=0, help="最初の画面の表示時間の上限（秒、超えたら失敗、0で確認しない）")
+    startup_parser.set_defaults(func=bench_startup)
+
+    bank = subparsers.add_parser("bank", help="問題集からの出題の時間とメモリ")
+    bank.add_argument("--problems", type=int, default=300)
+    bank.add_argument("--draws", type=int, default=50)
+    bank.add_argument("--latency", type=float, default=0.3)
+    bank.add_argument("--token-delay", type=float, default=0.03)
+    bank.set_defaults(func=bench_bank)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+LLM・チェーンの生成
+
+HTTPクライアント・OpenAIクライアント・LLMはプロセス全体で1つずつ生成し、
+セッションや再実行をまたいで共有する（接続もプール内で再利用される）。
+評価用のチェーンも共有し、問題文や回答文はプロンプトの入力として渡す。
+"""
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import streamlit as st
+from langchain.chains import ConversationChain
+from langchain.prompts import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    MessagesPlaceholder,
+    SystemMessagePromptTemplate,
+)
+from langchain.schema import SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_openai import ChatOpenAI
+from openai import DefaultHttpxClient, OpenAI
+
+import orchestrator
+import tracing
+from summary_memory import BackgroundSummaryMemory
+
+TUTOR_TEMPLATE = """
+    You are a conversational English tutor. Engage in a natural and free-flowing conversation with the user. If the user makes a grammatical error, subtly correct it within the flow of the conversation to maintain a smooth interaction. Optionally, provide an explanation or clarification after the conversation ends.
+    """
+
+DICTATION_PROBLEM_TEMPLATE = """
+    Generate 1 sentence that reflect natural English used in daily conversations, workplace, and social settings:
+    - Casual conversational expressions
+    - Polite business language
+    - Friendly phrases used among friends
+    - Sentences with situational nuances and emotions
+    - Expressions reflecting cultural and regional contexts
+
+    Limit your response to an English sentence of approximately 15 words.
+    # Make each sentence 10-15 words long with clear and understandable context.
+    """
+
+SHADOWING_PROBLEM_TEMPLATE = """
+    Generate 1 sentence that reflect natural English used in daily conversations, workplace, and social settings:
+    - Casual conversational expressions
+    - Polite business language
+    - Friendly phrases used among friends
+    - Sentences with situational nuances and emotions
+    - Expressions reflecting cultural and regional contexts
+
+    Make each sentence 20-30 words long with clear and understandable context.
+    """
+
+# 問題集（problem_bank）用に、話し方・難易度・長さを指定して問題文をまとめて生成する
+BANK_PROBLEM_TEMPLATE = """
+    Generate {count} different English sentences for listening and speaking practice:
+    - Register: {register}
+    - Difficulty: {difficulty}
+    - Cover varied situations in daily conversations, workplace, and social settings
+    - Make each sentence {min_words}-{max_words} words long with clear and understandable context.
+
+    Output one sentence per line, without numbering or any other text.
+    """
+
+# 問題集の難易度ごとの、問題文の語彙・文法の説明
+BANK_DIFFICULTIES = {
+    1: "easy (common everyday vocabulary and simple grammar)",
+    2: "intermediate (some idioms, phrasal verbs and compound sentences)",
+    3: "advanced (less common vocabulary, idioms and complex grammar)",
+}
+
+# 生成された問題文の行頭の箇条書きの記号・番号
+LIST_MARKER = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+
+ADVICE_TEMPLATE = """
+    あなたは英語学習の専門家です。
+    以下の「LLMによる問題文」と「ユーザーによる回答文」、および単語単位の比較結果をもとに、次回の練習のためのアドバイスを提供してください：
+
+    【LLMによる問題文】
+    問題文：{llm_text}
+
+    【ユーザーによる回答文】
+    回答文：{user_text}
+
+    【単語単位の比較結果】
+    {analysis}
+
+    比較結果の一覧はユーザーに表示済みのため繰り返さず、文法的な正確性や文の完成度、聞き取りのポイントに絞ってください。
+    フィードバックは以下のフォーマットで日本語で提供してください：
+
+    【アドバイス】 # ここで改行を入れる
+    次回の練習のためのポイント
+
+    ユーザーの努力を認め、前向きな姿勢で次の練習に取り組めるような励ましのコメントを含めてください。
+    """
+
+# 単語単位の比較結果に加えて、LLMによるアドバイスを生成するか
+LLM_ADVICE = os.environ.get("LLM_ADVICE", "1") == "1"
+# LLMのクライアント側の再試行回数（最初に get_llm() を呼ぶ前に設定する）
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+
+_advice_executor = ThreadPoolExecutor(max_workers=4)
+
+
+class TracedConversationChain(ConversationChain):
+    """predict の実行時間を記録する ConversationChain"""
+
+    def predict(self, callbacks=None, **kwargs):
+        with tracing.span("chain.predict"):
+            return super().predict(callbacks=callbacks, **kwargs)
+
+
+@st.cache_resource
+def get_http_client():
+    """OpenAIへの接続をプールするHTTPクライアント（プロセス全体で共有）"""
+    return DefaultHttpxClient(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+
+
+@st.cache_resource
+def get_openai_client():
+    """音声認識・音声合成用のOpenAIクライアント（プロセス全体で共有）"""
+    # 再試行は orchestrator で行うため、クライアント側では再試行しない
+    return OpenAI(api_key=os.environ["OPENAI_API_KEY"], http_client=get_http_client(),
+                  timeout=orchestrator.API_TIMEOUT, max_retries=0)
+
+
+@st.cache_resource
+def get_llm(model_name="gpt-4o-mini", temperature=0.5):
+    """LLM（プロセス全体で共有）"""
+    # 応答の生成は会話履歴に書き込むためヘッジせず、制限時間とクライアント側の再試行のみ設定
+    return ChatOpenAI(model_name=model_name, temperature=temperature, http_client=get_http_client(),
+                      timeout=orchestrator.API_TIMEOUT, max_retries=LLM_MAX_RETRIES)
+
+
+@st.cache_resource
+def get_conversation_prompt(system_template):
+    """会話履歴付きのプロンプト"""
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=system_template),
+        MessagesPlaceholder(variable_name="history"),
+        HumanMessagePromptTemplate.from_template("{input}")
+    ])
+
+
+def create_conversation_chain(system_template, max_token_limit=500):
+    """
+    会話履歴付きのチェーンを生成（LLMとプロンプトは共有し、会話履歴のみセッションごとに生成）
+    Args:
+        system_template: システムプロンプト
+        max_token_limit: 要約せずに保持する会話履歴のトークン数（古い履歴の要約は応答後に別スレッドで行う）
+    """
+    llm = get_llm()
+    memory = BackgroundSummaryMemory(
+        llm=llm,
+        max_token_limit=max_token_limit,
+        return_messages=True
+    )
+    return TracedConversationChain(
+        llm=llm,
+        prompt=get_conversation_prompt(system_template),
+        memory=memory
+    )
+
+
+def restore_history(chain, messages):
+    """
+    保存されていた会話をチェーンの会話履歴に戻す（再起動後にセッションを再開する場合）
+    Args:
+        chain: create_conversation_chain で生成したチェーン
+        messages: {"role", "content"} のリスト（古い順）
+    """
+    for message in messages:
+        if message["role"] == "user":
+            chain.memory.chat_memory.add_user_message(message["content"])
+        else:
+            chain.memory.chat_memory.add_ai_message(message["content"])
+    # 上限を超えた分は、別スレッドで要約に取り込む
+    chain.memory.prune()
+
+
+@st.cache_resource
+def get_feedback_chain(system_template):
+    """
+    評価用のチェーン（プロセス全体で共有、問題文・回答文は入力として渡す）
+    Args:
+        system_template: {llm_text} と {user_text} を含むシステムプロンプト
+    """
+    prompt = ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(system_template),
+        HumanMessagePromptTemplate.from_template("{input}")
+    ])
+    return prompt | get_llm() | StrOutputParser()
+
+
+def evaluate(system_template, llm_text, user_text, **inputs):
+    """
+    問題文と回答文をもとにした評価・アドバイスを生成
+    Args:
+        system_template: 評価用のシステムプロンプト
+        llm_text: 問題文
+        user_text: ユーザーによる回答文
+        inputs: その他のプロンプトへの入力
+    """
+    return get_feedback_chain(system_template).invoke({
+        "llm_text": llm_text,
+        "user_text": user_text,
+        "input": "",
+        **inputs
+    })
+
+
+def generate_problems(register, difficulty, min_words, max_words, count):
+    """
+    問題集用の問題文をまとめて生成
+    Args:
+        register: 話し方（"casual" または "business"）
+        difficulty: 難易度（BANK_DIFFICULTIES のキー）
+        min_words: 1文の最小の単語数
+        max_words: 1文の最大の単語数
+        count: 生成する文の数
+    Returns:
+        問題文のリスト（番号・記号は取り除く）
+    """
+    # 評価用と同じ構成（システムプロンプト＋空の入力）のチェーンで生成する
+    text = get_feedback_chain(BANK_PROBLEM_TEMPLATE).invoke({
+        "register": register,
+        "difficulty": BANK_DIFFICULTIES[difficulty],
+        "min_words": min_words,
+        "max_words": max_words,
+        "count": count,
+        "input": ""
+    })
+    # 行頭の箇条書きの記号・番号（"- " や "1. " など）のみ取り除き、文頭の数字（"3 people ..." など）は残す
+    sentences = [LIST_MARKER.sub("", line).strip() for line in text.splitlines()]
+    return [sentence for sentence in sentences if sentence]
+
+
+def advise_async(llm_text, user_text, score, deadline=None):
+    """
+    単語単位の比較結果をもとにしたアドバイスの生成を、別スレッドで開始
+    Args:
+        llm_text: 問題文
+        user_text: ユーザーによる回答文
+        score: scoring.ScoreResult
+        deadline: ターンの持ち時間（未指定の場合は呼び出し元のスレッドの持ち時間）
+    Returns:
+        アドバイスの文字列を返す Future（LLM_ADVICE が無効の場合は None、持ち時間内に生成できなかった場合の結果は None）
+    """
+    if not LLM_ADVICE:
+        return None
+    # キャッシュと持ち時間の参照はスクリプトのスレッドで行い、LLMの呼び出しのみ別スレッドで実行
+    chain = get_feedback_chain(ADVICE_TEMPLATE)
+    deadline = deadline or orchestrator.current_deadline()
+
+    def invoke(inputs):
+        with tracing.span("chain.advice"):
+            try:
+                return orchestrator.call("advice", lambda: chain.invoke(inputs), orchestrator.LLM, deadline=deadline)
+            except orchestrator.StageTimeout:
+                return None
+
+    return _advice_executor.submit(tracing.bind(invoke), {
+        "llm_text": llm_text,
+        "user_text": user_text,
+        "analysis": score.summary(),
+        "input": ""
+    })
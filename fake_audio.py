@@ -0,0 +1,113 @@
+"""
+マイクの代替入力（テスト・計測用）
+
+sounddevice.InputStream の代わりに、WAVファイルなどの音声を録音ブロックとして順に返す。
+マイク・スピーカー・PortAudio のない環境でも、録音からのターン全体を再現できる。
+
+使い方:
+    speech_audio = func.record_audio(input_stream=fake_audio.replay("fixtures/hello.wav"))
+"""
+import functools
+import math
+import time
+
+import numpy as np
+from scipy.io import wavfile
+from scipy.signal import resample_poly
+
+
+def load(source, samplerate, channels):
+    """
+    音声を録音と同じ形式（float32、(サンプル数, チャンネル数)）に変換
+    Args:
+        source: WAVファイルのパス、または (配列, サンプリングレート)
+        samplerate: 変換後のサンプリングレート
+        channels: 変換後のチャンネル数
+    """
+    if isinstance(source, tuple):
+        samples, fs = source
+    else:
+        fs, samples = wavfile.read(source)
+    samples = np.asarray(samples)
+    if samples.dtype == np.int16:
+        samples = samples.astype(np.float32) / 32768
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    if fs != samplerate:
+        g = math.gcd(int(fs), int(samplerate))
+        samples = resample_poly(samples, samplerate // g, int(fs) // g, axis=0)
+    # チャンネル数を合わせる（モノラルは複製、それ以外は平均）
+    if samples.shape[1] != channels:
+        samples = np.repeat(samples.mean(axis=1, keepdims=True), channels, axis=1)
+    return samples.astype(np.float32)
+
+
+class FakeInputStream:
+    """
+    音声を録音ブロックとして返す、sounddevice.InputStream の代替
+
+    音声を返し終えた後は、弱い雑音（無音）を返し続ける。
+
+    Args:
+        samplerate: サンプリングレート
+        channels: チャンネル数
+        blocksize: 1回に読み込むサンプル数
+        source: WAVファイルのパス、または (配列, サンプリングレート)
+        realtime: 実際の録音と同じ間隔でブロックを返すか（False の場合は待たずに返す）
+        noise: 音声の後に続ける雑音の大きさ（RMS）
+    """
+
+    def __init__(self, samplerate=48000, channels=2, blocksize=2400, source=None, realtime=True, noise=0.001):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.realtime = realtime
+        self.noise = noise
+        self._samples = load(source, samplerate, channels) if source is not None else np.zeros((0, channels), np.float32)
+        self._position = 0
+        self._rng = np.random.default_rng(0)
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def exhausted(self):
+        """音声をすべて返し終えたか"""
+        return self._position >= len(self._samples)
+
+    def read(self, frames):
+        """
+        次のブロックを返す
+        Returns:
+            (float32 の (frames, チャンネル数) 配列, オーバーフローしたか)
+        """
+        start = self._position
+        self._position += frames
+        data = self._samples[start:self._position]
+        if len(data) < frames:
+            tail = self._rng.normal(0, self.noise, (frames - len(data), self.channels)).astype(np.float32)
+            data = np.concatenate([data, tail])
+        else:
+            data = data.copy()
+        if self.realtime:
+            if self._started is None:
+                self._started = time.perf_counter() - start / self.samplerate
+            # このブロックの録音が終わる時刻まで待つ
+            time.sleep(max(0.0, self._started + self._position / self.samplerate - time.perf_counter()))
+        return data, False
+
+
+def replay(source, realtime=True, noise=0.001):
+    """
+    record_audio の input_stream に渡す、音声を再生する代替入力
+    Args:
+        source: WAVファイルのパス、または (配列, サンプリングレート)
+        realtime: 実際の録音と同じ間隔でブロックを返すか
+        noise: 音声の後に続ける雑音の大きさ（RMS）
+    """
+    return functools.partial(FakeInputStream, source=source, realtime=realtime, noise=noise)
@@ -0,0 +1,122 @@
+"""
+ブラウザの代替（テスト・計測用）
+
+audio_transport の WebSocket に接続し、ブラウザと同じメッセージをやり取りする。
+録音の開始（CAPTURE_START）を受け取ると、指定の音声を20ミリ秒ごとのフレームとして実時間で送り、
+その後は録音の停止（CAPTURE_STOP）まで弱い雑音を送り続ける。読み上げ音声（PLAY）は受け取った量と時刻を記録する。
+1つのスレッドのイベントループで、多数のブラウザを同時に動かせる。
+
+使い方:
+    browsers = fake_browser.start([f"ws://127.0.0.1:8510{t.path}" for t in transports], "fixtures/hello.wav")
+"""
+import asyncio
+import threading
+import time
+
+import numpy as np
+import tornado.websocket
+
+import fake_audio
+from audio_transport import CAPTURE_START, CAPTURE_STOP, FLUSH, MIC, MIC_RATE, PLAY
+
+FRAME = MIC_RATE // 50
+
+
+class FakeBrowser:
+    """
+    1つのブラウザのタブ
+
+    Args:
+        url: 接続先（ws://.../audio/<session_id>?token=<token>）
+        source: 録音のたびに送る音声（WAVファイルのパス、または (配列, サンプリングレート)）
+        noise: 音声の後に送る雑音の大きさ（RMS）
+
+    Attributes:
+        connected: 接続したときにセットされる
+        speech_ended_at: 最後の録音で、音声の最後の発話部分を送り終えた時刻（time.perf_counter()）
+        captures: 録音の回数
+        played: 受け取った読み上げ音声のバイト数
+        first_play_at: 最初に読み上げ音声を受け取った時刻
+        last_play_at: 最後に読み上げ音声を受け取った時刻
+        flushes: 再生待ちの音声の破棄（バージイン）を受け取った回数
+        sent: 送ったマイク音声のフレーム数
+    """
+
+    def __init__(self, url, source, noise=0.001):
+        self.url = url
+        samples = fake_audio.load(source, MIC_RATE, 1)[:, 0]
+        self._frames = [samples[i:i + FRAME] for i in range(0, len(samples) - FRAME + 1, FRAME)]
+        # 末尾の無音を除いた、最後の発話のフレーム
+        voiced = [i for i, frame in enumerate(self._frames) if np.sqrt(np.mean(frame ** 2)) > 0.01]
+        self._last_voiced = voiced[-1] if voiced else len(self._frames) - 1
+        self._noise = noise
+        self._rng = np.random.default_rng(0)
+        self.connected = threading.Event()
+        self.speech_ended_at = None
+        self.captures = 0
+        self.played = 0
+        self.first_play_at = None
+        self.last_play_at = None
+        self.flushes = 0
+        self.sent = 0
+        self._capture = None
+
+    async def run(self):
+        connection = await tornado.websocket.websocket_connect(self.url)
+        self.connected.set()
+        while True:
+            message = await connection.read_message()
+            if message is None:
+                break
+            kind = message[0]
+            if kind == PLAY:
+                now = time.perf_counter()
+                if self.first_play_at is None:
+                    self.first_play_at = now
+                self.last_play_at = now
+                self.played += len(message) - 1
+            elif kind == FLUSH:
+                self.flushes += 1
+            elif kind == CAPTURE_START:
+                self.captures += 1
+                self.speech_ended_at = None
+                self._capture = asyncio.ensure_future(self._speak(connection))
+            elif kind == CAPTURE_STOP and self._capture is not None:
+                self._capture.cancel()
+                self._capture = None
+        self.connected.clear()
+
+    async def _speak(self, connection):
+        # ブラウザのマイクと同じく、20ミリ秒ごとに1フレームずつ送る
+        start = time.perf_counter()
+        index = 0
+        while True:
+            if index < len(self._frames):
+                frame = self._frames[index]
+            else:
+                frame = self._rng.normal(0, self._noise, FRAME)
+            pcm = np.int16(np.clip(frame, -1, 1) * 32767).astype("<i2").tobytes()
+            await connection.write_message(bytes([MIC]) + pcm, binary=True)
+            if index == self._last_voiced:
+                self.speech_ended_at = time.perf_counter()
+            self.sent += 1
+            index += 1
+            await asyncio.sleep(max(0.0, start + index * FRAME / MIC_RATE - time.perf_counter()))
+
+
+def start(urls, source, noise=0.001):
+    """
+    ブラウザを別スレッドのイベントループで起動し、すべて接続するまで待つ
+    Returns:
+        FakeBrowser のリスト（urls と同じ順）
+    """
+    browsers = [FakeBrowser(url, source, noise) for url in urls]
+    loop = asyncio.new_event_loop()
+
+    async def run_all():
+        await asyncio.gather(*(browser.run() for browser in browsers), return_exceptions=True)
+
+    threading.Thread(target=loop.run_until_complete, args=(run_all(),), daemon=True).start()
+    for browser in browsers:
+        browser.connected.wait(10)
+    return browsers
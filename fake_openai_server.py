@@ -0,0 +1,274 @@
+"""
+ローカルで動くOpenAI APIの代替サーバー（テスト・計測用）
+
+実際のAPIを呼ばずに、応答の遅延やストリーミングの速度を再現する。
+
+使い方:
+    python fake_openai_server.py --port 8765 --latency 0.3 --chunk-delay 0.05
+
+    client = OpenAI(base_url="http://127.0.0.1:8765/v1", api_key="dummy")
+"""
+import argparse
+import io
+import json
+import random
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class FakeConfig:
+    """
+    代替サーバーの挙動の設定
+
+    Args:
+        latency: 応答の最初のバイトを返すまでの待ち時間（秒）
+        chunk_delay: ストリーミング時のチャンク間の待ち時間（秒）
+        chunk_size: ストリーミング時のチャンクのバイト数
+        seconds_per_word: 読み上げ音声の長さ（1単語あたりの秒数）
+        reply: チャットの応答文
+        token_delay: チャットの応答の1トークン（単語）あたりの生成時間（秒）
+        transcript: 文字起こしの結果として返す文（発話の長さに応じた単語数だけ先頭から使う）
+        transcribe_time: 音声1秒あたりの文字起こしにかかる時間（秒）
+        slow_rate: 応答が大きく遅れる要求の割合（裾の遅延の再現）
+        slow_latency: 遅れる要求に加える待ち時間（秒）
+        error_rate: 500エラーを返す要求の割合
+        seed: 遅延・エラーを選ぶ乱数のシード
+    """
+
+    def __init__(self, latency=0.3, chunk_delay=0.05, chunk_size=4800, seconds_per_word=0.35,
+                 reply=None, token_delay=0.03, transcript=None, transcribe_time=0.1,
+                 slow_rate=0.0, slow_latency=5.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.seconds_per_word = seconds_per_word
+        self.reply = reply or (
+            "That sounds like a wonderful weekend. "
+            "Did you go hiking with your friends or by yourself? "
+            "By the way, we say \"I went to the mountains\", not \"I go to the mountains\". "
+            "What was the best part of the trip?"
+        )
+        self.token_delay = token_delay
+        self.transcript = transcript or (
+            "Last weekend I went to the mountains with my friends and we climbed to the top "
+            "where the view was amazing so we stayed there until the sunset and took a lot of pictures"
+        )
+        self.transcribe_time = transcribe_time
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def inject(self):
+        """
+        要求ごとに加える遅延とエラーを選ぶ
+        Returns:
+            (追加の待ち時間, エラーを返すか)
+        """
+        with self._lock:
+            slow = self._random.random() < self.slow_rate
+            error = self._random.random() < self.error_rate
+        return (self.slow_latency if slow else 0.0), error
+
+
+def synthesize_pcm(text, seconds_per_word=0.35, rate=24000):
+    """テキストの単語数に応じた長さの、発話を模したPCMデータ（16ビット・モノラル）"""
+    n_words = max(1, len(text.split()))
+    t = np.arange(int(rate * seconds_per_word * n_words)) / rate
+    # 単語ごとに音量が上下する、声の高さ程度の正弦波
+    envelope = np.abs(np.sin(np.pi * t / seconds_per_word))
+    samples = np.sin(2 * np.pi * 180 * t) * envelope * 8000
+    return samples.astype("<i2").tobytes()
+
+
+def pcm_to_wav(pcm, rate=24000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def speech_seconds(wav, frame_ms=20, threshold=0.01):
+    """音声データのうち、音量が閾値を超えるフレームの合計秒数と、全体の秒数"""
+    if wav[:4] == b"RIFF":
+        with wave.open(io.BytesIO(wav), "rb") as wav_file:
+            rate = wav_file.getframerate()
+            channels = wav_file.getnchannels()
+            frames = wav_file.readframes(wav_file.getnframes())
+    else:
+        # FLAC・Opus などは ffmpeg でデコード
+        from pydub import AudioSegment
+        audio = AudioSegment.from_file(io.BytesIO(wav)).set_sample_width(2)
+        rate, channels, frames = audio.frame_rate, audio.channels, audio.raw_data
+    samples = np.frombuffer(frames, dtype="<i2").reshape(-1, channels).mean(axis=1) / 32768
+    frame_len = int(rate * frame_ms / 1000)
+    n_frames = len(samples) // frame_len
+    rms = np.sqrt(np.mean(samples[:n_frames * frame_len].reshape(n_frames, frame_len) ** 2, axis=1))
+    return np.count_nonzero(rms > threshold) * frame_ms / 1000, len(samples) / rate
+
+
+def multipart_file(body, content_type):
+    """multipart/form-data から file フィールドの内容を取り出す"""
+    boundary = content_type.split("boundary=")[1].strip('"').encode()
+    for part in body.split(b"--" + boundary):
+        headers, _, content = part.partition(b"\r\n\r\n")
+        if b'name="file"' in headers:
+            return content[:-2] if content.endswith(b"\r\n") else content
+    return None
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_chunked(self, chunks, content_type, delay=True):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, chunk in enumerate(chunks):
+                if i and delay and self.config.chunk_delay:
+                    time.sleep(self.config.chunk_delay)
+                self.wfile.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # ヘッジで使われなかった応答などは、クライアントが途中で閉じる
+            self.close_connection = True
+
+    def send_json(self, obj):
+        data = json.dumps(obj).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        delay, error = self.config.inject()
+        time.sleep(self.config.latency + delay)
+        if error:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_error(500)
+            return
+        if self.path.endswith("/audio/speech"):
+            self.handle_speech(self.read_json())
+        elif self.path.endswith("/chat/completions"):
+            self.handle_chat(self.read_json())
+        elif self.path.endswith("/audio/transcriptions"):
+            self.handle_transcription()
+        else:
+            self.send_error(404)
+
+    def handle_chat(self, body):
+        model = body.get("model", "gpt-4o-mini")
+        # 単語ごとに1トークンとして、生成にかかる時間を再現
+        tokens = [word + " " for word in self.config.reply.split(" ")]
+        tokens[-1] = tokens[-1].rstrip()
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": model}
+
+        if not body.get("stream"):
+            time.sleep(self.config.token_delay * len(tokens))
+            self.send_json({
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": self.config.reply}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+            return
+
+        def events():
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(self.config.token_delay)
+                delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+                chunk = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n".encode()
+            last = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(last)}\n\n".encode()
+            yield b"data: [DONE]\n\n"
+
+        self.send_chunked(events(), "text/event-stream", delay=False)
+
+    def handle_transcription(self):
+        length = int(self.headers.get("Content-Length", 0))
+        wav = multipart_file(self.rfile.read(length), self.headers.get("Content-Type", ""))
+        if wav is None:
+            self.send_error(400)
+            return
+        speech, duration = speech_seconds(wav)
+        # 音声の長さに比例した処理時間と、発話の長さに応じた単語数を再現
+        time.sleep(self.config.transcribe_time * duration)
+        n_words = round(speech / self.config.seconds_per_word)
+        self.send_json({"text": " ".join(self.config.transcript.split()[:n_words])})
+
+    def handle_speech(self, body):
+        pcm = synthesize_pcm(body.get("input", ""), self.config.seconds_per_word)
+        # pcm 以外の形式は、ffmpegでデコードできる wav で返す
+        if body.get("response_format") == "pcm":
+            data, content_type = pcm, "audio/pcm"
+        else:
+            data, content_type = pcm_to_wav(pcm), "audio/wav"
+        size = self.config.chunk_size
+        self.send_chunked([data[i:i + size] for i in range(0, len(data), size)], content_type)
+
+
+def start_server(port=0, config=None):
+    """
+    代替サーバーを別スレッドで起動
+    Args:
+        port: 待ち受けるポート（0の場合は空いているポート）
+        config: FakeConfig
+    Returns:
+        (サーバー, OpenAIクライアントの base_url)
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.config = config or FakeConfig()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI APIの代替サーバー")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--chunk-delay", type=float, default=0.05)
+    parser.add_argument("--transcribe-time", type=float, default=0.1)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="応答が大きく遅れる要求の割合")
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500エラーを返す要求の割合")
+    args = parser.parse_args()
+
+    config = FakeConfig(latency=args.latency, chunk_delay=args.chunk_delay, transcribe_time=args.transcribe_time,
+                        slow_rate=args.slow_rate, slow_latency=args.slow_latency, error_rate=args.error_rate)
+    server, base_url = start_server(args.port, config)
+    print(f"base_url: {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
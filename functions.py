@@ -1,128 +1,314 @@
-import wave
 import os
-import pyaudio
+import io
+import logging
 from pydub import AudioSegment
-import sounddevice as sd
-import numpy as np
 import time
-from time import sleep
 from scipy.io.wavfile import write
 from pathlib import Path
 import streamlit as st
+from vad import VoiceActivityDetector
+from audio_buffer import CaptureBuffer
+import tts_stream
+import streaming_stt
+import tts_cache
+import time_stretch
+import audio_archive
+import audio_encoding
+import tracing
+import audio_transport
+import orchestrator
 
-def record_audio(fs=48000, dir="audio/input", silence_threshold=2.5, min_duration=0.05, amplitude_threshold=0.01):
-    audio_directory = Path.cwd() / dir
-    audio_directory.mkdir(parents=True, exist_ok=True)
-    file_path = audio_directory / f"recorded_audio_input_{int(time.time())}.wav"
+logger = logging.getLogger(__name__)
 
-    recorded_audio = []
-    silent_time = 0
-    progress_num = 0
+# 録音・読み上げ音声をファイルとしても残すか（処理自体はメモリ上で行い、保存は別スレッドで実施）
+ARCHIVE_AUDIO = os.environ.get("ARCHIVE_AUDIO", "1") == "1"
+# 読み上げ音声を合成しながら再生するか
+TTS_STREAMING = os.environ.get("TTS_STREAMING", "1") == "1"
+# シャドーイング・ディクテーションで先に用意しておく問題の数
+PREFETCH_DEPTH = int(os.environ.get("PREFETCH_DEPTH", "1"))
+# 録音しながら、発話の切れ目ごとに文字起こしを進めるか
+STT_STREAMING = os.environ.get("STT_STREAMING", "1") == "1"
+# 文字起こしに送る音声の形式（wav / flac / opus、original で録音のまま送る）
+UPLOAD_FORMAT = os.environ.get("UPLOAD_FORMAT", "flac")
+# 読み上げ中にユーザーが話し始めたら、読み上げを止めるか
+#   auto: エコーキャンセルのある入出力（ブラウザ）の場合のみ（スピーカーの読み上げ音声をマイクが拾い、自分で止めてしまうため）
+#   1: 常に有効（ヘッドホン使用時など）、0: 無効
+BARGE_IN = os.environ.get("BARGE_IN", "auto")
+
+@tracing.traced()
+def record_audio(fs=48000, session=None, hangover=0.6, amplitude_threshold=0.01, blocksize=2400, vad=None, max_duration=120, archive=None, transcriber=None, input_stream=None, barge_in=None, transport=None):
+    """
+    マイクから録音し、話し終えたことを検出したら録音を終了する
+    Args:
+        fs: サンプリングレート
+        session: セッションのID（録音ファイルをセッションごとのディレクトリに保存する）
+        hangover: 発話後、この秒数だけ無音が続いたら録音を終了する
+        amplitude_threshold: 発話とみなす音量（RMS）の下限値
+        blocksize: 1回に読み込むサンプル数（48kHzで2400なら50ミリ秒）
+        vad: 発話区間検出器（未指定の場合は VoiceActivityDetector を使用）
+        max_duration: 1回の発話として録音する最大の秒数
+        archive: 録音ファイルを保存するか（未指定の場合は ARCHIVE_AUDIO に従う）
+        transcriber: 録音しながら文字起こしを進める StreamingTranscriber（create_transcriber で生成）
+        input_stream: 音声入力（sounddevice.InputStream と同じ引数で生成できるもの、未指定の場合は transport のマイク）
+        barge_in: 読み上げ中に録音を始め、話し始めたら読み上げを止めるか（未指定の場合は BARGE_IN と transport に従う）
+            無効の場合は、読み上げが終わってから録音を始める
+        transport: 音声の入出力（audio_transport.get_transport で取得、未指定の場合はサーバーのマイク・スピーカー）
+    Returns:
+        WAV形式の録音データ（BytesIO）
+    """
+
+    if vad is None:
+        vad = VoiceActivityDetector(fs=fs, hangover_ms=hangover * 1000, amplitude_threshold=amplitude_threshold)
+
+    recorded_audio = CaptureBuffer(fs=fs, channels=2, max_seconds=max_duration)
+    progress_num = -1
+    last_speech = None
 
     desc_text = st.empty()
-    desc_text.text("※無言の状態が5秒続くと、録音を終了します。")
+    desc_text.text("※話し終えて少し間を置くと、録音を終了します。")
     status_text = st.empty()
-    progress_bar = st.progress(progress_num)
+    progress_bar = st.progress(0)
 
-    print("現在使用中のデバイス一覧")
-    print(sd.query_devices())
-    print("デバイス表示終了")
+    if transport is None:
+        transport = audio_transport.local
+    if barge_in is None:
+        barge_in = BARGE_IN == "1" or (BARGE_IN == "auto" and transport.echo_cancelled)
+    if not barge_in and transport.is_playing():
+        # 読み上げが終わってから録音を始める
+        transport.get_engine().wait()
 
-    with sd.InputStream(samplerate=fs, channels=2) as stream:
+    if input_stream is None:
+        input_stream = transport.input_stream
+
+    with input_stream(samplerate=fs, channels=2, blocksize=blocksize) as stream:
         while True:
-            print("while処理開始")
-            data, overflowed = stream.read(5000)
+            data, overflowed = stream.read(blocksize)
             if overflowed:
                 st.error("メモリや音声入力速度の問題で、一部の音声データが失われた可能性があります。")
-            recorded_audio.append(data)
-            if np.all(np.abs(data) < amplitude_threshold):
-                silent_time += min_duration
-                progress_num += min_duration
-                if round(progress_num*20)*2 <= 100:
-                    status_text.text(f'Progress: {round(progress_num*20)*2}%')
-                    progress_bar.progress(round(progress_num, 2) / 2.5)
-
-                if silent_time >= silence_threshold:
-                    desc_text.empty()
-                    status_text.text('録音を終了しました。')
-                    break
-            else:
-                silent_time = 0
-                progress_num = 0
-                progress_bar.progress(0)
-                status_text.text(f'Progress: 0%')
-    print("while終了")
-
-    audio_data = np.concatenate(recorded_audio, axis=0)
-    audio_data = np.int16(audio_data * 32767)# 録音データを16ビット整数に変換
-    write(file_path, fs, audio_data)
-
-    return file_path
-
-def transcribe(file_path, client):
-    with open(file_path, 'rb') as audio_file:
-        transcript = client.audio.transcriptions.create(
+            recorded_audio.write(data)
+            ended = vad.process(data) or recorded_audio.full
+            if vad.in_speech:
+                last_speech = time.time()
+            if barge_in and transport.is_playing():
+                if vad.speech_ms >= vad.min_speech_ms:
+                    # ユーザーが話し始めたので、読み上げを止める
+                    transport.stop()
+                elif not vad.speech_started:
+                    # 読み上げを聞いている間は、発話がないことによる録音の打ち切りを保留
+                    vad.hold()
+            if transcriber is not None:
+                transcriber.feed(data, vad)
+
+            # 進捗表示は値が変わったときのみ更新
+            progress = 0 if vad.in_speech else round(vad.silence_progress * 100)
+            if progress != progress_num:
+                progress_num = progress
+                status_text.text(f'Progress: {progress_num}%')
+                progress_bar.progress(progress_num)
+
+            if ended:
+                desc_text.empty()
+                status_text.text('録音を終了しました。')
+                break
+
+    # 話し終えてから、ターン終了と判定するまでの無音の待ち時間
+    if last_speech is not None:
+        tracing.record("silence_wait", last_speech, time.time())
+
+    # 録音データは書き込み時に16ビット整数へ変換済み
+    wav_buffer = io.BytesIO()
+    write(wav_buffer, fs, recorded_audio.to_array())
+    # OpenAI APIはファイル名の拡張子から形式を判定する
+    wav_buffer.name = "recorded_audio_input.wav"
+    wav_buffer.seek(0)
+
+    if ARCHIVE_AUDIO if archive is None else archive:
+        audio_archive.get_archive().save("input", wav_buffer.getvalue(), session)
+
+    return wav_buffer
+
+@tracing.traced()
+def transcribe(audio, client, format=None, policy=None, deadline=None):
+    """
+    音声をテキストに変換
+    Args:
+        audio: 音声ファイルのパス、またはWAV形式の音声データ（BytesIO など）
+        client: OpenAIクライアント
+        format: 送信する形式（未指定の場合は UPLOAD_FORMAT に従う、"original" で録音のまま送る）
+        policy: 時間制限・再試行・ヘッジの設定（未指定の場合は orchestrator.STT）
+        deadline: ターンの持ち時間（別スレッドから呼ぶ場合に渡す、未指定の場合は呼び出し元のスレッドの持ち時間）
+    """
+    format = format or UPLOAD_FORMAT
+    if format != "original":
+        # 16kHzモノラルに変換・圧縮してから送る
+        audio = audio_encoding.encode(audio, format)
+    # 再試行・ヘッジで同じ音声を何度も送れるよう、(ファイル名, バイト列) として渡す
+    if hasattr(audio, "read"):
+        audio.seek(0)
+        file = (os.path.basename(getattr(audio, "name", "recorded_audio_input.wav")), audio.read())
+    else:
+        file = (os.path.basename(audio), Path(audio).read_bytes())
+    return orchestrator.call(
+        "transcribe",
+        lambda: client.audio.transcriptions.create(
             model="whisper-1",
-            file=audio_file
-        )
-    return transcript
+            file=file
+        ),
+        policy or orchestrator.STT,
+        deadline=deadline
+    )
 
-def save_to_wav(response_content, output_file):
+def create_transcriber(client, fs=48000):
     """
-    mp3形式の音声ファイルをwav形式に変換して保存
+    録音しながら文字起こしを進める StreamingTranscriber を生成（STT_STREAMING が無効の場合は None）
+    Args:
+        client: OpenAIクライアント
+        fs: 録音のサンプリングレート
+    Returns:
+        record_audio に渡し、録音後に finish() で結果を受け取る
     """
-    temp_file_name = "temp.mp3"
-    with open(temp_file_name, "wb") as temp_file:
-        temp_file.write(response_content)
-    
-    audio = AudioSegment.from_file(temp_file_name, format="mp3")
-    audio.export(output_file, format="wav")
+    if not STT_STREAMING:
+        return None
+    # 区間の文字起こしは別スレッドで行うため、呼び出し元のターンの持ち時間を渡す
+    deadline = orchestrator.current_deadline()
+    return streaming_stt.StreamingTranscriber(lambda audio: transcribe(audio, client, deadline=deadline), fs=fs)
 
-    # 一時ファイルを削除
-    os.remove(temp_file_name)
+@tracing.traced()
+def save_to_wav(response_content, format="mp3"):
+    """
+    mp3形式の音声データをメモリ上でデコード
+    Args:
+        response_content: 音声データのバイト列
+        format: 音声データの形式
+    Returns:
+        デコード済みの音声（AudioSegment）
+    """
+    return AudioSegment.from_file(io.BytesIO(response_content), format=format)
 
-def play_wav(filepath, speed=1.0):
+@tracing.traced()
+def play_wav(audio, speed=1.0, output=None, wait=True, transport=None):
     """
-    音声ファイルの読み上げ
+    音声の読み上げ
     Args:
-        file_path: 音声ファイルのパス
+        audio: 音声ファイルのパス、またはデコード済みの音声（AudioSegment）
         speed: 再生速度（1.0が通常速度、0.5で半分の速さ、2.0で倍速など）
+        output: 音声出力（未指定の場合は transport の再生エンジン）
+        wait: 再生し終えるまで待つか（再生エンジン使用時のみ、False の場合は再生を始めてすぐに戻る）
+        transport: 音声の入出力（未指定の場合はサーバーのスピーカー）
     """
 
     # PyDubで音声ファイルを読み込む
-    audio = AudioSegment.from_wav(filepath)
+    if not isinstance(audio, AudioSegment):
+        audio = AudioSegment.from_wav(audio)
     
-    # 速度を変更
-    if speed != 1.0:
-        # frame_rateを変更することで速度を調整
-        modified_audio = audio._spawn(audio.raw_data, overrides={
-            "frame_rate": int(audio.frame_rate * speed)
-        })
-        # 元のframe_rateに戻す（ピッチを保持したまま速度だけ変更）
-        modified_audio = modified_audio.set_frame_rate(audio.frame_rate)
+    # ピッチを保持したまま速度だけ変更（同じ音声・速度の結果はキャッシュから取得）
+    modified_audio = time_stretch.stretch_segment(audio, speed)
+
+    if output is None:
+        # 開いたままの出力デバイスの再生キューに積む（形式は再生エンジンに揃える）
+        engine = (transport or audio_transport.local).get_engine()
+        modified_audio = modified_audio.set_frame_rate(engine.rate).set_channels(engine.channels).set_sample_width(engine.width)
+        engine.play(modified_audio.raw_data)
+        if wait:
+            engine.wait()
+        return
+
+    # メモリ上の音声データをそのまま指定の出力に書き込む
+    output.open(modified_audio.frame_rate, modified_audio.channels, modified_audio.sample_width)
+
+    data = memoryview(modified_audio.raw_data)
+    chunk_size = 1024 * modified_audio.frame_width
+    try:
+        for start in range(0, len(data), chunk_size):
+            output.write(bytes(data[start:start + chunk_size]))
+    finally:
+        output.close()
+
+def speak(text, client, speed=1.0, model="tts-1", voice="alloy", output=None, session=None, transport=None):
+    """
+    テキストを音声に変換して読み上げ
+    Args:
+        text: 読み上げるテキスト
+        client: OpenAIクライアント
+        speed: 再生速度
+        model: TTSモデル
+        voice: 声の種類
+        output: 音声出力（未指定の場合は transport の再生エンジン、再生の完了は待たない）
+        session: セッションのID（読み上げ音声をセッションごとのディレクトリに保存する）
+        transport: 音声の入出力（未指定の場合はサーバーのスピーカー）
+    Returns:
+        読み上げた音声（AudioSegment）
+    """
+    if TTS_STREAMING:
+        # 合成の完了を待たず、届いた分から再生
+        if output is None and transport is not None:
+            output = transport.output()
+        pcm = tts_stream.speak_streaming(client, text, speed=speed, model=model, voice=voice, output=output)
+        return archive_pcm(pcm, session)
+
+    audio = synthesize(text, client, model=model, voice=voice, session=session)
+    play_wav(audio, speed=speed, output=output, wait=False, transport=transport)
+    return audio
+
+def synthesize(text, client, model="tts-1", voice="alloy", session=None, deadline=None):
+    """
+    テキストを音声に変換（再生はしない）
+    Args:
+        text: 読み上げるテキスト
+        client: OpenAIクライアント
+        model: TTSモデル
+        voice: 声の種類
+        session: セッションのID（音声をセッションごとのディレクトリに保存する）
+        deadline: 持ち時間（別スレッドから呼ぶ場合に渡す、未指定の場合は呼び出し元のスレッドの持ち時間）
+    Returns:
+        音声（AudioSegment）
+    """
+    if TTS_STREAMING:
+        pcm = b"".join(tts_stream.iter_speech_pcm(client, text, model=model, voice=voice, deadline=deadline))
+        return archive_pcm(pcm, session)
+
+    def request():
+        with tracing.span("speech.create", format="mp3", chars=len(text)):
+            response = orchestrator.call(
+                "speech",
+                lambda: client.audio.speech.create(
+                    model=model,
+                    voice=voice,
+                    input=text
+                ),
+                orchestrator.TTS,
+                deadline=deadline
+            )
+        # mp3形式の音声データをメモリ上でデコードし、ストリーミング時と同じPCM形式に揃える
+        audio = save_to_wav(response.content)
+        return audio.set_frame_rate(tts_stream.PCM_RATE).set_channels(tts_stream.PCM_CHANNELS).set_sample_width(tts_stream.PCM_WIDTH).raw_data
+
+    cache = tts_cache.get_cache()
+    if cache:
+        pcm = cache.fetch(cache.key(text, model, voice, "mp3", client.base_url), request)
     else:
-        modified_audio = audio
+        pcm = request()
+    return archive_pcm(pcm, session)
 
-    # 一時ファイルとして保存
-    temp_file = "temp_modified.wav"
-    modified_audio.export(temp_file, format="wav")
-    
-    # PyAudioで再生
-    play_target_file = wave.open(temp_file, 'rb')
-    p = pyaudio.PyAudio()
-    stream = p.open(format=p.get_format_from_width(play_target_file.getsampwidth()),
-                    channels=play_target_file.getnchannels(),
-                    rate=play_target_file.getframerate(),
-                    output=True)
-
-    data = play_target_file.readframes(1024)
-    while data:
-        stream.write(data)
-        data = play_target_file.readframes(1024)
-
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
-    
-    # 一時ファイルを削除
-    os.remove(temp_file)
\ No newline at end of file
+def log_tts_cache():
+    """TTSキャッシュのヒット率などをデバッグログに出力"""
+    cache = tts_cache.get_cache()
+    if cache and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("TTSキャッシュ: %s", cache.stats())
+
+
+def archive_pcm(pcm, session=None):
+    """
+    ストリーミングで受け取ったPCMデータを音声に変換（設定に応じてwav形式でも保存）
+    Args:
+        pcm: 24kHz・16ビット・モノラルのPCMデータ
+        session: セッションのID（セッションごとのディレクトリに保存する）
+    Returns:
+        音声（AudioSegment）
+    """
+    audio = AudioSegment(pcm, frame_rate=tts_stream.PCM_RATE, sample_width=tts_stream.PCM_WIDTH, channels=tts_stream.PCM_CHANNELS)
+    if ARCHIVE_AUDIO:
+        wav_buffer = io.BytesIO()
+        audio.export(wav_buffer, format="wav")
+        audio_archive.get_archive().save("output", wav_buffer.getvalue(), session)
+    return audio
@@ -1,26 +1,18 @@
-import os
-import sys
-import time
-from time import sleep
-from pathlib import Path
-import functions as func
-from langchain.memory import ConversationSummaryBufferMemory
-from langchain.chains import ConversationChain
-from langchain.prompts import (
-    ChatPromptTemplate,
-    HumanMessagePromptTemplate,
-    MessagesPlaceholder,
-)
-from openai import OpenAI
-from langchain_openai import ChatOpenAI
-from langchain.schema import SystemMessage
+import logging
+
+import tracing
+import orchestrator
+import audio_transport
+import session_store
+import startup
 import streamlit as st
 import streamlit.components.v1 as stc
-import json
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 st.markdown('## 生成AI英会話アプリ')
 # st.markdown("##### 「英会話開始」ボタンを押して、英会話を始めましょう。")
 
@@ -36,41 +28,19 @@ async function getAudioDevices() {
     // クライアント側のオーディオデバイスの一覧を取得
     let devices = await navigator.mediaDevices.enumerateDevices();
 
-    /*
-    devices.forEach(device => {
-        console.log(`Device Label: ${device.label}`);
-        console.log(`Device ID: ${device.deviceId}`);
-        console.log(`Device Kind: ${device.kind}`);
-        console.log(`Group ID: ${device.groupId}`);
-        console.log('---');
-    });
-    */
-
-    console.log("デバイス情報取得")
-    console.dir(devices);
-
     let audioDevices = devices.filter(device => device.kind === 'audioinput');
-    console.log("入力用のデバイス情報")
-    console.dir(audioDevices);
 
     let inputDevices = audioDevices.map(device => ({
         label: device.label,
         deviceId: device.deviceId
     }));
-    console.log("入力用のデバイス情報整形")
-    console.dir(inputDevices);
     return inputDevices
 }
 
 getAudioDevices().then(devices => {
     // Streamlitにデバイス情報を送信
-    console.log("JSデータ送信直前");
-    console.log(devices);
-    const streamlitSend = window.streamlitSend || ((message) => console.log(message));
-    console.log(streamlitSend)
-    console.log("check")
+    const streamlitSend = window.streamlitSend || (() => {});
     streamlitSend({type: "devices", value: devices});
-    console.log("check2")
 });
 
 // let newScript = document.createElement('script');
@@ -79,48 +49,17 @@ getAudioDevices().then(devices => {
 // <head>内に新しいスクリプト要素を挿入
 // document.head.appendChild(newScript);
 
-</script>
-
-<script src="https://code.jquery.com/jquery-3.5.1.js" integrity="sha256-QWo7\
-LDvxbWT2tbbQ97B53yJnYU3WhH/C8ycbRAkjPDc=" crossorigin="anonymous"></script>
-<script>
-$.ajax({
-    url: "get_audio_info.py",
-    data: "test",
-    dataTyep: "json",
-    success : function(response){
-        alert('成功');
-        console.log(response)
-    },
-    error: function(){
-         //通信失敗時の処
-        alert('通信失敗');
-    }
-});
 </script>
 """
 
-stc.html(html_code)
-
-if "audio_devices" not in st.session_state:
-    st.session_state.audio_devices = []
-
-st.write(st.experimental_get_query_params())
-if "message" in st.experimental_get_query_params():
-    st.write("test")
-    message = json.loads(st.experimental_get_query_params()["message"][0])
-    if message.get("type") == "devices":
-        st.session_state.audio_devices = message.get("devices")
-
-st.write("クライアントのオーディオデバイス情報:")
-st.write(st.session_state.audio_devices)
-
-
-
+if "history" not in st.session_state:
+    # ブラウザのオーディオデバイスの確認はセッションの最初の1回だけ行う（再実行のたびに埋め込まない）
+    stc.html(html_code, height=0)
 
-
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+    # 会話履歴はSQLiteに保存し、URLのセッションIDで再起動後も同じセッションを再開
+    st.session_state.history = session_store.get_store().session(st.query_params.get("session"))
+    st.query_params["session"] = st.session_state.history.id
+    st.session_state.history_limit = session_store.HISTORY_WINDOW
     st.session_state.start_flg = False
     st.session_state.end_flg = False
     st.session_state.shadowing_flg = False
@@ -130,32 +69,27 @@ if "messages" not in st.session_state:
     st.session_state.dictation_button_flg = False
     st.session_state.dictation_count = 0
     st.session_state.chat_wait_flg = False
-
-
-    st.session_state.client = OpenAI(api_key=os.environ['OPENAI_API_KEY'])
-
-    # LLMとのやり取り
-    system_template = """
-    You are a conversational English tutor. Engage in a natural and free-flowing conversation with the user. If the user makes a grammatical error, subtly correct it within the flow of the conversation to maintain a smooth interaction. Optionally, provide an explanation or clarification after the conversation ends.
-    """
-    prompt = ChatPromptTemplate.from_messages([
-        SystemMessage(content=system_template),
-        MessagesPlaceholder(variable_name="history"),
-        HumanMessagePromptTemplate.from_template("{input}")
-    ])
-    llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.5)
-    memory = ConversationSummaryBufferMemory(
-        llm=llm,
-        max_token_limit=500,
-        return_messages=True
-    )
-    st.session_state.chain = ConversationChain(
-        llm=llm,
-        prompt=prompt,
-        memory=memory
+    # 録音・読み上げの音声の入出力（AUDIO_TRANSPORT=websocket の場合はブラウザのマイク・スピーカー）
+    st.session_state.transport = audio_transport.get_transport(st.session_state.history.id)
+elif st.session_state.transport.closed:
+    # ブラウザとの接続が長く切れていたため破棄された場合は作り直す（埋め込むHTMLも新しいトークンで作り直される）
+    st.session_state.transport = audio_transport.get_transport(st.session_state.history.id)
+
+# 会話・音声処理の重いモジュールは、画面の表示を待たせないよう別スレッドで読み込み始める
+startup.preload()
+
+# ブラウザのマイク・スピーカーを使う場合は、音声をやり取りするスクリプトを埋め込む（再実行しても同じ位置に表示して接続を保つ）
+transport_html = st.session_state.transport.client_html()
+if transport_html:
+    stc.html(transport_html, height=40)
+
+# 直近のターンの処理時間（ウォーターフォール）と、処理ごとの p50/p95
+if st.sidebar.checkbox("処理時間を表示"):
+    tracing.render_sidebar(
+        n=st.sidebar.number_input("表示するターン数", min_value=1, max_value=20, value=3),
+        session=st.session_state.history.id
     )
 
-
 col1, col2, col3, col4 = st.columns([1, 1, 1, 2])
 with col1:
     if st.session_state.start_flg:
@@ -172,13 +106,21 @@ with col3:
 with col4:
     st.session_state.mode = st.selectbox(label="モード", options=["日常英会話", "シャドーイング", "ディクテーション"], label_visibility="collapsed")
 
+# モードが切り替わったら、先読み中の問題を破棄
+PREFETCHER_KEYS = ["shadowing_prefetcher", "dictation_prefetcher"]
+if st.session_state.get("prefetch_mode") != st.session_state.mode:
+    for key in PREFETCHER_KEYS:
+        if key in st.session_state:
+            st.session_state.pop(key).cancel()
+    st.session_state.prefetch_mode = st.session_state.mode
+
 with st.chat_message("assistant", avatar="images/370377.jpg"):
     # st.success("こちらは生成AIによる音声英会話の練習アプリです。何度も繰り返し練習して、英語力をアップさせましょう。")
     # st.markdown("")
     st.success("""
     - モードと再生速度を選択し、「英会話開始」ボタンを押して英会話を始めましょう。
     - モードは「日常英会話」「シャドーイング」「ディクテーション」から選べます。
-    - 発話後、5秒間沈黙することで音声入力が完了します。
+    - 発話後、少し間を置くと音声入力が完了します。
     - 「一時中断」ボタンを押すことで、英会話を一時中断できます。
     """)
     # st.markdown("")
@@ -191,7 +133,12 @@ with st.chat_message("assistant", avatar="images/370377.jpg"):
     # st.code("英語の音声が流れるため、聞き終わったら流れた音声を画面下部のチャット欄から入力してください。送信後、生成AIロボットによる評価が行われます。正しく各単語を聞き取れるようになるまで何度も練習しましょう。", language=None, wrap_lines=True)
     # st.divider()
 
-for message in st.session_state.messages:
+# 直近のメッセージのみ読み込んで表示（古いメッセージは「以前の会話を表示」で読み込む）
+messages, has_more = st.session_state.history.window(st.session_state.history_limit)
+if has_more and st.button("以前の会話を表示"):
+    st.session_state.history_limit += session_store.HISTORY_WINDOW
+    messages, has_more = st.session_state.history.window(st.session_state.history_limit)
+for message in messages:
     if message["role"] == "assistant":
         with st.chat_message(message["role"], avatar="images/370377.jpg"):
             st.markdown(message["content"])
@@ -218,6 +165,11 @@ if st.session_state.end_flg:
     st.session_state.dictation_button_flg = False
     st.session_state.dictation_count = 0
     st.session_state.chat_wait_flg = False
+    for key in PREFETCHER_KEYS:
+        if key in st.session_state:
+            st.session_state.pop(key).cancel()
+    # 読み上げ中の音声も止める
+    st.session_state.transport.stop()
 
 if st.session_state.chat_wait_flg:
     st.info("AIが読み上げた音声を、画面下部のチャット欄からそのまま入力・送信してください。")
@@ -228,253 +180,205 @@ if not chat_message and st.session_state.chat_wait_flg:
     st.stop()
 
 if st.session_state.start_flg:
+    # 重いモジュールの読み込みが終わるまで待つ（読み込み済みの場合はすぐに戻る）
+    startup.wait()
+    import functions as func
+    import speech_pipeline
+    import prefetch
+    import problem_bank
+    import chains
+    import scoring
+    import acoustic
+    import time_stretch
+
+    def end_turn():
+        """ターンの終了（処理時間の記録を保存し、TTSキャッシュの状況をデバッグログに出力）"""
+        func.log_tts_cache()
+        tracing.end_turn()
+
+    if "chain" not in st.session_state:
+        # OpenAIクライアント・LLMはプロセス全体で共有し、会話履歴のみセッションごとに生成（最初の英会話開始時）
+        st.session_state.client = chains.get_openai_client()
+        st.session_state.chain = chains.create_conversation_chain(chains.TUTOR_TEMPLATE)
+        chains.restore_history(
+            st.session_state.chain,
+            st.session_state.history.recent_messages(session_store.HISTORY_WINDOW, mode="日常英会話")
+        )
+
+    # 再実行までを1ターンとして、各処理の時間を記録
+    tracing.begin_turn(st.session_state.mode, session=st.session_state.history.id)
+    # 外部APIの呼び出しは、ターンの持ち時間の範囲で時間制限・再試行・ヘッジを行う
+    orchestrator.begin_turn()
     if st.session_state.mode == "ディクテーション" and (st.session_state.dictation_button_flg or st.session_state.dictation_count == 0 or chat_message):
         if not chat_message:
-            with st.spinner('問題文生成中...'):
-                system_template = """
-                Generate 1 sentence that reflect natural English used in daily conversations, workplace, and social settings:
-                - Casual conversational expressions
-                - Polite business language
-                - Friendly phrases used among friends
-                - Sentences with situational nuances and emotions
-                - Expressions reflecting cultural and regional contexts
-
-                Limit your response to an English sentence of approximately 15 words.
-                # Make each sentence 10-15 words long with clear and understandable context.
-                """
-                prompt = ChatPromptTemplate.from_messages([
-                    SystemMessage(content=system_template),
-                    MessagesPlaceholder(variable_name="history"),
-                    HumanMessagePromptTemplate.from_template("{input}")
-                ])
-                llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.5)
-                memory = ConversationSummaryBufferMemory(
-                    llm=llm,
-                    max_token_limit=500,
-                    return_messages=True
-                )
-                st.session_state.dictation_problem_chain = ConversationChain(
-                    llm=llm,
-                    prompt=prompt,
-                    memory=memory
-                )
-                st.session_state.problem = st.session_state.dictation_problem_chain.predict(input="")
-                # LLMからの回答を音声データに変換
-                response = st.session_state.client.audio.speech.create(
-                    model="tts-1",
-                    voice="alloy",
-                    input=st.session_state.problem
+            if "dictation_prefetcher" not in st.session_state:
+                problem_chain = chains.create_conversation_chain(chains.DICTATION_PROBLEM_TEMPLATE)
+                client = st.session_state.client
+                session = st.session_state.history.id
+                # 問題集があればそこから出題し（出題済みの問題は除く）、なければ回答中・評価結果の表示中に
+                # 次の問題文と音声を別スレッドで用意
+                st.session_state.dictation_prefetcher = prefetch.ProblemPrefetcher(
+                    generate=lambda: problem_chain.predict(input=""),
+                    # 先読みは次のターンのための処理のため、問題ごとに持ち時間を設ける
+                    synthesize=lambda text: func.synthesize(text, client, session=session, deadline=orchestrator.Deadline()),
+                    depth=func.PREFETCH_DEPTH,
+                    bank=problem_bank.deck(st.session_state.mode, seen=st.session_state.history.problems(st.session_state.mode))
                 )
-                # mp3形式の音声ファイルをwav形式に変換して保存
-                output_file_path = Path.cwd() / "audio/output" / f"recorded_audio_output_{int(time.time())}.wav"
-                func.save_to_wav(response.content, output_file_path)
-            # 音声ファイルの読み上げ
-            func.play_wav(str(output_file_path), speed=st.session_state.speed)
+            with st.spinner('問題文生成中...'):
+                problem = st.session_state.dictation_prefetcher.get()
+                st.session_state.problem = problem.text
+            logger.debug("先読み（ディクテーション）: %s", st.session_state.dictation_prefetcher.stats())
+            # 問題文の読み上げ（再生しながらチャット欄を表示し、聞きながら入力できるようにする）
+            func.play_wav(problem.audio, speed=st.session_state.speed, wait=False, transport=st.session_state.transport)
 
         if not chat_message:
             st.session_state.chat_wait_flg = True
+            end_turn()
             st.rerun()
         else:
-            st.session_state.messages.append({"role": "assistant", "content": st.session_state.problem})
-            st.session_state.messages.append({"role": "user", "content": chat_message})
+            st.session_state.history.add_message("assistant", st.session_state.problem, st.session_state.mode)
+            st.session_state.history.add_message("user", chat_message, st.session_state.mode)
+            # 単語単位の比較はその場で行い、アドバイスの生成は別スレッドで開始
+            score = scoring.score(st.session_state.problem, chat_message)
+            problem_id = st.session_state.history.add_problem(st.session_state.mode, st.session_state.problem)
+            st.session_state.history.add_score(problem_id, chat_message, score)
+            advice = chains.advise_async(st.session_state.problem, chat_message, score)
             with st.chat_message("assistant", avatar="images/370377.jpg"):
                 st.markdown(st.session_state.problem)
             with st.chat_message("user", avatar="images/23260507.jpg"):
                 st.markdown(chat_message)
-            
-            with st.spinner('評価結果の生成中...'):
-                system_template = """
-                あなたは英語学習の専門家です。
-                以下の「LLMによる問題文」と「ユーザーによる回答文」を比較し、分析してください：
-
-                【LLMによる問題文】
-                問題文：{llm_text}
-
-                【ユーザーによる回答文】
-                回答文：{user_text}
-
-                【分析項目】
-                1. 単語の正確性（誤った単語、抜け落ちた単語、追加された単語）
-                2. 文法的な正確性
-                3. 文の完成度
-
-                フィードバックは以下のフォーマットで日本語で提供してください：
-
-                【評価】 # ここで改行を入れる
-                ✓ 正確に再現できた部分 # 項目を複数記載
-                △ 改善が必要な部分 # 項目を複数記載
-                
-                【アドバイス】 # ここで改行を入れる
-                次回の練習のためのポイント
-
-                ユーザーの努力を認め、前向きな姿勢で次の練習に取り組めるような励ましのコメントを含めてください。
-                """
-                system_template = system_template.format(
-                    llm_text=st.session_state.problem,
-                    user_text=chat_message
-                )
-                prompt = ChatPromptTemplate.from_messages([
-                    SystemMessage(content=system_template),
-                    MessagesPlaceholder(variable_name="history"),
-                    HumanMessagePromptTemplate.from_template("{input}")
-                ])
-                llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.5)
-                memory = ConversationSummaryBufferMemory(
-                    llm=llm,
-                    max_token_limit=500,
-                    return_messages=True
-                )
-                st.session_state.dictation_feedback_chain = ConversationChain(
-                    llm=llm,
-                    prompt=prompt,
-                    memory=memory
-                )
-                result = st.session_state.dictation_feedback_chain.predict(input="")
-            st.session_state.messages.append({"role": "assistant", "content": result})
+
+            result = score.to_markdown()
             with st.chat_message("assistant", avatar="images/370377.jpg"):
                 st.markdown(result)
+                if advice is not None:
+                    with st.spinner('アドバイスの生成中...'):
+                        # 持ち時間内に生成できなかった場合は、比較結果のみ表示
+                        advice = orchestrator.result(advice)
+                if advice is not None:
+                    st.markdown(advice)
+                    result += "\n\n" + advice
+            st.session_state.history.add_message("assistant", result, st.session_state.mode)
             
             st.session_state.dictation_flg = True
             st.session_state.dictation_button_flg = True
             chat_message = ""
             st.session_state.dictation_count += 1
             st.session_state.chat_wait_flg = False
+            end_turn()
             st.rerun()
 
     if st.session_state.mode == "シャドーイング" and (st.session_state.shadowing_button_flg or st.session_state.shadowing_count == 0):
-        with st.spinner('問題文生成中...'):
-            system_template = """
-            Generate 1 sentence that reflect natural English used in daily conversations, workplace, and social settings:
-            - Casual conversational expressions
-            - Polite business language
-            - Friendly phrases used among friends
-            - Sentences with situational nuances and emotions
-            - Expressions reflecting cultural and regional contexts
-
-            Make each sentence 20-30 words long with clear and understandable context.
-            """
-            prompt = ChatPromptTemplate.from_messages([
-                SystemMessage(content=system_template),
-                MessagesPlaceholder(variable_name="history"),
-                HumanMessagePromptTemplate.from_template("{input}")
-            ])
-            llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0.5)
-            memory = ConversationSummaryBufferMemory(
-                llm=llm,
-                max_token_limit=500,
-                return_messages=True
-            )
-            st.session_state.shadowing_problem_chain = ConversationChain(
-                llm=llm,
-                prompt=prompt,
-                memory=memory
-            )
-            problem = st.session_state.shadowing_problem_chain.predict(input="")
-            st.session_state.messages.append({"role": "assistant", "content": problem})
-        
-            # LLMからの回答を音声データに変換
-            response = st.session_state.client.audio.speech.create(
-                model="tts-1",
-                voice="alloy",
-                input=problem
+        if "shadowing_prefetcher" not in st.session_state:
+            problem_chain = chains.create_conversation_chain(chains.SHADOWING_PROBLEM_TEMPLATE)
+            client = st.session_state.client
+            session = st.session_state.history.id
+            # 問題集があればそこから出題し（出題済みの問題は除く）、なければ発話中・評価結果の表示中に
+            # 次の問題文と音声を別スレッドで用意
+            st.session_state.shadowing_prefetcher = prefetch.ProblemPrefetcher(
+                generate=lambda: problem_chain.predict(input=""),
+                # 先読みは次のターンのための処理のため、問題ごとに持ち時間を設ける
+                synthesize=lambda text: func.synthesize(text, client, session=session, deadline=orchestrator.Deadline()),
+                depth=func.PREFETCH_DEPTH,
+                bank=problem_bank.deck(st.session_state.mode, seen=st.session_state.history.problems(st.session_state.mode))
             )
-            # mp3形式の音声ファイルをwav形式に変換して保存
-            output_file_path = Path.cwd() / "audio/output" / f"recorded_audio_output_{int(time.time())}.wav"
-            func.save_to_wav(response.content, output_file_path)
-        # 音声ファイルの読み上げ
-        func.play_wav(str(output_file_path), speed=st.session_state.speed)
-
-        # 音声入力の受け取り
-        speech_file_path = func.record_audio()
+        with st.spinner('問題文生成中...'):
+            problem = st.session_state.shadowing_prefetcher.get()
+            st.session_state.history.add_message("assistant", problem.text, st.session_state.mode)
+        logger.debug("先読み（シャドーイング）: %s", st.session_state.shadowing_prefetcher.stats())
+        # 問題文の読み上げ（お手本を最後まで聞いてから発話するため、再生し終えるまで待つ）
+        func.play_wav(problem.audio, speed=st.session_state.speed, transport=st.session_state.transport)
+        # リズム・タイミングは、利用者が実際に聞いた速度のお手本と比べる（再生時に変換した結果をキャッシュから取得）
+        reference_audio = time_stretch.stretch_segment(problem.audio, st.session_state.speed)
+        problem = problem.text
+
+        # 音声入力の受け取り（発話の切れ目ごとに、録音しながら文字起こしを開始）
+        transcriber = func.create_transcriber(st.session_state.client)
+        speech_audio = func.record_audio(session=st.session_state.history.id, transcriber=transcriber, transport=st.session_state.transport)
+        # 持ち時間は話し終えた時点から数え直す
+        orchestrator.begin_turn()
+        # リズム・タイミングはお手本の音声と録音を直接比較し（文字起こし不要）、文字起こしの待ち時間と並行して進める
+        rhythm = orchestrator.submit("acoustic.score", acoustic.score, reference_audio, speech_audio)
 
         with st.spinner('音声入力をテキストに変換中...'):
             # 音声入力をテキストに変換
-            result = func.transcribe(speech_file_path, st.session_state.client)
-            st.session_state.messages.append({"role": "user", "content": result.text})
+            if transcriber is not None:
+                result = transcriber.finish()
+            else:
+                result = func.transcribe(speech_audio, st.session_state.client)
+            st.session_state.history.add_message("user", result.text, st.session_state.mode)
+            # 単語単位の比較はその場で行い、アドバイスの生成は別スレッドで開始
+            score = scoring.score(problem, result.text)
+            problem_id = st.session_state.history.add_problem(st.session_state.mode, problem)
+            st.session_state.history.add_score(problem_id, result.text, score, rhythm)
+            advice = chains.advise_async(problem, result.text, score)
             with st.chat_message("assistant", avatar="images/370377.jpg"):
                 st.markdown(problem)
             with st.chat_message("user", avatar="images/23260507.jpg"):
                 st.markdown(result.text)
 
-        with st.spinner('評価結果の生成中...'):
-            system_template = """
-            あなたは英語学習の専門家です。
-            以下の「LLMによる問題文」と「ユーザーによる回答文」を比較し、分析してください：
-
-            【LLMによる問題文】
-            問題文：{llm_text}
-
-            【ユーザーによる回答文】
-            回答文：{user_text}
-
-            【分析項目】
-            1. 単語の正確性（誤った単語、抜け落ちた単語、追加された単語）
-            2. 文法的な正確性
-            3. 文の完成度
-
-            フィードバックは以下のフォーマットで日本語で提供してください：
-
-            【評価】 # ここで改行を入れる
-            ✓ 正確に再現できた部分 # 項目を複数記載
-            △ 改善が必要な部分 # 項目を複数記載
-            
-            【アドバイス】
-            次回の練習のためのポイント
-
-            ユーザーの努力を認め、前向きな姿勢で次の練習に取り組めるような励ましのコメントを含めてください。
-            """
-            system_template = system_template.format(
-                llm_text=problem,
-                user_text=result.text
-            )
-            prompt = ChatPromptTemplate.from_messages([
-                SystemMessage(content=system_template),
-                MessagesPlaceholder(variable_name="history"),
-                HumanMessagePromptTemplate.from_template("{input}")
-            ])
-            st.session_state.shadowing_feedback_chain = ConversationChain(
-                llm=llm,
-                prompt=prompt,
-                memory=memory
-            )
-            result = st.session_state.shadowing_feedback_chain.predict(input="")
-        st.session_state.messages.append({"role": "assistant", "content": result})
+        result = score.to_markdown()
+        rhythm = orchestrator.result(rhythm)
+        if rhythm is not None:
+            result += "\n\n" + rhythm.to_markdown()
         with st.chat_message("assistant", avatar="images/370377.jpg"):
             st.markdown(result)
+            if advice is not None:
+                with st.spinner('アドバイスの生成中...'):
+                    # 持ち時間内に生成できなかった場合は、比較結果のみ表示
+                    advice = orchestrator.result(advice)
+            if advice is not None:
+                st.markdown(advice)
+                result += "\n\n" + advice
+        st.session_state.history.add_message("assistant", result, st.session_state.mode)
         
         st.session_state.shadowing_flg = True
         st.session_state.shadowing_count += 1
+        end_turn()
         st.rerun()
 
 
     if st.session_state.mode == "日常英会話":
-        # 音声入力の受け取り
-        input_file_path = func.record_audio()
+        # 音声入力の受け取り（発話の切れ目ごとに、録音しながら文字起こしを開始）
+        transcriber = func.create_transcriber(st.session_state.client)
+        input_audio = func.record_audio(session=st.session_state.history.id, transcriber=transcriber, transport=st.session_state.transport)
+        # 持ち時間は話し終えた時点から数え直す
+        orchestrator.begin_turn()
 
         # 音声入力をテキストに変換
-        result = func.transcribe(input_file_path, st.session_state.client)
-        st.session_state.messages.append({"role": "user", "content": result.text})
+        if transcriber is not None:
+            result = transcriber.finish()
+        else:
+            result = func.transcribe(input_audio, st.session_state.client)
+        st.session_state.history.add_message("user", result.text, st.session_state.mode)
         with st.chat_message("user", avatar="images/23260507.jpg"):
             st.markdown(result.text)
 
-        result = st.session_state.chain.predict(input=result.text)
-        st.session_state.messages.append({"role": "assistant", "content": result})
-        with st.chat_message("assistant", avatar="images/370377.jpg"):
-            st.markdown(result)
-
-        # LLMからの回答を音声データに変換
-        response = st.session_state.client.audio.speech.create(
-            model="tts-1",
-            voice="alloy",
-            input=result
-        )
-
-        # mp3形式の音声ファイルをwav形式に変換して保存
-        output_file_path = Path.cwd() / "audio/output" / f"recorded_audio_output_{int(time.time())}.wav"
-        func.save_to_wav(response.content, output_file_path)
+        if func.TTS_STREAMING:
+            # LLMからの回答を生成しながら、完成した文から順に読み上げ
+            with st.chat_message("assistant", avatar="images/370377.jpg"):
+                reply_text = st.empty()
+                result, pcm = speech_pipeline.speak_reply(
+                    st.session_state.chain,
+                    result.text,
+                    st.session_state.client,
+                    speed=st.session_state.speed,
+                    output=st.session_state.transport.output(),
+                    on_sentence=reply_text.markdown
+                )
+                reply_text.markdown(result)
+            st.session_state.history.add_message("assistant", result, st.session_state.mode)
+            func.archive_pcm(pcm, st.session_state.history.id)
+        else:
+            result = st.session_state.chain.predict(input=result.text)
+            st.session_state.history.add_message("assistant", result, st.session_state.mode)
+            with st.chat_message("assistant", avatar="images/370377.jpg"):
+                st.markdown(result)
 
-        # 音声ファイルの読み上げ
-        func.play_wav(str(output_file_path), speed=st.session_state.speed)
+            # LLMからの回答を音声に変換して読み上げ
+            func.speak(result, st.session_state.client, speed=st.session_state.speed,
+                       session=st.session_state.history.id, transport=st.session_state.transport)
 
         # 英会話を続けるためにファイルを再実行
+        end_turn()
         st.rerun()
\ No newline at end of file
@@ -0,0 +1,323 @@
+"""
+外部API呼び出しの時間制限・再試行・ヘッジ
+
+1ターンの処理（文字起こし・LLM・音声合成）に全体の持ち時間（デッドライン）を設け、
+各処理（ステージ）は「ステージごとの制限時間」と「ターンの残り時間」の短い方で打ち切る。
+失敗・時間切れの場合はジッター付きの待ち時間をおいて再試行し、
+応答が直近の p95 などより遅い場合は同じ要求をもう1つ送って（ヘッジ）、先に返った方を使う。
+
+ステージは別スレッドで実行し、打ち切った要求はクライアント側の制限時間で自然に終了させる。
+スレッドプールはステージごとに分け、打ち切った要求が残っていても他のステージの実行を妨げないようにする。
+持ち時間はスレッドごとに保持するため、別スレッドで外部APIを呼ぶ処理（文単位の合成・アドバイスなど）には
+呼び出し元のスレッドで current_deadline() を取得し、deadline 引数で渡す。
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+
+import tracing
+
+# 1ターンの処理（話し終えてから応答を返すまで）の持ち時間（秒）
+TURN_BUDGET = float(os.environ.get("TURN_BUDGET", "30"))
+# APIクライアント側の1回の要求の制限時間（秒、打ち切った要求もこの時間で終了する）
+API_TIMEOUT = float(os.environ.get("API_TIMEOUT", "20"))
+# 遅い要求をヘッジするか（HEDGE=0 で無効）
+HEDGE = os.environ.get("HEDGE", "1") == "1"
+# この順位（パーセンタイル）の応答時間を超えたらヘッジする
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+# ステージごとのスレッドプールのスレッド数
+STAGE_WORKERS = int(os.environ.get("STAGE_WORKERS", "8"))
+
+# 再試行しても結果が変わらないエラー（リクエストの内容・認証の誤り）
+_PERMANENT_STATUS = (400, 401, 403, 404, 422)
+
+
+class StageTimeout(TimeoutError):
+    """ステージが制限時間内に終わらなかった"""
+
+
+class DeadlineExceeded(StageTimeout):
+    """ターンの持ち時間を使い切った"""
+
+
+class Deadline:
+    """
+    ターンの持ち時間
+
+    Args:
+        budget: 持ち時間（秒）
+    """
+
+    def __init__(self, budget=TURN_BUDGET):
+        self.restart(budget)
+
+    def restart(self, budget=None):
+        """
+        今から持ち時間を数え直す（この Deadline を渡した別スレッドの処理にも反映される）
+        Args:
+            budget: 持ち時間（秒、未指定の場合は前回と同じ）
+        """
+        if budget is not None:
+            self.budget = budget
+        self.expires_at = time.monotonic() + self.budget
+
+    def remaining(self):
+        """残り時間（秒、使い切った場合は 0）"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class Policy:
+    """
+    ステージの時間制限・再試行・ヘッジの設定
+
+    Args:
+        timeout: 1回の試行の制限時間（秒）
+        retries: 失敗・時間切れの場合に再試行する回数
+        backoff: 再試行までの待ち時間の基準（秒、試行ごとに倍にし、0からその値までの乱数で待つ）
+        max_backoff: 再試行までの待ち時間の上限（秒）
+        hedge: 遅い要求をヘッジするか
+        hedge_after: 応答時間の記録が少ない間に使う、ヘッジまでの待ち時間（秒）
+        hedge_percentile: この順位の応答時間を超えたらヘッジする
+        min_samples: 応答時間の順位を使い始める記録数
+    """
+
+    def __init__(self, timeout=10.0, retries=2, backoff=0.2, max_backoff=2.0, hedge=False, hedge_after=2.0,
+                 hedge_percentile=HEDGE_PERCENTILE, min_samples=20):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+
+
+# 文字起こし・音声合成は同じ要求を重ねて送っても副作用がないため、ヘッジを使う
+STT = Policy(timeout=15.0, retries=2, hedge=HEDGE, hedge_after=3.0)
+TTS = Policy(timeout=10.0, retries=2, hedge=HEDGE, hedge_after=1.5)
+# LLMは同じ要求を重ねて送ると料金も重なるため、ヘッジしない（再試行はクライアント側で行う）
+LLM = Policy(timeout=API_TIMEOUT, retries=0, hedge=False)
+
+
+class _Stats:
+    """ステージごとの応答時間と、再試行・ヘッジ・時間切れの回数"""
+
+    def __init__(self, maxlen=200):
+        self.latencies = deque(maxlen=maxlen)
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def hedge_delay(self, policy):
+        if len(self.latencies) < policy.min_samples:
+            return policy.hedge_after
+        return tracing.percentile(self.latencies, policy.hedge_percentile)
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+_local = threading.local()
+# ステージごとのスレッドプール（プロセス全体で共有）
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _get_stats(name):
+    with _stats_lock:
+        return _stats.setdefault(name, _Stats())
+
+
+def _get_executor(name):
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix=name)
+        return executor
+
+
+def begin_turn(budget=TURN_BUDGET):
+    """
+    呼び出し元のスレッドでターンの持ち時間を開始（すでに開始している場合は、今から数え直す）
+    Returns:
+        Deadline（開始済みの場合は同じ Deadline）
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        deadline = _local.deadline = Deadline(budget)
+    else:
+        deadline.restart(budget)
+    return deadline
+
+
+def current_deadline():
+    """呼び出し元のスレッドのターンの持ち時間（開始していない場合は None）"""
+    return getattr(_local, "deadline", None)
+
+
+def _retryable(error):
+    status = getattr(error, "status_code", None)
+    return status not in _PERMANENT_STATUS
+
+
+def _attempt(name, fn, policy, timeout, discard, stats, attrs):
+    start = time.perf_counter()
+    end = start + timeout
+    started = {}
+    pending = set()
+
+    executor = _get_executor(name)
+    # 別スレッドで記録したスパンも、呼び出し元のセッションのターンにまとめる
+    fn = tracing.bind(fn)
+
+    def launch():
+        future = executor.submit(fn)
+        started[future] = time.perf_counter()
+        pending.add(future)
+
+    launch()
+    hedge_at = start + stats.hedge_delay(policy) if policy.hedge else None
+    error = None
+    while True:
+        wait_until = end if hedge_at is None else min(end, hedge_at)
+        done, _ = wait(pending, timeout=max(0.0, wait_until - time.perf_counter()), return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.discard(future)
+            if future.exception() is not None:
+                error = future.exception()
+                continue
+            stats.latencies.append(time.perf_counter() - started[future])
+            if len(started) > 1 and future is not next(iter(started)):
+                stats.hedge_wins += 1
+                attrs["hedge_won"] = True
+            _abandon(pending, discard)
+            return future.result()
+        if not pending:
+            raise error
+        now = time.perf_counter()
+        if now >= end:
+            _abandon(pending, discard)
+            raise StageTimeout(f"{name} が {timeout:.1f} 秒以内に終わりませんでした。")
+        if hedge_at is not None and now >= hedge_at:
+            # 最初の要求は続けたまま、同じ要求をもう1つ送る
+            hedge_at = None
+            stats.hedges += 1
+            attrs["hedged"] = True
+            launch()
+
+
+def _abandon(futures, discard):
+    # 打ち切った要求は待たず、後で返ってきた結果だけ後始末する
+    if discard is None:
+        return
+
+    def cleanup(future):
+        if future.exception() is None:
+            discard(future.result())
+
+    for future in futures:
+        future.add_done_callback(cleanup)
+
+
+def call(name, fn, policy, deadline=None, discard=None):
+    """
+    外部APIの呼び出しを、時間制限・再試行・ヘッジ付きで実行
+    Args:
+        name: ステージの名前（応答時間の記録とトレースに使う）
+        fn: 引数なしで呼び出す関数（ヘッジでは同時に2回呼ばれることがある）
+        policy: Policy
+        deadline: ターンの持ち時間（未指定の場合は呼び出し元のスレッドの current_deadline()）
+        discard: 使われなかった要求の結果を受け取る後始末の関数（ストリーミング応答を閉じるなど）
+    Returns:
+        最初に成功した呼び出しの結果
+    """
+    deadline = deadline or current_deadline()
+    stats = _get_stats(name)
+    stats.calls += 1
+    with tracing.span(f"call.{name}") as attrs:
+        attempt = 0
+        while True:
+            timeout = policy.timeout if deadline is None else min(policy.timeout, deadline.remaining())
+            if timeout <= 0:
+                stats.timeouts += 1
+                raise DeadlineExceeded(f"ターンの持ち時間（{deadline.budget:.0f}秒）を超えたため、{name} を中止しました。")
+            try:
+                return _attempt(name, fn, policy, timeout, discard, stats, attrs)
+            except Exception as e:
+                if isinstance(e, StageTimeout):
+                    stats.timeouts += 1
+                if attempt >= policy.retries or not _retryable(e):
+                    stats.failures += 1
+                    raise
+                # 同時に失敗した要求が一斉に再試行しないよう、待ち時間をばらつかせる
+                delay = random.uniform(0, min(policy.max_backoff, policy.backoff * 2 ** attempt))
+                if deadline is not None and delay >= deadline.remaining():
+                    stats.failures += 1
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                stats.retries += 1
+                attrs["retries"] = attempt
+
+
+def submit(name, fn, *args, **kwargs):
+    """
+    独立したステージを別スレッドで開始（文字起こしの待ち時間中に他の処理を進める場合など）
+    Returns:
+        Future
+    """
+    def run():
+        with tracing.span(name):
+            return fn(*args, **kwargs)
+    return _get_executor(name).submit(tracing.bind(run))
+
+
+def result(future, default=None, deadline=None):
+    """
+    ステージの結果を、ターンの残り時間だけ待つ
+    Args:
+        future: Future
+        default: 時間内に終わらなかった場合の値
+        deadline: ターンの持ち時間（未指定の場合は呼び出し元のスレッドの current_deadline()）
+    """
+    deadline = deadline or current_deadline()
+    timeout = None if deadline is None else deadline.remaining()
+    try:
+        return future.result(timeout)
+    except FutureTimeout:
+        return default
+
+
+def stats():
+    """ステージごとの応答時間（p50・p95）と、再試行・ヘッジ・時間切れの回数"""
+    with _stats_lock:
+        items = list(_stats.items())
+    return {
+        name: {
+            "calls": s.calls,
+            "p50": tracing.percentile(s.latencies, 50),
+            "p95": tracing.percentile(s.latencies, 95),
+            "retries": s.retries,
+            "hedges": s.hedges,
+            "hedge_wins": s.hedge_wins,
+            "timeouts": s.timeouts,
+            "failures": s.failures,
+        }
+        for name, s in items
+    }
+
+
+def reset_stats():
+    """応答時間などの記録を消去（計測用）"""
+    with _stats_lock:
+        _stats.clear()
@@ -0,0 +1,259 @@
+"""
+音声の再生エンジン
+
+出力デバイスを最初の再生時に一度だけ開き、以降はプロセス全体で使い続ける。
+再生はデバイス側のコールバックがキューから音声を取り出して行うため、
+呼び出し元は音声をキューに積んだらすぐに次の処理へ進める。
+ユーザーが話し始めたときなどは stop() でキューを破棄し、すぐに再生を止められる（バージイン）。
+"""
+import threading
+import time
+from collections import deque
+
+# OpenAI TTS の pcm 形式（24kHz・16ビット・モノラル）に合わせる
+RATE = 24000
+CHANNELS = 1
+WIDTH = 2
+
+
+class PyAudioBackend:
+    """
+    PyAudioのコールバック方式による出力
+
+    Attributes:
+        latency: コールバックで渡した音声が実際に鳴るまでの遅延（秒）
+    """
+
+    latency = 0.0
+
+    def start(self, rate, channels, width, frames_per_buffer, fill):
+        import pyaudio
+
+        def callback(in_data, frame_count, time_info, status):
+            return fill(frame_count), pyaudio.paContinue
+
+        self._p = pyaudio.PyAudio()
+        self._stream = self._p.open(format=self._p.get_format_from_width(width),
+                                    channels=channels,
+                                    rate=rate,
+                                    output=True,
+                                    frames_per_buffer=frames_per_buffer,
+                                    stream_callback=callback)
+        self.latency = self._stream.get_output_latency()
+        self._stream.start_stream()
+
+    def stop(self):
+        self._stream.stop_stream()
+        self._stream.close()
+        self._p.terminate()
+
+
+class NullBackend:
+    """
+    何も再生しない出力（テスト・計測用）
+
+    デバイスと同じく、別スレッドから一定間隔でコールバックを呼び出して音声を取り出す。
+    realtime=False の場合、キューに音声がある間は待たずに取り出す。
+
+    Attributes:
+        written: 取り出した音声（無音を除く）のバイト数
+        first_audio_at: 最初に音声を取り出した時刻（time.perf_counter()）
+        last_audio_at: 最後に音声を取り出した時刻（time.perf_counter()）
+    """
+
+    def __init__(self, realtime=True):
+        self.realtime = realtime
+        self.written = 0
+        self.first_audio_at = None
+        self.last_audio_at = None
+
+    def start(self, rate, channels, width, frames_per_buffer, fill):
+        self._period = frames_per_buffer / rate
+        self._frames = frames_per_buffer
+        self._fill = fill
+        self._running = threading.Event()
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        next_at = time.perf_counter()
+        while self._running.is_set():
+            data = self._fill(self._frames)
+            if any(data):
+                now = time.perf_counter()
+                if self.first_audio_at is None:
+                    self.first_audio_at = now
+                self.last_audio_at = now
+                self.written += len(data)
+                if not self.realtime:
+                    continue
+            next_at = max(next_at + self._period, time.perf_counter() - self._period)
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+
+    def stop(self):
+        self._running.clear()
+        self._thread.join()
+
+
+class PlaybackEngine:
+    """
+    キューに積まれたPCMデータを、開いたままの出力デバイスで順に再生する
+
+    Args:
+        backend: 出力（未指定の場合は PyAudioBackend）
+        rate: サンプリングレート
+        channels: チャンネル数
+        width: サンプルのバイト数
+        frames_per_buffer: 1回のコールバックで渡すフレーム数（停止までの最大遅延になる）
+
+    出力（backend）が latency 属性を持つ場合は、最後の音声を渡してからその分だけ待って再生し終えたとみなす。
+    """
+
+    def __init__(self, backend=None, rate=RATE, channels=CHANNELS, width=WIDTH, frames_per_buffer=480):
+        self.backend = backend or PyAudioBackend()
+        self.rate = rate
+        self.channels = channels
+        self.width = width
+        self.frame_width = channels * width
+        self._lock = threading.Lock()
+        self._chunks = deque()
+        self._offset = 0
+        self._idle = threading.Event()
+        self._idle.set()
+        # キューの最後の音声が鳴り終わる時刻（time.perf_counter()）
+        self._drained_at = 0.0
+        self.closed = False
+        self.interrupted = 0
+        self.backend.start(rate, channels, width, frames_per_buffer, self._fill)
+
+    def _fill(self, frame_count):
+        # 出力デバイスのスレッドから呼ばれる（足りない分は無音で埋める）
+        size = frame_count * self.frame_width
+        out = bytearray()
+        with self._lock:
+            while self._chunks and len(out) < size:
+                chunk = self._chunks[0]
+                take = chunk[self._offset:self._offset + size - len(out)]
+                out += take
+                self._offset += len(take)
+                if self._offset >= len(chunk):
+                    self._chunks.popleft()
+                    self._offset = 0
+            if not self._chunks:
+                if out:
+                    # 最後の音声を出力に渡した（出力側のバッファの分と合わせて鳴り終わるまでは再生中とする）
+                    latency = getattr(self.backend, "latency", 0.0)
+                    self._drained_at = time.perf_counter() + len(out) / self.frame_width / self.rate + latency
+                elif not self._idle.is_set() and time.perf_counter() >= self._drained_at:
+                    self._idle.set()
+        if len(out) < size:
+            out += bytes(size - len(out))
+        return bytes(out)
+
+    def play(self, data):
+        """
+        PCMデータを再生キューに積む（再生の完了は待たない）
+        Args:
+            data: rate・channels・width の形式のPCMデータ
+        """
+        usable = len(data) - len(data) % self.frame_width
+        if not usable:
+            return
+        with self._lock:
+            if self.closed:
+                # 出力が止まっているため、積んでも再生されず wait() が終わらない
+                raise RuntimeError("再生エンジンは閉じられています。")
+            self._chunks.append(bytes(data[:usable]))
+            self._idle.clear()
+
+    @property
+    def playing(self):
+        """再生中（キューまたは出力側に未再生の音声がある）か"""
+        return not self._idle.is_set()
+
+    def wait(self, timeout=None):
+        """
+        キューの音声を再生し終えるまで待つ
+        Returns:
+            再生し終えた（または停止された）場合は True
+        """
+        return self._idle.wait(timeout)
+
+    def stop(self):
+        """
+        再生中の音声を破棄し、すぐに無音にする
+        Returns:
+            破棄した音声のバイト数
+        """
+        with self._lock:
+            dropped = sum(len(chunk) for chunk in self._chunks) - self._offset
+            self._chunks.clear()
+            self._offset = 0
+            self._idle.set()
+        # 出力先にも再生待ちの音声がある場合（ブラウザなど）は、それも破棄させる
+        flush = getattr(self.backend, "flush", None)
+        if flush is not None:
+            flush()
+        if dropped:
+            self.interrupted += 1
+        return dropped
+
+    def close(self):
+        """出力デバイスを閉じる（以降の play() はエラーになる）"""
+        with self._lock:
+            self.closed = True
+        self.stop()
+        self.backend.stop()
+
+
+class EngineOutput:
+    """
+    StreamingPlayer などの音声出力（open / write / close）として PlaybackEngine を使うアダプタ
+
+    write はキューに積むだけで、close も再生の完了を待たない。
+    """
+
+    def __init__(self, engine=None):
+        self._engine = engine
+
+    def open(self, rate, channels, width):
+        if self._engine is None:
+            self._engine = get_engine()
+        if (rate, channels, width) != (self._engine.rate, self._engine.channels, self._engine.width):
+            raise ValueError("再生エンジンと異なる形式の音声です。")
+
+    def write(self, data):
+        self._engine.play(data)
+
+    def close(self):
+        pass
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(backend=None):
+    """
+    プロセス全体で共有する再生エンジン（最初の呼び出し時に出力デバイスを開く）
+    Args:
+        backend: 最初の呼び出し時のみ有効な出力（未指定の場合は PyAudioBackend）
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = PlaybackEngine(backend)
+        return _engine
+
+
+def is_playing():
+    """再生エンジンが再生中か（まだ生成されていない場合は False）"""
+    return _engine is not None and _engine.playing
+
+
+def stop():
+    """再生中の音声を止める（再生エンジンが生成されていない場合は何もしない）"""
+    if _engine is not None:
+        return _engine.stop()
+    return 0
@@ -0,0 +1,174 @@
+"""
+問題文と読み上げ音声の先読み
+
+ユーザーが回答している間や評価結果を読んでいる間に、次の問題文の生成と
+音声合成を別スレッドで済ませておく。
+問題集（problem_bank）がある場合はそこから先に出題し、残り少なくなってから生成を始める。
+"""
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import tracing
+
+Problem = namedtuple("Problem", ["text", "audio"])
+
+# 先読みを待つ間に、中止・先読みスレッドの異常終了を確認する間隔（秒）
+POLL_INTERVAL = 0.5
+
+
+class ProblemPrefetcher:
+    """
+    問題文と読み上げ音声を、別スレッドで先に用意しておくキュー
+
+    Args:
+        generate: 問題文を生成する関数（引数なし、文字列を返す）
+        synthesize: 問題文を受け取り、読み上げ音声を返す関数
+        depth: 先に用意しておく問題の数（0 の場合は先読みせず、get() のたびに生成する）
+        bank: 先に出題する問題集の問題（problem_bank.Deck、未指定の場合はすべて生成する）
+        retry_delay: 生成に失敗した後、次に生成を試みるまでの秒数（続けて失敗するたびに倍にする）
+        max_retry_delay: retry_delay の上限（秒）
+    """
+
+    def __init__(self, generate, synthesize, depth=1, bank=None, retry_delay=1.0, max_retry_delay=30.0):
+        if depth < 0:
+            raise ValueError(f"depth は 0 以上を指定してください: {depth}")
+        self._generate = generate
+        self._synthesize = synthesize
+        self.depth = depth
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._bank = bank
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._cancelled = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.bank_hits = 0
+        self.wait_time = 0.0
+        # 続けて生成に失敗した回数
+        self.failures = 0
+        # 先読みスレッドを異常終了させた例外
+        self.error = None
+        self._thread = None
+        if bank is None or bank.remaining <= depth:
+            self._start()
+
+    def _start(self):
+        if self._thread is None and self.depth > 0:
+            self._thread = threading.Thread(target=tracing.bind(self._run), daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self._produce()
+        except BaseException as e:
+            self.error = e
+            raise
+
+    def _produce(self):
+        while not self._cancelled.is_set():
+            try:
+                text = self._generate()
+                if self._cancelled.is_set():
+                    break
+                item = Problem(text, self._synthesize(text))
+                self.failures = 0
+            except Exception as e:
+                # 取り出し側で例外を送出する
+                item = e
+                self.failures += 1
+            while not self._cancelled.is_set():
+                try:
+                    self._queue.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            if self.failures:
+                # APIの障害などで失敗が続く場合に、すぐに呼び出しを繰り返さない
+                delay = min(self.max_retry_delay, self.retry_delay * 2 ** (self.failures - 1))
+                self._cancelled.wait(delay)
+
+    def get(self):
+        """
+        次の問題を取り出す（用意できていなければ、できるまで待つ）
+
+        待っている間に中止された場合は RuntimeError を送出し、先読みスレッドが異常終了していた場合はその場で生成する。
+        Returns:
+            Problem
+        """
+        if self._cancelled.is_set():
+            raise RuntimeError("先読みは中止されています。")
+        if self._bank is not None:
+            problem = self._bank.next()
+            if self._bank.remaining <= self.depth:
+                # 問題集を使い切る前に、生成による先読みを始めておく
+                self._start()
+            if problem is not None:
+                self.bank_hits += 1
+                return problem
+        if self.depth == 0:
+            # 先読みしない場合は、その場で生成する
+            self.misses += 1
+            return self._make()
+        try:
+            item = self._queue.get_nowait()
+            self.hits += 1
+        except queue.Empty:
+            self.misses += 1
+            start = time.perf_counter()
+            try:
+                item = self._wait()
+            finally:
+                self.wait_time += time.perf_counter() - start
+            if item is None:
+                # 先読みスレッドが異常終了した場合は、その場で生成する
+                return self._make()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def _wait(self):
+        # 用意できるまで待つ（中止された場合は例外、先読みスレッドが終了している場合は None）
+        while True:
+            try:
+                return self._queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                pass
+            if self._cancelled.is_set():
+                raise RuntimeError("先読みは中止されています。")
+            if self._thread is None or not self._thread.is_alive():
+                return None
+
+    def _make(self):
+        start = time.perf_counter()
+        try:
+            text = self._generate()
+            return Problem(text, self._synthesize(text))
+        finally:
+            self.wait_time += time.perf_counter() - start
+
+    def cancel(self):
+        """先読みを中止し、用意済みの問題を破棄（生成中の問題は完了後に破棄される）"""
+        self._cancelled.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    @property
+    def hit_rate(self):
+        """待たずに出題できた割合（問題集からの出題を含む）"""
+        total = self.bank_hits + self.hits + self.misses
+        return (self.bank_hits + self.hits) / total if total else 0.0
+
+    def stats(self):
+        """先読みの効果（問題集からの出題数・ヒット数・ミス数・ヒット率・ミス時の合計待ち時間）"""
+        return {
+            "bank": self.bank_hits,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "wait_time": self.wait_time,
+        }
@@ -0,0 +1,331 @@
+"""
+問題集（事前に生成した問題文と読み上げ音声）
+
+シャドーイング・ディクテーションの問題文と読み上げ音声を build コマンドでまとめて生成しておき、
+出題時はネットワークを使わずに取り出す。
+音声はすべての問題分を1つのPCMファイル（24kHz・16ビット・モノラル）に連結してメモリマップで開き、
+索引には問題ごとの文・長さ・話し方（casual / business）・難易度と、PCMファイル内の位置を記録する。
+出題時に読み込むのは1問分の音声だけで、問題集を使い切った場合はその場での生成に切り替える。
+
+使い方:
+    python problem_bank.py build --per-cell 20 --workers 4
+    python problem_bank.py stats
+"""
+import argparse
+import itertools
+import json
+import mmap
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from pydub import AudioSegment
+
+import tts_stream
+from prefetch import Problem
+
+# 問題集のディレクトリ（空文字列の場合は使わない）
+PROBLEM_BANK = os.environ.get("PROBLEM_BANK", "data/problem_bank")
+
+# 長さの区分（単語数の範囲）
+LENGTHS = {"short": (10, 15), "long": (20, 30)}
+# 話し方
+REGISTERS = ("casual", "business")
+# 難易度（1: やさしい、2: ふつう、3: 難しい）
+DIFFICULTIES = (1, 2, 3)
+# モードごとに出題する長さ（chains の問題文の生成と同じ長さ）
+MODE_LENGTHS = {"シャドーイング": "long", "ディクテーション": "short"}
+
+PCM_FILE = "bank.pcm"
+INDEX_FILE = "index.json"
+
+
+class ProblemBank:
+    """
+    問題集の読み込み（索引はメモリ上に保持し、音声はPCMファイルのメモリマップから取り出す）
+
+    Args:
+        path: 問題集のディレクトリ
+    """
+
+    def __init__(self, path=PROBLEM_BANK):
+        self.path = Path(path)
+        index = json.loads((self.path / INDEX_FILE).read_text(encoding="utf-8"))
+        self.rate = index["rate"]
+        self.entries = index["entries"]
+        self._by_key = {}
+        for entry in self.entries:
+            self._by_key.setdefault((entry["length"], entry["register"], entry["difficulty"]), []).append(entry)
+        self._file = open(self.path / PCM_FILE, "rb")
+        # 空のファイルはメモリマップで開けない
+        self._pcm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.entries else b""
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find(self, length=None, register=None, difficulty=None):
+        """
+        条件に合う問題の索引（None の条件は問わない）
+        Returns:
+            索引のエントリ（"id", "text", "length", "register", "difficulty", "words", "offset", "size"）のリスト
+        """
+        entries = []
+        for (entry_length, entry_register, entry_difficulty), group in self._by_key.items():
+            if ((length is None or entry_length == length) and (register is None or entry_register == register)
+                    and (difficulty is None or entry_difficulty == difficulty)):
+                entries.extend(group)
+        return entries
+
+    def problem(self, entry):
+        """
+        問題文と読み上げ音声（音声はこの問題の分だけPCMファイルから読み込む）
+        Returns:
+            prefetch.Problem
+        """
+        pcm = self._pcm[entry["offset"]:entry["offset"] + entry["size"]]
+        audio = AudioSegment(pcm, frame_rate=self.rate, sample_width=tts_stream.PCM_WIDTH, channels=tts_stream.PCM_CHANNELS)
+        return Problem(entry["text"], audio)
+
+    def deck(self, length=None, register=None, difficulty=None, seen=()):
+        """
+        条件に合う問題を、ランダムな順で1問ずつ出題する Deck
+        Args:
+            seen: 出題済みの問題文（出題しない）
+        """
+        seen = set(seen)
+        entries = [entry for entry in self.find(length, register, difficulty) if entry["text"] not in seen]
+        random.shuffle(entries)
+        return Deck(self, entries)
+
+    def stats(self):
+        """長さ・話し方・難易度ごとの問題数と、音声の合計時間（秒）"""
+        return {
+            "problems": len(self.entries),
+            "seconds": sum(entry["size"] for entry in self.entries) / (self.rate * tts_stream.PCM_WIDTH),
+            "cells": {"/".join(map(str, key)): len(group) for key, group in sorted(self._by_key.items())},
+        }
+
+    def close(self):
+        if isinstance(self._pcm, mmap.mmap):
+            self._pcm.close()
+        self._file.close()
+
+
+class Deck:
+    """
+    1つのセッション・モードで出題する問題の並び（同じ問題は出題しない）
+
+    ProblemPrefetcher の bank に渡すと、問題集の問題から先に出題する。
+    """
+
+    def __init__(self, bank, entries):
+        self.bank = bank
+        self._entries = list(entries)
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self):
+        """残りの問題数"""
+        return len(self._entries)
+
+    def next(self):
+        """
+        次の問題
+        Returns:
+            prefetch.Problem（使い切った場合は None）
+        """
+        with self._lock:
+            if not self._entries:
+                return None
+            entry = self._entries.pop()
+        return self.bank.problem(entry)
+
+
+class BankWriter:
+    """
+    問題集への追加（音声はPCMファイルの末尾に追記し、commit で索引を書き換える）
+
+    追記中も既存の問題の位置は変わらないため、開いている ProblemBank はそのまま使える。
+
+    Args:
+        path: 問題集のディレクトリ（存在しない場合は作成）
+    """
+
+    def __init__(self, path=PROBLEM_BANK):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        index_path = self.path / INDEX_FILE
+        index = json.loads(index_path.read_text(encoding="utf-8")) if index_path.exists() else {"entries": []}
+        self.entries = index["entries"]
+        self.texts = {entry["text"] for entry in self.entries}
+        self._lock = threading.Lock()
+        self._file = open(self.path / PCM_FILE, "ab")
+        # 索引に記録されていない末尾（前回の中断で書きかけた音声）は使わない
+        self._file.truncate(max((entry["offset"] + entry["size"] for entry in self.entries), default=0))
+        self._file.seek(0, os.SEEK_END)
+
+    def add(self, text, pcm, length, register, difficulty):
+        """
+        問題を追加（同じ問題文がすでにある場合は追加しない）
+        Returns:
+            追加した場合は True
+        """
+        with self._lock:
+            if text in self.texts:
+                return False
+            offset = self._file.tell()
+            self._file.write(pcm)
+            self.entries.append({
+                "id": len(self.entries), "text": text, "length": length, "register": register,
+                "difficulty": difficulty, "words": len(text.split()), "offset": offset, "size": len(pcm),
+            })
+            self.texts.add(text)
+            return True
+
+    def count(self, length, register, difficulty):
+        """長さ・話し方・難易度が一致する問題の数"""
+        with self._lock:
+            return sum((e["length"], e["register"], e["difficulty"]) == (length, register, difficulty) for e in self.entries)
+
+    def commit(self):
+        """追記した音声を書き出し、索引を置き換える"""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            index_path = self.path / INDEX_FILE
+            tmp_path = index_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps({"rate": tts_stream.PCM_RATE, "entries": self.entries}, ensure_ascii=False),
+                                encoding="utf-8")
+            os.replace(tmp_path, index_path)
+
+    def close(self):
+        self.commit()
+        self._file.close()
+
+
+def build(path, client, per_cell=20, workers=4, model="tts-1", voice="alloy", lengths=None, registers=REGISTERS,
+          difficulties=DIFFICULTIES, attempts=3):
+    """
+    長さ・話し方・難易度の組み合わせごとに、問題文と読み上げ音声を生成して問題集に追加
+    Args:
+        path: 問題集のディレクトリ（既存の問題集には足りない分だけ追加する）
+        client: OpenAIクライアント
+        per_cell: 組み合わせごとの問題数
+        workers: 同時に生成・合成する数
+        model: TTSモデル
+        voice: 声の種類
+        lengths: 長さの区分の名前のリスト（未指定の場合は LENGTHS のすべて）
+        registers: 話し方のリスト
+        difficulties: 難易度のリスト
+        attempts: 組み合わせごとに問題文の生成を試みる回数（重複・長さの外れを除いて足りない場合）
+    Returns:
+        {"added", "skipped", "elapsed"}
+    """
+    import chains
+
+    start = time.perf_counter()
+    writer = BankWriter(path)
+    cells = list(itertools.product(lengths or LENGTHS, registers, difficulties))
+    added, skipped = 0, 0
+
+    def generate(cell):
+        length, register, difficulty = cell
+        low, high = LENGTHS[length]
+        sentences = []
+        for _ in range(attempts):
+            missing = per_cell - writer.count(*cell) - len(sentences)
+            if missing <= 0:
+                break
+            for text in chains.generate_problems(register, difficulty, low, high, missing):
+                # 指定の長さから大きく外れた文・重複は使わない
+                if low - 2 <= len(text.split()) <= high + 2 and text not in writer.texts and text not in sentences:
+                    sentences.append(text)
+        return [(text, cell) for text in sentences[:max(0, per_cell - writer.count(*cell))]]
+
+    def synthesize(text):
+        return b"".join(tts_stream.iter_speech_pcm(client, text, model=model, voice=voice, cache=False))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        problems = [problem for sentences in executor.map(generate, cells) for problem in sentences]
+        futures = {executor.submit(synthesize, text): (text, cell) for text, cell in problems}
+        for i, future in enumerate(as_completed(futures), 1):
+            text, cell = futures[future]
+            try:
+                if writer.add(text, future.result(), *cell):
+                    added += 1
+            except Exception as e:
+                skipped += 1
+                print(f"音声合成に失敗しました（{text}）: {e}")
+            # 中断しても合成済みの分は残るよう、一定数ごとに索引を書き出す
+            if i % 20 == 0:
+                writer.commit()
+                print(f"{i}/{len(futures)} 問", flush=True)
+    writer.close()
+    return {"added": added, "skipped": skipped, "elapsed": time.perf_counter() - start}
+
+
+_bank = None
+_bank_lock = threading.Lock()
+
+
+def get_bank():
+    """プロセス全体で共有する ProblemBank（PROBLEM_BANK が無効、または問題集が作られていない場合は None）"""
+    global _bank
+    with _bank_lock:
+        if _bank is None and PROBLEM_BANK and (Path(PROBLEM_BANK) / INDEX_FILE).exists():
+            _bank = ProblemBank(PROBLEM_BANK)
+        return _bank
+
+
+def deck(mode, seen=(), register=None, difficulty=None):
+    """
+    モードの長さの問題を出題する Deck（問題集がない場合は None）
+    Args:
+        mode: "シャドーイング" または "ディクテーション"
+        seen: 出題済みの問題文（出題しない）
+        register: 話し方（未指定の場合はすべて）
+        difficulty: 難易度（未指定の場合はすべて）
+    """
+    bank = get_bank()
+    if bank is None:
+        return None
+    return bank.deck(MODE_LENGTHS[mode], register, difficulty, seen)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="問題集の作成と確認")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="問題文と読み上げ音声を生成して追加")
+    build_parser.add_argument("--path", default=PROBLEM_BANK or "data/problem_bank")
+    build_parser.add_argument("--per-cell", type=int, default=20, help="長さ・話し方・難易度の組み合わせごとの問題数")
+    build_parser.add_argument("--workers", type=int, default=4)
+    build_parser.add_argument("--lengths", nargs="+", choices=list(LENGTHS), default=list(LENGTHS))
+    build_parser.add_argument("--voice", default="alloy")
+    build_parser.add_argument("--base-url", help="OpenAI APIの接続先（代替サーバーなど）")
+    stats_parser = subparsers.add_parser("stats", help="組み合わせごとの問題数")
+    stats_parser.add_argument("--path", default=PROBLEM_BANK or "data/problem_bank")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if args.base_url:
+            os.environ["OPENAI_BASE_URL"] = args.base_url
+            os.environ.setdefault("OPENAI_API_KEY", "dummy")
+        import chains
+
+        result = build(args.path, chains.get_openai_client(), per_cell=args.per_cell, workers=args.workers,
+                       voice=args.voice, lengths=args.lengths)
+        print(f"{result['added']} 問を追加、{result['skipped']} 問は失敗（{result['elapsed']:.1f}秒）")
+
+    if not (Path(args.path) / INDEX_FILE).exists():
+        raise SystemExit(f"問題集がありません: {args.path}（python problem_bank.py build で作成してください）")
+    stats = ProblemBank(args.path).stats()
+    print(f"{stats['problems']} 問（音声 {stats['seconds'] / 60:.1f}分）")
+    for cell, count in stats["cells"].items():
+        print(f"  {cell:<20}{count:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+問題文と回答文の単語単位の比較
+
+問題文と回答文を正規化した単語列にし、編集距離（レーベンシュタイン距離）で
+対応付けて、誤った単語・抜けた単語・余分な単語と単語誤り率（WER）を求める。
+LLMを呼ばずにその場で結果を出せる。
+"""
+import re
+import unicodedata
+
+# 単語の一部とみなす記号（アポストロフィ・ハイフン）以外の記号は除去
+WORD = re.compile(r"[a-z0-9]+(?:['\-][a-z0-9]+)*")
+# 空白を挟まずに単語をつなぐ記号（"Hello,world" のカンマや "wait--what" のダッシュなど）
+GLUE = re.compile(r"(?<=\w)(?:[^\w\s'’‘-]|-{2,})+(?=\w)")
+
+EQUAL = "equal"
+SUBSTITUTE = "substitute"
+DELETE = "delete"
+INSERT = "insert"
+
+
+def normalize(text):
+    """
+    比較用にテキストを正規化
+    Args:
+        text: 英文
+    Returns:
+        小文字化・記号除去した単語のリスト
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = text.replace("’", "'").replace("‘", "'")
+    # アクセント記号を除去（café → cafe）
+    text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return WORD.findall(text)
+
+
+def _split_glue(match):
+    # 数字の間の小数点・桁区切り（3.5 や 1,000）は区切らない
+    text, start, end = match.string, match.start(), match.end()
+    if match.group() in (".", ",") and text[start - 1].isdigit() and text[end].isdigit():
+        return match.group()
+    return match.group() + " "
+
+
+def tokenize(text):
+    """
+    表示用の単語と比較用の単語の組に分割
+    空白だけでなく、単語の間の記号でも区切る（記号を除去して "helloworld" のように1語につなげない）。
+    Returns:
+        (表示用の単語, 比較用の単語) のリスト（比較用の単語がないものは除外）
+    """
+    tokens = []
+    for word in GLUE.sub(_split_glue, text).split():
+        normalized = normalize(word)
+        if normalized:
+            tokens.append((word, "".join(normalized)))
+    return tokens
+
+
+def align(reference, hypothesis):
+    """
+    2つの単語列を編集距離が最小になるように対応付け
+    Args:
+        reference: 正解の単語のリスト
+        hypothesis: 回答の単語のリスト
+    Returns:
+        (操作, 正解の位置, 回答の位置) のリスト（対応する単語がない側の位置は None）
+    """
+    n, m = len(reference), len(hypothesis)
+    # dist[i][j]: reference[:i] と hypothesis[:j] の編集距離
+    dist = [[0] * (m + 1) for _ in range(n + 1)]
+    for i in range(n + 1):
+        dist[i][0] = i
+    for j in range(m + 1):
+        dist[0][j] = j
+    for i in range(1, n + 1):
+        row, prev = dist[i], dist[i - 1]
+        for j in range(1, m + 1):
+            cost = 0 if reference[i - 1] == hypothesis[j - 1] else 1
+            row[j] = min(prev[j - 1] + cost, prev[j] + 1, row[j - 1] + 1)
+
+    # 末尾からたどる（同点の場合は 一致/置換 → 抜け → 追加 の順に優先し、結果を決定的にする）
+    ops = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        if i > 0 and j > 0:
+            cost = 0 if reference[i - 1] == hypothesis[j - 1] else 1
+            if dist[i][j] == dist[i - 1][j - 1] + cost:
+                ops.append((EQUAL if cost == 0 else SUBSTITUTE, i - 1, j - 1))
+                i, j = i - 1, j - 1
+                continue
+        if i > 0 and dist[i][j] == dist[i - 1][j] + 1:
+            ops.append((DELETE, i - 1, None))
+            i -= 1
+        else:
+            ops.append((INSERT, None, j - 1))
+            j -= 1
+    ops.reverse()
+    return ops
+
+
+class ScoreResult:
+    """
+    比較結果
+
+    Attributes:
+        diffs: (操作, 問題文の単語, 回答文の単語) のリスト
+        correct: 正しく再現できた単語数
+        substitutions: 誤った単語数
+        deletions: 抜けた単語数
+        insertions: 余分な単語数
+        reference_length: 問題文の単語数
+    """
+
+    def __init__(self, reference_tokens, hypothesis_tokens, ops):
+        self.diffs = [
+            (op, reference_tokens[i][0] if i is not None else None, hypothesis_tokens[j][0] if j is not None else None)
+            for op, i, j in ops
+        ]
+        self.correct = sum(1 for op, _, _ in ops if op == EQUAL)
+        self.substitutions = sum(1 for op, _, _ in ops if op == SUBSTITUTE)
+        self.deletions = sum(1 for op, _, _ in ops if op == DELETE)
+        self.insertions = sum(1 for op, _, _ in ops if op == INSERT)
+        self.reference_length = len(reference_tokens)
+
+    @property
+    def errors(self):
+        return self.substitutions + self.deletions + self.insertions
+
+    @property
+    def wer(self):
+        """単語誤り率（問題文の単語数に対する、誤り・抜け・余分な単語の合計の割合）"""
+        if self.reference_length == 0:
+            return 0.0 if self.insertions == 0 else 1.0
+        return self.errors / self.reference_length
+
+    @property
+    def accuracy(self):
+        """問題文の単語のうち、正しく再現できた割合"""
+        return self.correct / self.reference_length if self.reference_length else 1.0
+
+    def correct_phrases(self):
+        """正しく再現できた、連続した単語のまとまり"""
+        phrases, current = [], []
+        for op, ref, _ in self.diffs:
+            if op == EQUAL:
+                current.append(ref)
+            elif op != INSERT and current:
+                phrases.append(" ".join(current))
+                current = []
+        if current:
+            phrases.append(" ".join(current))
+        return phrases
+
+    def problems(self):
+        """改善が必要な箇所の説明"""
+        items = []
+        for op, ref, hyp in self.diffs:
+            if op == SUBSTITUTE:
+                items.append(f"「{ref}」→「{hyp}」（誤り）")
+            elif op == DELETE:
+                items.append(f"「{ref}」が抜けています（抜け）")
+            elif op == INSERT:
+                items.append(f"「{hyp}」は問題文にありません（追加）")
+        return items
+
+    def to_markdown(self):
+        """評価結果の表示用テキスト"""
+        lines = [
+            "【評価】",
+            "",
+            f"正答率: {self.accuracy:.0%}（{self.correct}/{self.reference_length}語）　単語誤り率（WER）: {self.wer:.0%}",
+            "",
+            "✓ 正確に再現できた部分",
+            "",
+        ]
+        lines += [f"- {phrase}" for phrase in self.correct_phrases()] or ["- なし"]
+        lines += ["", "△ 改善が必要な部分", ""]
+        lines += [f"- {item}" for item in self.problems()] or ["- なし（完璧です！）"]
+        return "\n".join(lines)
+
+    def summary(self):
+        """LLMにアドバイスを依頼する際に渡す、比較結果の要約"""
+        problems = self.problems()
+        return f"正答率 {self.accuracy:.0%}、WER {self.wer:.0%}。" + ("、".join(problems) if problems else "誤りなし。")
+
+
+def score(reference, hypothesis):
+    """
+    問題文と回答文を単語単位で比較
+    Args:
+        reference: 問題文
+        hypothesis: ユーザーによる回答文
+    Returns:
+        ScoreResult
+    """
+    reference_tokens = tokenize(reference)
+    hypothesis_tokens = tokenize(hypothesis)
+    ops = align([t[1] for t in reference_tokens], [t[1] for t in hypothesis_tokens])
+    return ScoreResult(reference_tokens, hypothesis_tokens, ops)
@@ -0,0 +1,282 @@
+"""
+会話履歴・問題・評価結果の保存（SQLite）
+
+会話のメッセージ・出題した問題文・評価結果をセッションごとにSQLiteに保存し、
+プロセスを再起動しても同じセッションの続きから再開できるようにする。
+画面には直近のメッセージだけを読み込んで表示するため、履歴が伸びても
+再実行ごとの処理量は変わらない（古いメッセージは必要になったときに読み込む）。
+
+使い方（セッションの一覧）:
+    python session_store.py data/history.db
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# 保存先のSQLiteファイル（空文字列の場合はメモリ上に保持し、再起動で消える）
+HISTORY_DB = os.environ.get("HISTORY_DB", "data/history.db")
+# 画面に表示する直近のメッセージ数（「以前の会話を表示」でこの件数ずつ増やす）
+HISTORY_WINDOW = int(os.environ.get("HISTORY_WINDOW", "20"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(id),
+    mode TEXT,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session_time ON messages(session_id, created_at, id);
+CREATE TABLE IF NOT EXISTS problems (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(id),
+    mode TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS problems_session_time ON problems(session_id, created_at);
+CREATE TABLE IF NOT EXISTS scores (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(id),
+    problem_id INTEGER REFERENCES problems(id),
+    answer TEXT NOT NULL,
+    accuracy REAL,
+    wer REAL,
+    rhythm REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scores_session_time ON scores(session_id, created_at);
+"""
+
+
+class SessionStore:
+    """
+    セッションごとの会話履歴・問題・評価結果を保存するSQLiteデータベース
+
+    1つの接続をスレッド間で共有し、読み書きはロックで直列化する（1回の処理は数十マイクロ秒程度）。
+
+    Args:
+        path: SQLiteファイル（None の場合はメモリ上に保持）
+    """
+
+    def __init__(self, path=None):
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # 書き込み中も読み込みを妨げないようにし、書き込みごとの fsync を減らす
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def session(self, session_id=None):
+        """
+        セッションを開く（存在しない場合は作成）
+        Args:
+            session_id: 再開するセッションのID（未指定の場合は新しいセッション）
+        Returns:
+            Session
+        """
+        session_id = session_id or uuid.uuid4().hex
+        now = time.time()
+        self._execute("INSERT OR IGNORE INTO sessions (id, created_at, updated_at) VALUES (?, ?, ?)",
+                      (session_id, now, now))
+        return Session(self, session_id)
+
+    def add_message(self, session_id, role, content, mode=None):
+        """
+        メッセージを追加
+        Returns:
+            メッセージのID
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO messages (session_id, mode, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, mode, role, content, now)
+            )
+            self._conn.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (now, session_id))
+        return cursor.lastrowid
+
+    def recent_messages(self, session_id, limit, mode=None):
+        """
+        直近のメッセージ
+        Args:
+            session_id: セッションのID
+            limit: 読み込む件数
+            mode: 指定した場合は、そのモードのメッセージのみ
+        Returns:
+            {"role", "content", "mode", "created_at"} のリスト（古い順）
+        """
+        if mode is None:
+            rows = self._query(
+                "SELECT role, content, mode, created_at FROM messages WHERE session_id = ? "
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
+                (session_id, limit)
+            )
+        else:
+            rows = self._query(
+                "SELECT role, content, mode, created_at FROM messages WHERE session_id = ? AND mode = ? "
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
+                (session_id, mode, limit)
+            )
+        return [dict(row) for row in reversed(rows)]
+
+    def add_problem(self, session_id, mode, text):
+        """
+        出題した問題文を追加
+        Returns:
+            問題のID
+        """
+        return self._execute(
+            "INSERT INTO problems (session_id, mode, text, created_at) VALUES (?, ?, ?, ?)",
+            (session_id, mode, text, time.time())
+        ).lastrowid
+
+    def problems(self, session_id, mode=None):
+        """出題した問題文の一覧（古い順）"""
+        if mode is None:
+            rows = self._query("SELECT text FROM problems WHERE session_id = ? ORDER BY created_at", (session_id,))
+        else:
+            rows = self._query("SELECT text FROM problems WHERE session_id = ? AND mode = ? ORDER BY created_at",
+                               (session_id, mode))
+        return [row["text"] for row in rows]
+
+    def add_score(self, session_id, problem_id, answer, score, rhythm=None):
+        """
+        評価結果を追加
+        Args:
+            session_id: セッションのID
+            problem_id: 問題のID
+            answer: ユーザーによる回答文
+            score: scoring.ScoreResult
+            rhythm: acoustic.AcousticScore（シャドーイングのみ）
+        Returns:
+            評価結果のID
+        """
+        return self._execute(
+            "INSERT INTO scores (session_id, problem_id, answer, accuracy, wer, rhythm, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (session_id, problem_id, answer, score.accuracy, score.wer,
+             rhythm.overall if rhythm is not None else None, time.time())
+        ).lastrowid
+
+    def scores(self, session_id, mode=None):
+        """
+        評価結果の一覧（古い順）
+        Returns:
+            {"mode", "problem", "answer", "accuracy", "wer", "rhythm", "created_at"} のリスト
+        """
+        sql = ("SELECT p.mode, p.text AS problem, s.answer, s.accuracy, s.wer, s.rhythm, s.created_at "
+               "FROM scores s LEFT JOIN problems p ON p.id = s.problem_id WHERE s.session_id = ?")
+        params = (session_id,)
+        if mode is not None:
+            sql += " AND p.mode = ?"
+            params += (mode,)
+        return [dict(row) for row in self._query(sql + " ORDER BY s.created_at", params)]
+
+    def sessions(self, limit=20):
+        """最近更新されたセッションの一覧（新しい順）"""
+        rows = self._query(
+            "SELECT s.id, s.created_at, s.updated_at, "
+            "(SELECT COUNT(*) FROM messages m WHERE m.session_id = s.id) AS messages, "
+            "(SELECT AVG(accuracy) FROM scores c WHERE c.session_id = s.id) AS accuracy "
+            "FROM sessions s ORDER BY s.updated_at DESC LIMIT ?",
+            (limit,)
+        )
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Session:
+    """
+    1つのセッションの履歴（SessionStore のメソッドをセッションIDを固定して呼び出す）
+
+    Attributes:
+        id: セッションのID
+    """
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.id = session_id
+
+    def add_message(self, role, content, mode=None):
+        return self.store.add_message(self.id, role, content, mode)
+
+    def recent_messages(self, limit, mode=None):
+        return self.store.recent_messages(self.id, limit, mode)
+
+    def window(self, limit):
+        """
+        画面に表示する直近のメッセージ
+        Returns:
+            (古い順のメッセージのリスト, それより前のメッセージがあるか)
+        """
+        messages = self.store.recent_messages(self.id, limit + 1)
+        return messages[-limit:] if limit else [], len(messages) > limit
+
+    def add_problem(self, mode, text):
+        return self.store.add_problem(self.id, mode, text)
+
+    def problems(self, mode=None):
+        return self.store.problems(self.id, mode)
+
+    def add_score(self, problem_id, answer, score, rhythm=None):
+        return self.store.add_score(self.id, problem_id, answer, score, rhythm)
+
+    def scores(self, mode=None):
+        return self.store.scores(self.id, mode)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """プロセス全体で共有する SessionStore（最初の呼び出し時にファイルを開く）"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore(HISTORY_DB or None)
+        return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="保存されたセッションの一覧")
+    parser.add_argument("path", nargs="?", default=HISTORY_DB or "data/history.db")
+    parser.add_argument("--last", type=int, default=20, help="表示するセッション数")
+    args = parser.parse_args()
+
+    store = SessionStore(args.path)
+    print(f"{'セッション':<34}{'更新日時':<22}{'メッセージ':>8}{'正答率':>8}")
+    for session in store.sessions(args.last):
+        updated = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(session["updated_at"]))
+        accuracy = f"{session['accuracy']:.0%}" if session["accuracy"] is not None else "-"
+        print(f"{session['id']:<34}{updated:<22}{session['messages']:>8}{accuracy:>8}")
+
+
+if __name__ == "__main__":
+    main()
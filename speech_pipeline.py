@@ -0,0 +1,193 @@
+"""
+LLMの応答を文単位で読み上げるパイプライン
+
+LLMの応答をストリーミングで受け取り、文が完成するたびに音声合成を開始する。
+合成は複数の文を並行して行い、再生は文の順番どおりに行う。
+応答全体の生成・合成を待たずに話し始めるため、最初の音声までの時間が短くなる。
+"""
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import orchestrator
+import tracing
+from tts_stream import StreamingPlayer, iter_speech_pcm
+
+# 文末とみなさない略語
+ABBREVIATIONS = {"mr.", "mrs.", "ms.", "dr.", "prof.", "st.", "vs.", "etc.", "e.g.", "i.e.", "a.m.", "p.m."}
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+|\n+')
+
+
+class SentenceSplitter:
+    """
+    トークンを順に受け取り、完成した文を返す
+
+    Args:
+        min_chars: この文字数に満たない文は、次の文とまとめて返す（短すぎる合成を避ける）
+    """
+
+    def __init__(self, min_chars=20):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, token):
+        """
+        トークンを追加し、完成した文のリストを返す
+        """
+        self._buffer += token
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            candidate = self._buffer[start:match.end()]
+            last_word = self._buffer[start:match.start() + 1].split()[-1:] or [""]
+            if last_word[0].lower() in ABBREVIATIONS or len(candidate.strip()) < self.min_chars:
+                continue
+            sentences.append(candidate.strip())
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """残りのテキストを最後の文として返す"""
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return [rest] if rest else []
+
+
+def split_sentences(tokens, min_chars=20):
+    """
+    トークンの列を文の列に変換
+    Args:
+        tokens: 文字列のイテラブル
+        min_chars: 1文の最小文字数
+    """
+    splitter = SentenceSplitter(min_chars=min_chars)
+    for token in tokens:
+        yield from splitter.feed(token)
+    yield from splitter.flush()
+
+
+def stream_chain_reply(chain, user_input):
+    """
+    ConversationChain の応答をトークン単位で返す（応答が完了したら会話履歴に保存）
+    Args:
+        chain: ConversationChain
+        user_input: ユーザーの発話
+    """
+    history = chain.memory.load_memory_variables({})
+    messages = chain.prompt.format_messages(input=user_input, **history)
+    reply = []
+    with tracing.span("chain.stream") as attrs:
+        start = time.time()
+        for chunk in chain.llm.stream(messages):
+            if chunk.content:
+                if not reply:
+                    attrs["first_token"] = time.time() - start
+                reply.append(chunk.content)
+                yield chunk.content
+    chain.memory.save_context({chain.input_key: user_input}, {chain.output_key: "".join(reply)})
+
+
+class _Segment:
+    """1文分の合成結果を、届いた順に受け渡すキュー"""
+
+    def __init__(self, text):
+        self.text = text
+        self.chunks = queue.Queue()
+
+    def synthesize(self, client, model, voice, deadline=None):
+        try:
+            for chunk in iter_speech_pcm(client, self.text, model=model, voice=voice, deadline=deadline):
+                self.chunks.put(chunk)
+        except Exception as e:
+            self.chunks.put(e)
+        finally:
+            self.chunks.put(None)
+
+
+def speak_sentences(sentences, client, speed=1.0, max_workers=3, model="tts-1", voice="alloy",
+                    output=None, on_sentence=None):
+    """
+    文の列を並行して音声合成し、順番どおりに読み上げる
+    Args:
+        sentences: 文のイテラブル（生成されるたびに合成を開始する）
+        client: OpenAIクライアント
+        speed: 再生速度
+        max_workers: 同時に合成する文の数
+        model: TTSモデル
+        voice: 声の種類
+        output: 音声出力（未指定の場合は共有の再生エンジン）
+        on_sentence: 文が完成するたびに、それまでのテキスト全体を受け取るコールバック
+    Returns:
+        (読み上げたテキスト全体, 読み上げた音声のPCMデータ)
+    """
+    player = StreamingPlayer(speed=speed, output=output)
+    # 合成は別スレッドで行うため、呼び出し元のターンの持ち時間を渡す
+    deadline = orchestrator.current_deadline()
+    order = queue.Queue()
+    pcm = []
+    errors = []
+
+    def play_in_order():
+        # 先に合成が終わった文があっても、前の文の再生が終わるまで待つ
+        while True:
+            segment = order.get()
+            if segment is None:
+                break
+            while True:
+                chunk = segment.chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    errors.append(chunk)
+                    continue
+                pcm.append(chunk)
+                player.feed(chunk)
+
+    playback = threading.Thread(target=tracing.bind(play_in_order), daemon=True)
+    playback.start()
+
+    texts = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for sentence in sentences:
+                texts.append(sentence)
+                segment = _Segment(sentence)
+                executor.submit(tracing.bind(segment.synthesize), client, model, voice, deadline)
+                order.put(segment)
+                if on_sentence is not None:
+                    on_sentence(" ".join(texts))
+    finally:
+        order.put(None)
+        playback.join()
+        player.close()
+
+    if errors:
+        raise errors[0]
+    return " ".join(texts), b"".join(pcm)
+
+
+def speak_reply(chain, user_input, client, speed=1.0, max_workers=3, model="tts-1", voice="alloy",
+                output=None, on_sentence=None):
+    """
+    ConversationChain の応答を、生成しながら文単位で読み上げる
+    Args:
+        chain: ConversationChain
+        user_input: ユーザーの発話
+        client: OpenAIクライアント
+        その他: speak_sentences と同じ
+    Returns:
+        (応答テキスト, 読み上げた音声のPCMデータ)
+    """
+    tokens = []
+
+    def collect():
+        for token in stream_chain_reply(chain, user_input):
+            tokens.append(token)
+            yield token
+
+    _, pcm = speak_sentences(split_sentences(collect()), client, speed=speed, max_workers=max_workers,
+                             model=model, voice=voice, output=output, on_sentence=on_sentence)
+    return "".join(tokens), pcm
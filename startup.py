@@ -0,0 +1,53 @@
+"""
+起動の高速化
+
+最初の画面の表示に必要なのは streamlit と軽いモジュールだけのため、会話・音声処理の重いモジュール
+（langchain・openai・pydub・scipy などを読み込む）は、画面を表示してから別スレッドで読み込み始め、
+「英会話開始」を押したときに読み込みの完了を待つ。
+読み込んだモジュールはプロセス全体で共有されるため、2つ目以降のセッションや再実行では読み込まない。
+"""
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 英会話を始めるときに必要になる重いモジュール（この順に読み込む）
+HEAVY_MODULES = ("chains", "functions", "speech_pipeline", "prefetch", "problem_bank", "scoring", "acoustic")
+
+_thread = None
+_lock = threading.Lock()
+# 重いモジュールの読み込みにかかった時間（秒、読み込み中は None）
+elapsed = None
+
+
+def _load():
+    global elapsed
+    start = time.perf_counter()
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            # 使う側でもう一度読み込み、そこでエラーを表示する
+            logger.warning("%s の事前読み込みに失敗しました", name, exc_info=True)
+    elapsed = time.perf_counter() - start
+
+
+def preload():
+    """
+    重いモジュールの読み込みを別スレッドで開始（プロセスで最初の呼び出し時のみ）
+    Returns:
+        読み込みを行うスレッド
+    """
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_load, name="preload", daemon=True)
+            _thread.start()
+        return _thread
+
+
+def wait():
+    """重いモジュールの読み込みが終わるまで待つ（始まっていない場合は開始して待つ）"""
+    preload().join()
@@ -0,0 +1,118 @@
+"""
+録音しながらの逐次音声認識
+
+録音中の音声を発話の切れ目（短い無音）で区切り、区切った区間ごとに別スレッドで
+文字起こしを始めておく。話し終えた時点で残っているのは最後の短い区間だけになり、
+各区間の結果を順番につなげて全体の文字起こしとする。
+"""
+import io
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import numpy as np
+from scipy.io.wavfile import write
+
+import orchestrator
+import tracing
+
+Transcript = namedtuple("Transcript", ["text", "segments"])
+
+# 区間の文字起こし（プロセス全体で共有）
+_executor = ThreadPoolExecutor(max_workers=4)
+
+
+def stitch(texts):
+    """区間ごとの文字起こしを順番につなげる"""
+    return " ".join(text.strip() for text in texts if text and text.strip())
+
+
+class StreamingTranscriber:
+    """
+    録音ブロックを受け取り、発話の切れ目ごとに文字起こしを開始する
+
+    Args:
+        transcribe: WAV形式の音声データ（BytesIO）を受け取り、text 属性を持つ結果を返す関数
+        fs: サンプリングレート
+        pause_ms: この時間だけ無音が続いたら区間を区切る（ターン終了の判定より短くする）
+        min_segment_s: これより短い区間は区切らず、次の区間とまとめる
+        max_segment_s: 無音がなくても、この長さで区切る
+        preroll_ms: 発話の前に残しておく無音の長さ（語頭の欠けを防ぐ）
+    """
+
+    def __init__(self, transcribe, fs=48000, pause_ms=300, min_segment_s=1.0, max_segment_s=15.0, preroll_ms=200):
+        self._transcribe = transcribe
+        self.fs = fs
+        self.pause_ms = pause_ms
+        self.min_samples = int(fs * min_segment_s)
+        self.max_samples = int(fs * max_segment_s)
+        self.preroll_samples = int(fs * preroll_ms / 1000)
+        self._blocks = []
+        self._samples = 0
+        self._has_speech = False
+        self._speech_ms = 0.0
+        self._futures = []
+        self.wait_time = 0.0
+
+    def feed(self, block, vad):
+        """
+        録音ブロックを追加し、発話の切れ目であれば区間の文字起こしを開始
+        Args:
+            block: (サンプル数, チャンネル数) の float 音声
+            vad: このブロックを判定済みの VoiceActivityDetector
+        """
+        # sounddevice は読み込みごとに新しい配列を返すため、コピーせずに保持できる
+        self._blocks.append(block)
+        self._samples += len(block)
+        if vad.speech_ms > self._speech_ms:
+            self._has_speech = True
+        self._speech_ms = vad.speech_ms
+
+        if not self._has_speech:
+            # 発話が始まるまでは、直前の無音だけを残す
+            while len(self._blocks) > 1 and self._samples - len(self._blocks[0]) >= self.preroll_samples:
+                self._samples -= len(self._blocks.pop(0))
+            return
+
+        paused = not vad.in_speech and vad.silence_ms >= self.pause_ms
+        if (paused and self._samples >= self.min_samples) or self._samples >= self.max_samples:
+            self._submit()
+
+    def _submit(self):
+        blocks = self._blocks
+        self._blocks = []
+        self._samples = 0
+        self._has_speech = False
+        self._futures.append(_executor.submit(tracing.bind(self._run), blocks, len(self._futures)))
+
+    def _run(self, blocks, index):
+        samples = np.concatenate(blocks)
+        wav_buffer = io.BytesIO()
+        write(wav_buffer, self.fs, np.int16(np.clip(samples, -1, 1) * 32767))
+        # OpenAI APIはファイル名の拡張子から形式を判定する
+        wav_buffer.name = f"recorded_audio_segment_{index}.wav"
+        wav_buffer.seek(0)
+        return self._transcribe(wav_buffer).text
+
+    @property
+    def pending(self):
+        """文字起こしが終わっていない区間の数"""
+        return sum(1 for future in self._futures if not future.done())
+
+    def finish(self):
+        """
+        残りの区間の文字起こしを開始し、全区間の完了を待って結果をつなげる
+        Returns:
+            Transcript（text: 全体の文字起こし、segments: 区間ごとの文字起こし）
+        """
+        if self._has_speech:
+            self._submit()
+        start = time.perf_counter()
+        deadline = orchestrator.current_deadline()
+        with tracing.span("transcribe_wait", segments=len(self._futures)):
+            try:
+                segments = [future.result(deadline.remaining() if deadline else None) for future in self._futures]
+            except FutureTimeout:
+                raise orchestrator.DeadlineExceeded("ターンの持ち時間内に文字起こしが終わりませんでした。") from None
+        self.wait_time = time.perf_counter() - start
+        return Transcript(stitch(segments), segments)
@@ -0,0 +1,131 @@
+"""
+会話履歴の非同期・逐次要約
+
+ConversationSummaryBufferMemory は、会話履歴が上限のトークン数を超えると
+応答の生成（predict）の中で要約のLLM呼び出しを行うため、ときどき数秒止まる。
+ここでは、メッセージごとのトークン数を保持して増えた分だけ数え、上限を超えた古いメッセージは
+直近のメッセージの枠から外して、応答を返した後に別スレッドで要約に取り込む。
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import BaseMessage, get_buffer_string
+from pydantic import PrivateAttr
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# 要約の生成（プロセス全体で共有）
+_executor = ThreadPoolExecutor(max_workers=2)
+
+
+class BackgroundSummaryMemory(ConversationSummaryBufferMemory):
+    """
+    要約を別スレッドで行う ConversationSummaryBufferMemory
+
+    直近のメッセージは max_token_limit 以内に収め、それより古いメッセージは要約に取り込むまでの間、
+    要約待ちのメッセージとしてそのまま履歴に含める（要約待ちが max_token_limit を超えた分は、
+    要約に取り込まれるまで履歴から外れる）。
+    """
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _counts: List[int] = PrivateAttr(default_factory=list)
+    _pending: List[BaseMessage] = PrivateAttr(default_factory=list)
+    _pending_counts: List[int] = PrivateAttr(default_factory=list)
+    _compacting: bool = PrivateAttr(default=False)
+    _future: Any = PrivateAttr(default=None)
+
+    def _count(self, message):
+        return self.llm.get_num_tokens_from_messages([message])
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """会話を履歴に追加し、上限を超えた場合は要約を別スレッドで開始"""
+        super(ConversationSummaryBufferMemory, self).save_context(inputs, outputs)
+        self.prune()
+
+    def prune(self) -> None:
+        """
+        直近のメッセージが上限を超えた分を要約待ちに移す（トークン数は追加されたメッセージのみ数える）
+        """
+        with tracing.span("memory.prune"):
+            with self._lock:
+                messages = self.chat_memory.messages
+                if len(self._counts) > len(messages):
+                    # 外部で履歴が変更された場合は数え直す
+                    self._counts = []
+                new_messages = messages[len(self._counts):]
+            counts = [self._count(message) for message in new_messages]
+
+            with self._lock:
+                self._counts.extend(counts)
+                total = sum(self._counts)
+                while total > self.max_token_limit and len(self.chat_memory.messages) > 1:
+                    self._pending.append(self.chat_memory.messages.pop(0))
+                    count = self._counts.pop(0)
+                    self._pending_counts.append(count)
+                    total -= count
+                start = bool(self._pending) and not self._compacting
+                if start:
+                    self._compacting = True
+            if start:
+                self._future = _executor.submit(tracing.bind(self._compact))
+
+    def _compact(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._compacting = False
+                    return
+                batch = list(self._pending)
+                summary = self.moving_summary_buffer
+            try:
+                with tracing.span("memory.compact", messages=len(batch)):
+                    summary = self.predict_new_summary(batch, summary)
+            except Exception:
+                # 要約待ちのまま残し、次に会話が追加されたときに再び試みる
+                logger.warning("会話履歴の要約に失敗しました", exc_info=True)
+                with self._lock:
+                    self._compacting = False
+                return
+            with self._lock:
+                # 要約中に履歴が消去された場合は、結果を捨てる
+                if self._pending[:len(batch)] != batch:
+                    continue
+                self.moving_summary_buffer = summary
+                del self._pending[:len(batch)]
+                del self._pending_counts[:len(batch)]
+
+    def wait(self, timeout=None):
+        """実行中の要約が終わるまで待つ（テスト・計測用）"""
+        future = self._future
+        if future is not None:
+            future.result(timeout)
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """要約・要約待ちのメッセージ・直近のメッセージを返す（要約の完了は待たない）"""
+        with self._lock:
+            pending, total = [], 0
+            # 要約待ちのメッセージは、新しいものから max_token_limit の範囲で含める
+            for message, count in zip(reversed(self._pending), reversed(self._pending_counts)):
+                total += count
+                if total > self.max_token_limit:
+                    break
+                pending.insert(0, message)
+            buffer = pending + list(self.chat_memory.messages)
+            if self.moving_summary_buffer != "":
+                buffer = [self.summary_message_cls(content=self.moving_summary_buffer)] + buffer
+        if self.return_messages:
+            return {self.memory_key: buffer}
+        return {self.memory_key: get_buffer_string(buffer, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)}
+
+    def clear(self) -> None:
+        """履歴と要約を消去"""
+        with self._lock:
+            self._counts = []
+            self._pending = []
+            self._pending_counts = []
+        super().clear()
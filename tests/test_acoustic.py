@@ -0,0 +1,71 @@
+import io
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+from acoustic import FS, score, to_mono
+
+PITCHES = (220, 330, 260, 400, 300, 350, 240, 280)
+
+
+def silence(seconds):
+    return np.zeros(int(FS * seconds), np.float32)
+
+
+def syllable(pitch, seconds=0.18):
+    t = np.arange(int(FS * seconds)) / FS
+    return (0.3 * np.sin(2 * np.pi * pitch * t) * np.hanning(len(t))).astype(np.float32)
+
+
+def utterance(pauses=None):
+    """pauses: 音節の番号 -> その後に入れる間（秒）"""
+    pauses = pauses or {}
+    parts = [silence(0.2)]
+    for i, pitch in enumerate(PITCHES):
+        parts += [syllable(pitch), silence(0.03), silence(pauses.get(i, 0))]
+    parts.append(silence(0.2))
+    return np.concatenate(parts)
+
+
+def wav(samples):
+    buffer = io.BytesIO()
+    wavfile.write(buffer, FS, samples)
+    return buffer.getvalue()
+
+
+def pause(pauses):
+    return score((utterance(), FS), (utterance(pauses), FS)).pause
+
+
+def test_same_timing_keeps_full_pause_score():
+    assert pause({}) == pytest.approx(100.0)
+
+
+def test_one_extra_pause_is_a_partial_penalty():
+    assert 60.0 < pause({3: 0.6}) < 90.0
+
+
+def test_penalty_grows_with_number_and_length_of_pauses():
+    one = pause({3: 0.6})
+    assert pause({1: 0.6, 5: 0.6}) < one
+    assert pause({3: 1.5}) < one
+
+
+def test_missed_pause_is_penalized():
+    reference = utterance({3: 0.6})
+    assert score((reference, FS), (utterance(), FS)).pause < 100.0
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.int32])
+def test_integer_input_is_normalized_by_dtype(dtype):
+    full = np.iinfo(dtype).max
+    samples = np.array([0, full // 2, -full // 2], dtype=dtype)
+    samples, fs = to_mono(wav(samples))
+    assert fs == FS
+    assert np.allclose(samples, [0.0, 0.5, -0.5], atol=1e-4)
+
+
+def test_uint8_input_is_centered():
+    samples, _ = to_mono(wav(np.array([128, 255, 0], dtype=np.uint8)))
+    assert np.allclose(samples, [0.0, 127 / 128, -1.0])
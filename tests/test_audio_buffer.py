@@ -0,0 +1,46 @@
+import numpy as np
+
+from audio_buffer import CaptureBuffer
+
+
+def ramp(start, stop):
+    # int16 に変換しても値を確認しやすい、0.01 刻みの音声
+    return (np.arange(start, stop, dtype=np.float32) * 0.01).reshape(-1, 1)
+
+
+def as_steps(buffer):
+    return np.round(buffer.to_array()[:, 0] / 32767 * 100).astype(int).tolist()
+
+
+def test_ring_buffer_wraps_around_in_order():
+    buffer = CaptureBuffer(fs=10, channels=1, max_seconds=1, initial_seconds=0.5, ring=True)
+    for start in range(0, 16, 4):
+        buffer.write(ramp(start, start + 4))
+    assert len(buffer) == 10
+    assert buffer.full
+    assert as_steps(buffer) == list(range(6, 16))
+
+
+def test_ring_buffer_keeps_tail_of_long_block():
+    buffer = CaptureBuffer(fs=10, channels=1, max_seconds=1, ring=True)
+    buffer.write(ramp(0, 3))
+    buffer.write(ramp(3, 28))
+    assert as_steps(buffer) == list(range(18, 28))
+
+
+def test_without_ring_drops_after_capacity():
+    buffer = CaptureBuffer(fs=10, channels=1, max_seconds=1, initial_seconds=0.5)
+    buffer.write(ramp(0, 8))
+    assert buffer.write(ramp(8, 14)) == 2
+    assert buffer.full
+    assert buffer.dropped == 4
+    assert as_steps(buffer) == list(range(10))
+
+
+def test_clipping_and_stereo():
+    buffer = CaptureBuffer(fs=10, channels=2, max_seconds=1)
+    buffer.write(np.array([[2.0, -2.0], [0.5, -0.5]], dtype=np.float32))
+    data = buffer.to_array()
+    assert data.dtype == np.int16
+    assert data[0].tolist() == [32767, -32768]
+    assert data[1].tolist() == [16383, -16383]
@@ -0,0 +1,109 @@
+import itertools
+import threading
+
+import pytest
+
+from prefetch import Problem, ProblemPrefetcher
+
+
+def counter():
+    numbers = itertools.count()
+    return lambda: f"problem {next(numbers)}"
+
+
+def test_problems_are_served_in_order():
+    prefetcher = ProblemPrefetcher(counter(), str.upper, depth=2)
+    assert [prefetcher.get() for _ in range(3)] == [Problem(f"problem {i}", f"PROBLEM {i}") for i in range(3)]
+    prefetcher.cancel()
+    assert prefetcher.hits + prefetcher.misses == 3
+
+
+def test_errors_are_raised_from_get_and_retried():
+    calls = itertools.count()
+
+    def generate():
+        if next(calls) == 0:
+            raise RuntimeError("API error")
+        return "recovered"
+
+    prefetcher = ProblemPrefetcher(generate, str.upper, retry_delay=0.01)
+    with pytest.raises(RuntimeError, match="API error"):
+        prefetcher.get()
+    assert prefetcher.get().text == "recovered"
+    prefetcher.cancel()
+
+
+def test_depth_zero_generates_on_demand():
+    prefetcher = ProblemPrefetcher(counter(), str.upper, depth=0)
+    assert prefetcher._thread is None
+    assert prefetcher.get().text == "problem 0"
+    assert prefetcher.get().text == "problem 1"
+    assert prefetcher.stats()["misses"] == 2
+
+
+def test_negative_depth_is_rejected():
+    with pytest.raises(ValueError):
+        ProblemPrefetcher(counter(), str.upper, depth=-1)
+
+
+class FakeDeck:
+    def __init__(self, texts):
+        self._texts = list(texts)
+
+    @property
+    def remaining(self):
+        return len(self._texts)
+
+    def next(self):
+        return Problem(self._texts.pop(0), b"") if self._texts else None
+
+
+def test_bank_is_used_before_generation():
+    generated = threading.Event()
+
+    def generate():
+        generated.set()
+        return "generated"
+
+    prefetcher = ProblemPrefetcher(generate, str.upper, depth=1, bank=FakeDeck(["a", "b", "c"]))
+    assert prefetcher.get().text == "a"
+    assert not generated.is_set()
+    assert [prefetcher.get().text for _ in range(3)] == ["b", "c", "generated"]
+    assert prefetcher.stats()["bank"] == 3
+    prefetcher.cancel()
+
+
+def test_cancelled_prefetcher_raises():
+    prefetcher = ProblemPrefetcher(counter(), str.upper)
+    prefetcher.cancel()
+    with pytest.raises(RuntimeError):
+        prefetcher.get()
+
+
+def test_cancel_while_waiting_raises():
+    release = threading.Event()
+
+    def generate():
+        release.wait(5)
+        return "late"
+
+    prefetcher = ProblemPrefetcher(generate, str.upper)
+    threading.Timer(0.1, prefetcher.cancel).start()
+    with pytest.raises(RuntimeError):
+        prefetcher.get()
+    release.set()
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_dead_producer_falls_back_to_inline_generation():
+    calls = itertools.count()
+
+    def generate():
+        if next(calls) == 0:
+            # Exception 以外の例外で先読みスレッドが終了する
+            raise SystemExit
+        return "inline"
+
+    prefetcher = ProblemPrefetcher(generate, str.upper)
+    assert prefetcher.get() == Problem("inline", "INLINE")
+    assert isinstance(prefetcher.error, SystemExit)
@@ -0,0 +1,48 @@
+import pytest
+
+from scoring import DELETE, EQUAL, INSERT, SUBSTITUTE, align, score, tokenize
+
+
+def test_identical_text():
+    result = score("The cat sat on the mat.", "the cat sat on the mat")
+    assert result.wer == 0.0
+    assert result.accuracy == 1.0
+    assert result.correct == 6
+
+
+def test_substitution_deletion_insertion():
+    result = score("the cat sat on the mat", "the cat sit on the big mat")
+    assert (result.substitutions, result.deletions, result.insertions) == (1, 0, 1)
+    assert result.wer == pytest.approx(2 / 6)
+    assert result.accuracy == pytest.approx(5 / 6)
+
+    result = score("the cat sat on the mat", "cat sat on the mat")
+    assert (result.substitutions, result.deletions, result.insertions) == (0, 1, 0)
+    assert result.problems() == ["「the」が抜けています（抜け）"]
+
+
+def test_alignment_is_deterministic():
+    assert align(["a", "b"], ["a", "c", "b"]) == [(EQUAL, 0, 0), (INSERT, None, 1), (EQUAL, 1, 2)]
+    assert align(["a", "b", "c"], ["a", "c"]) == [(EQUAL, 0, 0), (DELETE, 1, None), (EQUAL, 2, 1)]
+    assert align(["a"], ["b"]) == [(SUBSTITUTE, 0, 0)]
+
+
+def test_case_punctuation_and_accents_are_ignored():
+    assert score("Hello, World! Café?", "hello world cafe").wer == 0.0
+    assert score("Don’t stop", "don't stop").wer == 0.0
+
+
+def test_words_glued_by_punctuation_are_split():
+    assert [word for _, word in tokenize("Hello,world")] == ["hello", "world"]
+    assert [word for _, word in tokenize("wait--what")] == ["wait", "what"]
+    assert score("Hello world", "Hello,world").wer == 0.0
+
+
+def test_numbers_keep_decimal_point_and_separators():
+    assert [word for _, word in tokenize("3.5 and 1,000")] == ["35", "and", "1000"]
+    assert [word for _, word in tokenize("well-known")] == ["well-known"]
+
+
+def test_empty_reference():
+    assert score("", "").wer == 0.0
+    assert score("", "extra").wer == 1.0
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from time_stretch import stretch, stretch_pcm
+
+RATE = 24000
+
+
+def signal(seconds=1.0):
+    t = np.arange(int(RATE * seconds)) / RATE
+    return (0.3 * np.sin(2 * np.pi * 180 * t) * np.abs(np.sin(np.pi * t / 0.35))).astype(np.float32)
+
+
+@pytest.mark.parametrize("speed", [0.6, 0.8, 1.2, 1.5, 2.0])
+def test_output_length_follows_speed(speed):
+    samples = signal()
+    assert len(stretch(samples, speed, rate=RATE)) == round(len(samples) / speed)
+
+
+@pytest.mark.parametrize("speed", [0.8, 1.5])
+def test_block_processing_gives_same_length(speed):
+    samples = signal()
+    whole = stretch(samples, speed, rate=RATE)
+    blocks = stretch(samples, speed, rate=RATE, blocksize=2400)
+    assert len(blocks) == len(whole)
+
+
+def test_speed_one_is_unchanged():
+    samples = signal(0.2)
+    assert np.array_equal(stretch(samples, 1.0, rate=RATE)[:, 0], samples)
+
+
+def test_pcm_length():
+    pcm = np.int16(signal() * 32767).tobytes()
+    assert len(stretch_pcm(pcm, 1.5, rate=RATE)) == round(len(pcm) / 2 / 1.5) * 2
@@ -0,0 +1,58 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from tracing import Tracer
+
+
+def _now():
+    now = time.time()
+    return now, now + 0.001
+
+
+def run_turn(tracer, session, executor, ready, done):
+    tracer.begin_turn("test", session=session)
+    with tracer.span(f"{session}.main"):
+        executor.submit(tracing.bind(lambda: tracer.record(f"{session}.worker", *_now()))).result()
+        ready.wait(5)
+    record = tracer.end_turn()
+    done.append(record)
+
+
+def test_turn_contains_only_its_own_session():
+    tracer = Tracer()
+    ready = threading.Barrier(2)
+    done = []
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        threads = [threading.Thread(target=run_turn, args=(tracer, session, executor, ready, done)) for session in ("a", "b")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    for record in done:
+        names = {span["name"] for span in record["spans"]}
+        assert names == {f"{record['session']}.main", f"{record['session']}.worker"}
+        assert all("session" not in span for span in record["spans"])
+
+
+def test_recent_turns_filters_by_session():
+    tracer = Tracer()
+    for session in ("a", "b", "a"):
+        tracer.begin_turn("test", session=session)
+        tracer.end_turn()
+    assert [turn["session"] for turn in tracer.recent_turns(session="a")] == ["a", "a"]
+    assert len(tracer.recent_turns()) == 3
+
+
+def test_without_session_collects_all_overlapping_spans():
+    tracer = Tracer()
+    tracer.begin_turn("test")
+    other = threading.Thread(target=lambda: tracer.record("other", *_now()))
+    other.start()
+    other.join()
+    with tracer.span("main"):
+        pass
+    names = {span["name"] for span in tracer.end_turn()["spans"]}
+    assert names == {"main", "other"}
@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from tts_cache import TTSCache
+
+KEY = TTSCache.key("Hello.")
+
+
+class Producer:
+    """呼び出し回数を数え、release されるまで合成を終えない代替のTTS"""
+
+    def __init__(self, pcm=b"\x01\x02" * 8, fail_first=False):
+        self.pcm = pcm
+        self.fail_first = fail_first
+        self.calls = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            first = self.calls == 1
+        self.release.wait(5)
+        if first and self.fail_first:
+            raise RuntimeError("API error")
+        return self.pcm
+
+
+def fetch_concurrently(cache, producer, n=5):
+    results = [None] * n
+
+    def run(i):
+        try:
+            results[i] = cache.fetch(KEY, producer)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    # すべての要求が合成の完了を待つようになってから、合成を終える
+    time.sleep(0.1)
+    producer.release.set()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_misses_make_one_upstream_call(tmp_path):
+    cache = TTSCache(tmp_path)
+    producer = Producer()
+    assert fetch_concurrently(cache, producer) == [producer.pcm] * 5
+    assert producer.calls == 1
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["shared"] + stats["memory_hits"] == 4
+
+
+def test_waiters_retry_when_the_leader_fails(tmp_path):
+    cache = TTSCache(tmp_path)
+    producer = Producer(fail_first=True)
+    results = fetch_concurrently(cache, producer)
+    errors = [result for result in results if isinstance(result, Exception)]
+    assert len(errors) == 1 and str(errors[0]) == "API error"
+    assert results.count(producer.pcm) == 4
+    assert producer.calls == 2
+
+
+def test_cached_audio_is_returned_without_calling_the_producer(tmp_path):
+    cache = TTSCache(tmp_path)
+    cache.put(KEY, b"pcm")
+    assert cache.fetch(KEY, pytest.fail) == b"pcm"
+    # 再起動後もディスクから読み込める
+    assert TTSCache(tmp_path).fetch(KEY, pytest.fail) == b"pcm"
+
+
+def test_memory_limit_evicts_least_recently_used(tmp_path):
+    cache = TTSCache(tmp_path, memory_bytes=10)
+    keys = [TTSCache.key(str(i)) for i in range(3)]
+    for key in keys:
+        cache.put(key, b"abcd")
+    assert cache.stats()["memory_bytes"] <= 10
+    # メモリから外れた音声はディスクから読む
+    assert cache.get(keys[0]) == b"abcd"
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_disk_limit_removes_least_recently_used_files(tmp_path):
+    cache = TTSCache(tmp_path, max_bytes=10)
+    keys = [TTSCache.key(str(i)) for i in range(3)]
+    for key in keys:
+        cache.put(key, b"abcd")
+    assert cache.stats()["disk_bytes"] <= 10
+    assert not cache._path(keys[0]).exists()
+    assert cache._path(keys[2]).exists()
+    assert TTSCache(tmp_path, memory_bytes=0).get(keys[0]) is None
@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+
+from tts_stream import NullOutput, StreamingPlayer
+
+CHUNK = b"\x00\x01" * 480
+
+
+class BrokenOutput(NullOutput):
+    """最初の書き込みで失敗する音声出力（閉じられた出力デバイスなど）"""
+
+    def write(self, data):
+        raise OSError("device closed")
+
+
+def test_chunks_are_written_in_order():
+    output = NullOutput()
+    player = StreamingPlayer(output=output)
+    for _ in range(5):
+        player.feed(CHUNK)
+    player.close()
+    assert output.written == 5 * len(CHUNK)
+
+
+def test_odd_bytes_are_carried_to_the_next_chunk():
+    output = NullOutput()
+    player = StreamingPlayer(output=output)
+    player.feed(CHUNK[:3])
+    player.feed(CHUNK[3:])
+    player.close()
+    assert output.written == len(CHUNK)
+
+
+def test_write_error_is_raised_from_feed_and_close():
+    player = StreamingPlayer(output=BrokenOutput(), max_queue=2)
+    done = threading.Event()
+
+    def feed():
+        # キューの上限を超えて積んでも止まらない
+        with pytest.raises(OSError, match="device closed"):
+            for _ in range(100):
+                player.feed(CHUNK)
+        done.set()
+
+    thread = threading.Thread(target=feed)
+    thread.start()
+    thread.join(5)
+    assert done.is_set()
+    with pytest.raises(OSError, match="device closed"):
+        player.close()
@@ -0,0 +1,57 @@
+import numpy as np
+
+from vad import run_vad
+
+FS = 16000
+
+
+def tone(seconds, amplitude, freq=200):
+    t = np.arange(int(FS * seconds)) / FS
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def hum(seconds, rms, seed=0):
+    # 低い周波数の定常的な雑音（空調・換気扇など、ゼロ交差率が低い）
+    rng = np.random.default_rng(seed)
+    noise = tone(seconds, rms * np.sqrt(2), freq=100)
+    return noise + rng.normal(0, rms / 10, noise.size).astype(np.float32)
+
+
+def silence(seconds):
+    return np.zeros(int(FS * seconds), np.float32)
+
+
+def test_turn_ends_after_hangover():
+    data = np.concatenate([silence(0.5), tone(1.0, 0.3), silence(2.0)])
+    vad = run_vad(data, FS, hangover_ms=600)
+    assert vad.ended
+    assert abs(vad.end_ms - 2100) <= 40
+
+
+def test_no_speech_timeout():
+    vad = run_vad(silence(6.0), FS, no_speech_timeout_ms=5000)
+    assert vad.ended
+    assert not vad.speech_started
+    assert abs(vad.end_ms - 5000) <= 40
+
+
+def test_block_size_does_not_change_end():
+    data = np.concatenate([silence(0.5), tone(1.0, 0.3), silence(2.0)])
+    ends = {run_vad(data, FS, blocksize=blocksize).end_ms for blocksize in (160, 800, 2400, 4001)}
+    assert len(ends) == 1
+
+
+def test_stationary_noise_is_not_speech_forever():
+    # RMS 0.03 の定常雑音だけが続く場合も、フロアが雑音に追従してターンが終わる
+    vad = run_vad(hum(6.0, 0.03), FS, hangover_ms=600)
+    assert vad.ended
+    assert vad.end_ms <= 2500
+    assert vad.noise_floor >= 0.03 ** 2 / 2
+
+
+def test_speech_is_detected_over_stationary_noise():
+    data = np.concatenate([hum(2.5, 0.03), hum(1.0, 0.03, seed=1) + tone(1.0, 0.3, freq=300), hum(4.0, 0.03, seed=2)])
+    vad = run_vad(data, FS, hangover_ms=3000)
+    assert vad.ended
+    # 雑音の上の発話（2.5〜3.5秒）が続いている間は無音とみなさない
+    assert abs(vad.end_ms - 6500) <= 100
@@ -0,0 +1,208 @@
+"""
+音の高さを保ったまま再生速度を変える（WSOLA方式のタイムストレッチ）
+
+入力音声を短いフレームに区切り、出力側では一定間隔で重ね合わせる一方、
+入力側ではフレームの取り出し間隔を速度に応じて伸縮させる。
+取り出し位置は、直前のフレームと波形が最もよくつながる位置を探索して決める。
+ブロック単位で処理できるため、ストリーミング中の音声にも適用できる。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class WSOLAStretcher:
+    """
+    ブロック単位で処理できる WSOLA タイムストレッチ
+
+    Args:
+        speed: 再生速度（2.0で倍速、0.5で半分の速さ）
+        rate: サンプリングレート
+        channels: チャンネル数
+        frame_ms: フレームの長さ（ミリ秒）
+        tolerance_ms: 取り出し位置を探索する幅（ミリ秒）
+    """
+
+    def __init__(self, speed, rate=24000, channels=1, frame_ms=32, tolerance_ms=6):
+        self.speed = speed
+        self.channels = channels
+        self.frame_len = int(rate * frame_ms / 1000) // 2 * 2
+        self.synthesis_hop = self.frame_len // 2
+        self.analysis_hop = self.synthesis_hop * speed
+        self.tolerance = int(rate * tolerance_ms / 1000)
+        n = np.arange(self.frame_len)
+        # ホップ幅がフレーム長の半分のとき、重ね合わせると1になる窓
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * n / self.frame_len)).astype(np.float32)[:, None]
+
+        self._input = np.zeros((0, channels), dtype=np.float32)
+        # self._input[0] が入力全体の何サンプル目か
+        self._input_start = 0
+        self._input_total = 0
+        self._frame_index = 0
+        self._prev_pos = None
+        self._overlap = np.zeros((self.frame_len, channels), dtype=np.float32)
+
+    def _best_position(self, nominal):
+        lo = max(0, nominal - self.tolerance)
+        hi = nominal + self.tolerance
+        if self._prev_pos is None:
+            return nominal if nominal >= 0 else 0
+        # 直前のフレームの自然な続き（テンプレート）と最も相関の高い位置を探す
+        natural = self._prev_pos + self.synthesis_hop - self._input_start
+        template = self._input[natural:natural + self.frame_len].mean(axis=1)
+        region = self._input[lo - self._input_start:hi - self._input_start + self.frame_len].mean(axis=1)
+        if len(template) < self.frame_len or len(region) < self.frame_len:
+            return nominal
+        corr = np.correlate(region, template, mode="valid")
+        return lo + int(np.argmax(corr))
+
+    def _run(self, final=False):
+        outputs = []
+        end = self._input_start + len(self._input)
+        while True:
+            nominal = int(round(self._frame_index * self.analysis_hop))
+            if nominal >= self._input_total and final:
+                break
+            needed = nominal + self.tolerance + self.frame_len
+            if self._prev_pos is not None:
+                needed = max(needed, self._prev_pos + self.synthesis_hop + self.frame_len)
+            if needed > end:
+                break
+
+            pos = self._best_position(nominal)
+            offset = pos - self._input_start
+            frame = self._input[offset:offset + self.frame_len]
+            self._overlap += frame * self.window
+            outputs.append(self._overlap[:self.synthesis_hop].copy())
+            self._overlap = np.concatenate([self._overlap[self.synthesis_hop:], np.zeros_like(self._overlap[:self.synthesis_hop])])
+            self._prev_pos = pos
+            self._frame_index += 1
+
+            # 以降の探索で参照しない入力を破棄
+            keep_from = min(int(round(self._frame_index * self.analysis_hop)) - self.tolerance, pos + self.synthesis_hop)
+            drop = max(0, keep_from - self._input_start)
+            if drop:
+                self._input = self._input[drop:]
+                self._input_start += drop
+
+        if not outputs:
+            return np.zeros((0, self.channels), dtype=np.float32)
+        return np.concatenate(outputs)
+
+    def process(self, samples):
+        """
+        入力ブロックを処理し、出力できるところまでの音声を返す
+        Args:
+            samples: (サンプル数, チャンネル数) または (サンプル数,) の float 音声
+        Returns:
+            (サンプル数, チャンネル数) の float32 音声
+        """
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1, self.channels)
+        self._input = np.concatenate([self._input, samples])
+        self._input_total += len(samples)
+        return self._run()
+
+    def flush(self):
+        """残りの入力をすべて処理して返す"""
+        padding = np.zeros((self.frame_len * 2 + self.tolerance * 2, self.channels), dtype=np.float32)
+        self._input = np.concatenate([self._input, padding])
+        emitted = self._frame_index * self.synthesis_hop
+        out = np.concatenate([self._run(final=True), self._overlap])
+        # 重ね合わせ途中の分まで出力し、全体の長さを 入力の長さ/速度 に揃える
+        expected = int(round(self._input_total / self.speed))
+        return out[:max(0, expected - emitted)]
+
+
+def stretch(samples, speed, rate=24000, channels=1, blocksize=None):
+    """
+    音声全体のタイムストレッチ
+    Args:
+        samples: (サンプル数, チャンネル数) または (サンプル数,) の float 音声
+        speed: 再生速度
+        rate: サンプリングレート
+        channels: チャンネル数
+        blocksize: 指定した場合は、ブロックに分けて処理する（ストリーミング時の動作確認用）
+    Returns:
+        (サンプル数, チャンネル数) の float32 音声
+    """
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1, channels)
+    if speed == 1.0:
+        return samples
+    stretcher = WSOLAStretcher(speed, rate=rate, channels=channels)
+    if blocksize is None:
+        parts = [stretcher.process(samples)]
+    else:
+        parts = [stretcher.process(samples[i:i + blocksize]) for i in range(0, len(samples), blocksize)]
+    parts.append(stretcher.flush())
+    return np.concatenate(parts)
+
+
+def stretch_pcm(pcm, speed, rate=24000, channels=1):
+    """
+    16ビットPCMのバイト列のタイムストレッチ
+    """
+    samples = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768
+    stretched = stretch(samples, speed, rate=rate, channels=channels)
+    return np.clip(stretched * 32768, -32768, 32767).astype("<i2").tobytes()
+
+
+class StretchCache:
+    """
+    タイムストレッチ結果のキャッシュ（音声の内容と速度ごと、容量上限付きのLRU）
+
+    Args:
+        max_bytes: 保持するPCMデータの合計バイト数の上限
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pcm, speed, rate, channels):
+        """
+        キャッシュ済みであればその結果を、なければ計算して返す
+        """
+        key = (hashlib.blake2b(pcm, digest_size=16).digest(), speed, rate, channels)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        result = stretch_pcm(pcm, speed, rate=rate, channels=channels)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = result
+                self._bytes += len(result)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return result
+
+
+cache = StretchCache()
+
+
+def stretch_segment(audio, speed):
+    """
+    AudioSegment の再生速度を変更（音の高さは保持、結果はキャッシュ）
+    Args:
+        audio: AudioSegment
+        speed: 再生速度
+    Returns:
+        速度を変更した AudioSegment
+    """
+    if speed == 1.0:
+        return audio
+    if audio.sample_width != 2:
+        audio = audio.set_sample_width(2)
+    pcm = cache.get(audio.raw_data, speed, audio.frame_rate, audio.channels)
+    return audio._spawn(pcm)
@@ -0,0 +1,292 @@
+"""
+処理時間の計測（トレース）
+
+録音・文字起こし・LLM・音声合成・デコード・再生などの処理を「スパン」として記録し、
+会話の1ターンごとにまとめてJSONL形式で保存する。
+保存したログから処理ごとの中央値（p50）・95パーセンタイル（p95）を集計できる。
+
+使い方（集計）:
+    python tracing.py logs/trace.jsonl
+"""
+import argparse
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+# 処理時間を記録するか（TRACE=0 で無効）
+TRACE = os.environ.get("TRACE", "1") == "1"
+# ターンごとの記録の保存先（空文字列の場合は保存しない）
+TRACE_FILE = os.environ.get("TRACE_FILE", "logs/trace.jsonl")
+
+# Streamlit の再実行・停止は例外で実現されているため、エラーとして扱わない
+_CONTROL_FLOW = ("RerunException", "StopException")
+
+# スパンを記録したセッション（別スレッドの処理には bind() で引き継ぐ）
+_session = contextvars.ContextVar("trace_session", default=None)
+
+
+def bind(fn):
+    """
+    呼び出し元のセッションを引き継いで fn を実行する関数を返す（別スレッド・スレッドプールで実行する処理に使う）
+    Args:
+        fn: 別スレッドで実行する関数
+    Returns:
+        fn と同じ引数で呼び出せる関数（同時に複数のスレッドから呼び出してもよい）
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+class Tracer:
+    """
+    スパンの記録と、ターン単位での集約・保存
+
+    スパンはどのスレッドからでも記録でき、ターンの開始から終了までの間に
+    同じセッションで実行されたスパン（先読みなど別スレッドの処理を含む）がそのターンにまとめられる。
+    別スレッドの処理をセッションに結び付けるには、スレッドで実行する関数を bind() で包む。
+
+    Args:
+        path: ターンごとの記録を追記するJSONLファイル（None の場合は保存しない）
+        enabled: 記録するか
+        max_turns: メモリ上に保持するターン数
+        max_spans: メモリ上に保持するスパン数
+    """
+
+    def __init__(self, path=None, enabled=True, max_turns=50, max_spans=5000):
+        self.path = Path(path) if path else None
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=max_spans)
+        self._turns = deque(maxlen=max_turns)
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+
+    def record(self, name, start, end, **attrs):
+        """
+        開始・終了時刻が分かっている処理をスパンとして記録
+        Args:
+            name: 処理の名前
+            start: 開始時刻（time.time()）
+            end: 終了時刻（time.time()）
+            attrs: 付加情報
+        """
+        if not self.enabled:
+            return
+        span = {"name": name, "start": start, "end": end, "thread": threading.current_thread().name, "session": _session.get(), **attrs}
+        with self._lock:
+            self._spans.append(span)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        with ブロックの実行時間をスパンとして記録
+        Args:
+            name: 処理の名前
+            attrs: 付加情報（with で受け取った辞書に、ブロック内から追加もできる）
+        """
+        start = time.time()
+        try:
+            yield attrs
+        except BaseException as e:
+            if type(e).__name__ not in _CONTROL_FLOW:
+                attrs["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(name, start, time.time(), **attrs)
+
+    def traced(self, name=None):
+        """関数の実行時間をスパンとして記録するデコレータ"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name or func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def begin_turn(self, label, session=None):
+        """
+        呼び出し元のスレッドでターンを開始
+        Args:
+            label: ターンの種類（モード名など）
+            session: セッションID（指定した場合は、同じセッションのスパンのみターンにまとめる）
+        """
+        _session.set(session)
+        self._local.turn = (next(self._ids), label, time.time(), session)
+
+    def end_turn(self):
+        """
+        ターンを終了し、その間のスパンをまとめて保存
+        Returns:
+            ターンの記録（ターンが開始されていない場合は None）
+        """
+        turn = getattr(self._local, "turn", None)
+        if turn is None or not self.enabled:
+            return None
+        self._local.turn = None
+        turn_id, label, start, session = turn
+        end = time.time()
+        with self._lock:
+            spans = [
+                span for span in self._spans
+                if span["start"] < end and span["end"] > start and (session is None or span["session"] == session)
+            ]
+
+        record = {
+            "turn": turn_id,
+            "label": label,
+            "session": session,
+            "time": start,
+            "duration": end - start,
+            "spans": [
+                {
+                    **{key: value for key, value in span.items() if key not in ("start", "end", "session")},
+                    "offset": span["start"] - start,
+                    "duration": span["end"] - span["start"],
+                }
+                for span in sorted(spans, key=lambda span: span["start"])
+            ],
+        }
+        with self._lock:
+            self._turns.append(record)
+        if self.path is not None:
+            self._write(record)
+        return record
+
+    def _write(self, record):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def recent_turns(self, n=None, session=None):
+        """直近 n ターンの記録（古い順、n が None の場合は保持しているすべて、session を指定した場合はそのセッションのみ）"""
+        with self._lock:
+            turns = [turn for turn in self._turns if session is None or turn["session"] == session]
+        return turns[-n:] if n else turns
+
+
+def percentile(values, q):
+    """値のリストの q パーセンタイル（線形補間）"""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def rollup(turns):
+    """
+    処理ごとの実行時間の集計
+    Args:
+        turns: ターンの記録のリスト
+    Returns:
+        {処理の名前: {"count", "p50", "p95", "max"}}（ターン全体は "turn"）
+    """
+    durations = {}
+    for turn in turns:
+        durations.setdefault("turn", []).append(turn["duration"])
+        for span in turn["spans"]:
+            durations.setdefault(span["name"], []).append(span["duration"])
+    return {
+        name: {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "max": max(values),
+        }
+        for name, values in durations.items()
+    }
+
+
+def load(path):
+    """JSONLファイルからターンの記録を読み込む"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def waterfall_spec(turns):
+    """直近のターンの処理をウォーターフォール（横棒）で表示する Vega-Lite の仕様"""
+    rows = [
+        {
+            "turn": f"#{turn['turn']} {turn['label']}",
+            "name": span["name"],
+            "start": span["offset"],
+            "end": span["offset"] + span["duration"],
+            "duration": round(span["duration"], 3),
+        }
+        for turn in turns
+        for span in turn["spans"]
+    ]
+    return {
+        "data": {"values": rows},
+        "mark": {"type": "bar", "cornerRadius": 2},
+        "encoding": {
+            "row": {"field": "turn", "type": "nominal", "title": None, "sort": None},
+            "y": {"field": "name", "type": "nominal", "title": None, "sort": None},
+            "x": {"field": "start", "type": "quantitative", "title": "秒"},
+            "x2": {"field": "end"},
+            "color": {"field": "name", "type": "nominal", "legend": None},
+            "tooltip": [
+                {"field": "name", "type": "nominal"},
+                {"field": "start", "type": "quantitative", "format": ".2f"},
+                {"field": "duration", "type": "quantitative", "format": ".3f"},
+            ],
+        },
+    }
+
+
+def render_sidebar(n=5, session=None):
+    """直近 n ターンの処理時間と集計をサイドバーに表示（session を指定した場合はそのセッションのターンのみ）"""
+    import streamlit as st
+
+    turns = tracer.recent_turns(n, session)
+    if not turns:
+        st.sidebar.caption("まだ記録がありません。")
+        return
+    st.sidebar.vega_lite_chart(waterfall_spec(turns), use_container_width=True)
+    st.sidebar.dataframe([
+        {"処理": name, "回数": stats["count"], "p50 (ms)": round(stats["p50"] * 1000), "p95 (ms)": round(stats["p95"] * 1000)}
+        for name, stats in rollup(tracer.recent_turns(session=session)).items()
+    ], hide_index=True)
+
+
+# プロセス全体で共有するトレーサー
+tracer = Tracer(TRACE_FILE or None, enabled=TRACE)
+span = tracer.span
+record = tracer.record
+traced = tracer.traced
+begin_turn = tracer.begin_turn
+end_turn = tracer.end_turn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="処理時間の集計")
+    parser.add_argument("path", nargs="?", default=TRACE_FILE or "logs/trace.jsonl")
+    parser.add_argument("--last", type=int, default=0, help="直近のターンのみ集計（0で全件）")
+    args = parser.parse_args()
+
+    turns = load(args.path)
+    if args.last:
+        turns = turns[-args.last:]
+    print(f"{len(turns)} ターン")
+    print(f"{'処理':<24}{'回数':>6}{'p50 (ms)':>12}{'p95 (ms)':>12}{'最大 (ms)':>12}")
+    for name, stats in sorted(rollup(turns).items(), key=lambda item: -item[1]["p95"]):
+        print(f"{name:<24}{stats['count']:>6}{stats['p50'] * 1000:>12.1f}{stats['p95'] * 1000:>12.1f}{stats['max'] * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+読み上げ音声のキャッシュ
+
+(テキスト, モデル, 声, 形式, 接続先) のハッシュをキーに、デコード済みのPCMデータを保存する。
+よく使う音声はメモリ上に、それ以外はディスク上に保持し、どちらも容量上限を
+超えたら最も長く使われていないものから削除する（LRU）。
+同じキーの合成が同時に要求された場合は、APIの呼び出しを1回にまとめる。
+キャッシュは最初に使うときに生成する（読み込み時にはディレクトリの作成・ファイルの走査をしない）。
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# 読み上げ音声をキャッシュするか（TTS_CACHE=0 で無効）
+TTS_CACHE = os.environ.get("TTS_CACHE", "1") == "1"
+# キャッシュの保存先
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", "audio/cache")
+
+
+class _Flight:
+    """合成中のキー（同じキーの要求は、この合成の完了を待つ）"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class TTSCache:
+    """
+    メモリとディスクの2段構成の、容量上限付きLRUキャッシュ
+
+    Args:
+        directory: ディスク上の保存先
+        max_bytes: ディスク上に保持するPCMデータの合計バイト数の上限
+        memory_bytes: メモリ上に保持するPCMデータの合計バイト数の上限
+        chunk_size: キャッシュから返す際のチャンクのバイト数
+    """
+
+    def __init__(self, directory="audio/cache", max_bytes=256 * 1024 * 1024, memory_bytes=32 * 1024 * 1024,
+                 chunk_size=4800):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._inflight = {}
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.shared = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+        # 既存のファイルを、更新日時の古い順（使われていない順）に登録
+        files = sorted(self.directory.glob("*/*.pcm"), key=lambda path: path.stat().st_mtime)
+        for path in files:
+            size = path.stat().st_size
+            self._disk[path.stem] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    @staticmethod
+    def key(text, model="tts-1", voice="alloy", format="pcm", base_url=""):
+        """
+        キャッシュのキー
+        Args:
+            base_url: APIの接続先（代替サーバーなど、接続先が違えば別の音声として扱う）
+        """
+        source = "\0".join([str(base_url), model, voice, format, text])
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return self.directory / key[:2] / f"{key}.pcm"
+
+    def _remember(self, key, pcm):
+        # 呼び出し元でロックを取得済み
+        if len(pcm) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = pcm
+        self._memory_size += len(pcm)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _evict_disk(self):
+        # 呼び出し元でロックを取得済み（初期化時を除く）
+        while self._disk_size > self.max_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key):
+        """
+        キャッシュ済みのPCMデータを返す（なければ None）
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                pcm = self._memory[key]
+                self.bytes_saved += len(pcm)
+                return pcm
+            if key not in self._disk:
+                return None
+            self._disk.move_to_end(key)
+
+        path = self._path(key)
+        try:
+            pcm = path.read_bytes()
+            # 更新日時を使用日時として扱い、再起動後もLRUの順序を保つ
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                if key in self._disk:
+                    self._disk_size -= self._disk.pop(key)
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+            self.bytes_saved += len(pcm)
+            self._remember(key, pcm)
+        return pcm
+
+    def put(self, key, pcm):
+        """PCMデータを保存"""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 書き込み途中のファイルを読まれないよう、一時ファイルに書いてから置き換える
+        temp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        temp_path.write_bytes(pcm)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            if key in self._disk:
+                self._disk_size -= self._disk.pop(key)
+            self._disk[key] = len(pcm)
+            self._disk_size += len(pcm)
+            self._remember(key, pcm)
+            self._evict_disk()
+
+    def _chunks(self, pcm):
+        for start in range(0, len(pcm), self.chunk_size):
+            yield pcm[start:start + self.chunk_size]
+
+    def stream(self, key, producer):
+        """
+        キャッシュ済みであればそのPCMデータを、なければ producer から取得しながら返す
+        Args:
+            key: キャッシュのキー
+            producer: PCMチャンクのイテラブルを返す関数（キャッシュにない場合のみ呼ばれる）
+        """
+        while True:
+            pcm = self.get(key)
+            if pcm is not None:
+                yield from self._chunks(pcm)
+                return
+
+            with self._lock:
+                flight = self._inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._inflight[key] = _Flight()
+            if leader:
+                break
+
+            # 同じキーを合成中のため、その完了を待って結果を共有
+            flight.done.wait()
+            if flight.result is not None:
+                with self._lock:
+                    self.shared += 1
+                    self.bytes_saved += len(flight.result)
+                yield from self._chunks(flight.result)
+                return
+            # 合成が失敗・中断された場合は、改めて自分で合成する
+
+        with self._lock:
+            self.misses += 1
+        chunks = []
+        try:
+            for chunk in producer():
+                chunks.append(chunk)
+                yield chunk
+            pcm = b"".join(chunks)
+            self.put(key, pcm)
+            flight.result = pcm
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+
+    def fetch(self, key, producer):
+        """
+        stream() の一括取得版
+        Args:
+            key: キャッシュのキー
+            producer: PCMデータ（バイト列）を返す関数
+        Returns:
+            PCMデータ
+        """
+        return b"".join(self.stream(key, lambda: [producer()]))
+
+    def stats(self):
+        """キャッシュの効果（ヒット数・ミス数・ヒット率・API呼び出しを省けたバイト数）"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits + self.shared
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "shared": self.shared,
+                "misses": self.misses,
+                "hit_ratio": hits / total if total else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "memory_bytes": self._memory_size,
+                "disk_bytes": self._disk_size,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """プロセス全体で共有するキャッシュ（最初の呼び出し時に生成、TTS_CACHE が無効の場合は None）"""
+    global _cache
+    if not TTS_CACHE:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = TTSCache(TTS_CACHE_DIR)
+        return _cache
@@ -0,0 +1,234 @@
+"""
+ストリーミング音声合成・再生
+
+TTSの応答を生のPCM形式で受け取り、届いた分から順に再生する。
+合成の完了を待たずに再生を始められるため、最初の音声が聞こえるまでの時間が短くなる。
+"""
+import queue
+import threading
+import time
+
+import numpy as np
+
+import orchestrator
+import playback
+import tracing
+import tts_cache
+from time_stretch import WSOLAStretcher
+
+# OpenAI TTS の pcm 形式は 24kHz・16ビット・モノラル（リトルエンディアン）
+PCM_RATE = 24000
+PCM_WIDTH = 2
+PCM_CHANNELS = 1
+# 再生キューが空くのを待つ間に、再生スレッドの異常終了を確認する間隔（秒）
+POLL_INTERVAL = 0.5
+
+
+def iter_speech_pcm(client, text, model="tts-1", voice="alloy", chunk_size=4800, cache=None, deadline=None):
+    """
+    TTSの応答をPCMのチャンクとして順に返す
+    Args:
+        client: OpenAIクライアント
+        text: 読み上げるテキスト
+        model: TTSモデル
+        voice: 声の種類
+        chunk_size: 1回に読み込むバイト数（4800バイトで100ミリ秒）
+        cache: TTSCache（未指定の場合は tts_cache.get_cache()、False の場合はキャッシュを使わない）
+        deadline: ターンの持ち時間（別スレッドから呼ぶ場合に渡す、未指定の場合は呼び出し元のスレッドの持ち時間）
+    """
+    def open_response():
+        return client.audio.speech.with_streaming_response.create(
+            model=model,
+            voice=voice,
+            input=text,
+            response_format="pcm"
+        ).__enter__()
+
+    def request():
+        with tracing.span("speech.create", format="pcm", chars=len(text)) as attrs:
+            start = time.time()
+            # 応答の開始（ヘッダーの受信）までを時間制限・ヘッジの対象とし、使わなかった応答は閉じる
+            response = orchestrator.call("speech", open_response, orchestrator.TTS, deadline=deadline,
+                                         discard=lambda unused: unused.close())
+            try:
+                for chunk in response.iter_bytes(chunk_size):
+                    if "first_byte" not in attrs:
+                        attrs["first_byte"] = time.time() - start
+                    yield chunk
+            finally:
+                response.close()
+
+    if cache is None:
+        cache = tts_cache.get_cache()
+    if not cache:
+        yield from request()
+        return
+    yield from cache.stream(cache.key(text, model, voice, "pcm", client.base_url), request)
+
+
+class PyAudioOutput:
+    """PyAudioによる音声出力"""
+
+    def open(self, rate, channels, width):
+        import pyaudio
+
+        self._p = pyaudio.PyAudio()
+        self._stream = self._p.open(format=self._p.get_format_from_width(width),
+                                    channels=channels,
+                                    rate=rate,
+                                    output=True)
+
+    def write(self, data):
+        self._stream.write(data)
+
+    def close(self):
+        self._stream.stop_stream()
+        self._stream.close()
+        self._p.terminate()
+
+
+class NullOutput:
+    """
+    何も再生しない音声出力（テスト・計測用）
+
+    realtime=True の場合は、実際の再生と同じだけ時間をかけて書き込む。
+    """
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.written = 0
+        self.first_write_at = None
+
+    def open(self, rate, channels, width):
+        self._bytes_per_sec = rate * channels * width
+
+    def write(self, data):
+        if self.first_write_at is None:
+            self.first_write_at = time.perf_counter()
+        self.written += len(data)
+        if self.realtime:
+            time.sleep(len(data) / self._bytes_per_sec)
+
+    def close(self):
+        pass
+
+
+class StreamingPlayer:
+    """
+    キューに積まれたPCMチャンクを別スレッドで順に再生するプレーヤー
+
+    Args:
+        rate: サンプリングレート
+        speed: 再生速度（音の高さは保ったまま、届いたチャンクごとに速度を変更）
+        output: 音声出力（未指定の場合は共有の再生エンジン）
+        max_queue: キューに積めるチャンク数の上限
+
+    Attributes:
+        error: 再生スレッドを終了させた例外（出力デバイスが閉じられた場合など、feed・close で送出する）
+    """
+
+    def __init__(self, rate=PCM_RATE, speed=1.0, output=None, max_queue=64):
+        self.output = output or playback.EngineOutput()
+        self.output.open(rate, PCM_CHANNELS, PCM_WIDTH)
+        self._stretcher = WSOLAStretcher(speed, rate=rate, channels=PCM_CHANNELS) if speed != 1.0 else None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._remainder = b""
+        self.first_audio_at = None
+        self.error = None
+        self._thread = threading.Thread(target=tracing.bind(self._run), daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        started = None
+        try:
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                if self.first_audio_at is None:
+                    self.first_audio_at = time.perf_counter()
+                    started = time.time()
+                self.output.write(chunk)
+        except BaseException as e:
+            self.error = e
+            # 積まれた分を捨て、キューが空くのを待っている feed を戻す
+            self._drain()
+        finally:
+            try:
+                self.output.close()
+            except Exception as e:
+                self.error = self.error or e
+            # 最初の音声を書き込んでから再生し終えるまで
+            if started is not None:
+                tracing.record("playback", started, time.time())
+
+    def feed(self, chunk):
+        """
+        PCMチャンクを再生キューに積む（サンプルの途中で切れた分は次回に回す）
+        """
+        data = self._remainder + chunk
+        usable = len(data) - len(data) % (PCM_WIDTH * PCM_CHANNELS)
+        self._remainder = data[usable:]
+        if usable:
+            self._put(data[:usable])
+
+    def _put(self, data, final=False):
+        if self._stretcher is not None:
+            samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768
+            stretched = self._stretcher.flush() if final else self._stretcher.process(samples)
+            data = np.clip(stretched * 32768, -32768, 32767).astype("<i2").tobytes()
+        if data:
+            self._enqueue(data)
+
+    def _enqueue(self, item):
+        # 再生スレッドが終了している場合は、キューが空くのを待たずにその例外を送出する
+        while True:
+            if self.error is not None:
+                raise self.error
+            if not self._thread.is_alive():
+                raise RuntimeError("再生スレッドは終了しています。")
+            try:
+                self._queue.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def _drain(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def close(self):
+        """キューに積んだ分を再生し終えるまで待つ（再生に失敗していた場合はその例外を送出）"""
+        if self._stretcher is not None:
+            self._put(b"", final=True)
+        self._enqueue(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def speak_streaming(client, text, speed=1.0, model="tts-1", voice="alloy", output=None):
+    """
+    テキストを合成しながら読み上げる
+    Args:
+        client: OpenAIクライアント
+        text: 読み上げるテキスト
+        speed: 再生速度
+        model: TTSモデル
+        voice: 声の種類
+        output: 音声出力（未指定の場合は共有の再生エンジン）
+    Returns:
+        読み上げた音声のPCMデータ
+    """
+    player = StreamingPlayer(speed=speed, output=output)
+    chunks = []
+    try:
+        for chunk in iter_speech_pcm(client, text, model=model, voice=voice):
+            chunks.append(chunk)
+            player.feed(chunk)
+    finally:
+        player.close()
+    return b"".join(chunks)
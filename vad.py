@@ -0,0 +1,212 @@
+"""
+音声区間検出（VAD）
+
+短いフレーム単位のエネルギー・ゼロ交差率から発話区間を判定し、
+話者が話し終えたタイミング（ターン終了）を検出する。
+"""
+import wave
+from collections import deque
+
+import numpy as np
+
+
+class VoiceActivityDetector:
+    """
+    フレーム単位のエネルギー/ゼロ交差率による発話区間検出器
+
+    ブロック（任意の長さの音声データ）を順次 process() に渡すと、
+    内部で frame_ms ごとのフレームに分割して判定する。
+    無音時間はフレーム数から実時間で積算するため、ブロック長に依存しない。
+
+    Args:
+        fs: サンプリングレート
+        frame_ms: 判定フレームの長さ（ミリ秒）
+        hangover_ms: 発話後、この時間だけ無音が続いたらターン終了とみなす
+        min_speech_ms: ターン終了と判定するために必要な発話時間の合計
+        no_speech_timeout_ms: 発話が一度も始まらない場合に録音を打ち切るまでの時間
+        threshold_db: ノイズフロアから何dB大きければ発話とみなすか
+        amplitude_threshold: 発話とみなすRMSの絶対下限値
+        zcr_max: エネルギーが閾値付近のフレームで、発話とみなすゼロ交差率の上限
+        noise_alpha: ノイズフロアの追従係数（0〜1、大きいほど速く追従）
+        noise_window_ms: 発話中もノイズフロアを追従させる、フレームのパワーの最小値をとる時間
+            （定常的な雑音はこの時間の最小値がノイズフロアを上回るため、発話と判定され続けずに済む）
+    """
+
+    # noise_window_ms を分割する区間の数（区間ごとの最小値を保持して、時間窓の最小値を求める）
+    NOISE_SUBWINDOWS = 5
+
+    def __init__(self, fs=48000, frame_ms=20, hangover_ms=600, min_speech_ms=150,
+                 no_speech_timeout_ms=5000, threshold_db=10.0, amplitude_threshold=0.01,
+                 zcr_max=0.35, noise_alpha=0.05, noise_window_ms=1500):
+        self.fs = fs
+        self.frame_ms = frame_ms
+        self.frame_len = max(1, int(fs * frame_ms / 1000))
+        self.hangover_ms = hangover_ms
+        self.min_speech_ms = min_speech_ms
+        self.no_speech_timeout_ms = no_speech_timeout_ms
+        self.threshold_db = threshold_db
+        self.amplitude_threshold = amplitude_threshold
+        self.zcr_max = zcr_max
+        self.noise_alpha = noise_alpha
+        self._subwindow_frames = max(1, int(noise_window_ms / frame_ms / self.NOISE_SUBWINDOWS))
+        self.reset()
+
+    def reset(self):
+        """状態を初期化"""
+        self._remainder = np.zeros(0, dtype=np.float32)
+        # ノイズフロアはRMSの二乗（パワー）で保持
+        self.noise_floor = (self.amplitude_threshold / 4) ** 2
+        # 直近の noise_window_ms のパワーの最小値（区間ごと）
+        self._minima = deque(maxlen=self.NOISE_SUBWINDOWS)
+        self._minimum = np.inf
+        self._subwindow_count = 0
+        self.speech_started = False
+        self.speech_ms = 0.0
+        self.silence_ms = 0.0
+        self.elapsed_ms = 0.0
+        self.ended = False
+        # ターン終了と判定したフレームの時刻（ミリ秒）
+        self.end_ms = None
+        self.in_speech = False
+
+    def hold(self):
+        """
+        発話が始まる前の無音時間をリセット（読み上げを聞いている間などに、録音が打ち切られないようにする）
+        """
+        if not self.speech_started:
+            self.silence_ms = 0.0
+
+    @property
+    def silence_progress(self):
+        """ターン終了までの無音の進み具合（0.0〜1.0）"""
+        if self.speech_started:
+            return min(1.0, self.silence_ms / self.hangover_ms)
+        return min(1.0, self.silence_ms / self.no_speech_timeout_ms)
+
+    def frame_features(self, frames):
+        """
+        フレームごとの特徴量を一括計算
+        Args:
+            frames: (フレーム数, frame_len) のモノラル音声
+        Returns:
+            (パワー, ゼロ交差率) の配列のタプル
+        """
+        power = np.mean(frames * frames, axis=1)
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frames.shape[1] - 1 or 1)
+        return power, zcr
+
+    def _track_minimum(self, p):
+        """
+        直近の noise_window_ms のパワーの最小値を更新
+        Returns:
+            時間窓の最小値（窓が埋まるまでは None）
+        """
+        self._minimum = min(self._minimum, p)
+        self._subwindow_count += 1
+        if self._subwindow_count >= self._subwindow_frames:
+            self._minima.append(self._minimum)
+            self._minimum = np.inf
+            self._subwindow_count = 0
+        if len(self._minima) < self._minima.maxlen:
+            return None
+        return min(min(self._minima), self._minimum)
+
+    def process(self, block):
+        """
+        音声ブロックを判定し、ターンが終了したかを返す
+        Args:
+            block: (サンプル数,) または (サンプル数, チャンネル数) の float 音声
+        Returns:
+            ターン終了を検出済みであれば True
+        """
+        if self.ended:
+            return True
+
+        block = np.asarray(block, dtype=np.float32)
+        if block.ndim == 2:
+            block = block.mean(axis=1)
+        samples = np.concatenate([self._remainder, block]) if self._remainder.size else block
+
+        n_frames = samples.size // self.frame_len
+        used = n_frames * self.frame_len
+        self._remainder = samples[used:].copy()
+        if n_frames == 0:
+            return False
+
+        power, zcr = self.frame_features(samples[:used].reshape(n_frames, self.frame_len))
+        abs_floor = self.amplitude_threshold ** 2
+        ratio = 10 ** (self.threshold_db / 10)
+        # ノイズフロア+6dBを超えるフレームは、ゼロ交差率を問わず発話とみなす
+        strong = 10 ** ((self.threshold_db + 6) / 10)
+
+        for p, z in zip(power, zcr):
+            self.elapsed_ms += self.frame_ms
+            floor = self.noise_floor
+            minimum = self._track_minimum(p)
+            if minimum is not None and minimum > floor:
+                # 一定時間、パワーがフロアを下回らない（定常的な雑音）場合は、発話中でもフロアを引き上げる
+                self.noise_floor = floor = minimum
+            is_speech = p >= abs_floor and p >= floor * ratio and (p >= floor * strong or z <= self.zcr_max)
+
+            if is_speech:
+                self.in_speech = True
+                self.speech_started = True
+                self.speech_ms += self.frame_ms
+                self.silence_ms = 0.0
+            else:
+                self.in_speech = False
+                self.silence_ms += self.frame_ms
+                # 非発話フレームでのみノイズフロアを更新（下降は即時に追従）
+                if p < floor:
+                    self.noise_floor = p
+                else:
+                    self.noise_floor = (1 - self.noise_alpha) * floor + self.noise_alpha * p
+
+            if self.speech_started and self.speech_ms >= self.min_speech_ms:
+                if self.silence_ms >= self.hangover_ms:
+                    self.ended = True
+            elif self.silence_ms >= self.no_speech_timeout_ms:
+                self.ended = True
+
+            if self.ended:
+                self.end_ms = self.elapsed_ms
+                return True
+
+        return False
+
+
+def run_vad(data, fs, blocksize=2400, **kwargs):
+    """
+    録音済みの音声データに対してVADを実行（オフライン検証用）
+    Args:
+        data: (サンプル数,) または (サンプル数, チャンネル数) の float 音声
+        fs: サンプリングレート
+        blocksize: 1回に渡すブロックのサンプル数（録音時の読み込み単位を再現）
+        kwargs: VoiceActivityDetector に渡す設定
+    Returns:
+        判定に使用した VoiceActivityDetector（end_ms でターン終了時刻を確認できる）
+    """
+    vad = VoiceActivityDetector(fs=fs, **kwargs)
+    for start in range(0, len(data), blocksize):
+        if vad.process(data[start:start + blocksize]):
+            break
+    return vad
+
+
+def run_vad_on_wav(file_path, blocksize=2400, **kwargs):
+    """
+    WAVファイルに対してVADを実行（オフライン検証用）
+    Args:
+        file_path: 16ビットPCMのWAVファイルのパス
+        blocksize: 1回に渡すブロックのサンプル数
+        kwargs: VoiceActivityDetector に渡す設定
+    Returns:
+        判定に使用した VoiceActivityDetector
+    """
+    with wave.open(str(file_path), 'rb') as wav_file:
+        fs = wav_file.getframerate()
+        channels = wav_file.getnchannels()
+        frames = wav_file.readframes(wav_file.getnframes())
+    data = np.frombuffer(frames, dtype=np.int16).reshape(-1, channels).astype(np.float32) / 32768
+    return run_vad(data, fs, blocksize=blocksize, **kwargs)